@@ -0,0 +1,57 @@
+"""Exact handling of money amounts, which are stored as integer pence."""
+from sqlalchemy import Integer
+from sqlalchemy.types import TypeDecorator
+
+
+PENCE = 100
+
+
+class Amount(TypeDecorator):
+    """Column type for amounts in integer pence.
+
+    The values are plain integers, so that sums and comparisons in SQL are exact. The type only marks the columns
+    whose values are converted to pounds in the JSON output.
+    """
+
+    impl = Integer
+    cache_ok = True
+
+
+def parse_amount(value: str) -> int:
+    """Parse the decimal ``value`` in pounds into pence, without rounding.
+
+    :param value: The amount with an optional sign and at most two decimal places
+    :type value: str
+    :return: The amount in pence
+    :rtype: int
+    :raises ValueError: If the ``value`` is not a decimal number with at most two decimal places
+    """
+    pounds, _, pence = value.partition('.')
+    if len(pence) == 2 and pence.isdigit():
+        return int(pounds + pence)
+    pounds, _, pence = value.strip().partition('.')
+    sign = 1
+    if pounds[:1] == '-':
+        sign = -1
+        pounds = pounds[1:]
+    elif pounds[:1] == '+':
+        pounds = pounds[1:]
+    if len(pence) > 2 or not (pounds + pence).isdigit():
+        raise ValueError(f'Invalid amount {value}')
+    return sign * (int(pounds or '0') * PENCE + int(pence.ljust(2, '0')))
+
+
+def to_pounds(amount: int) -> float:
+    """Convert the ``amount`` in pence into pounds for the JSON output.
+
+    The division is correctly rounded and JSON encodes floats as the shortest decimal that round-trips, so the output
+    is exactly the amount in pounds, for all amounts below 2 ** 53 pence.
+
+    :param amount: The amount in pence
+    :type amount: int
+    :return: The amount in pounds or ``None`` if the ``amount`` is ``None``
+    :rtype: float
+    """
+    if amount is None:
+        return None
+    return amount / PENCE
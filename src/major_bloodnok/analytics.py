@@ -0,0 +1,511 @@
+"""Time-bucketed analytics over the transactions."""
+import logging
+
+from abc import ABC, abstractmethod
+from datetime import date, timedelta
+from sqlalchemy import select, func
+
+from .amounts import to_pounds
+from .cache import Cache, CategoryTree
+from .events import EventBus
+from .models import MonthlyTotal
+from .queries import bucket_totals
+from .snapshot import TransactionSnapshot, rolling_means, series
+
+
+logger = logging.getLogger(__name__)
+
+
+BUCKETS = ('day', 'week', 'month', 'year')
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """Return the first day of the ``bucket`` that the ``day`` is in.
+
+    :param day: The day to get the bucket for
+    :type day: date
+    :param bucket: The bucket size, one of :data:`BUCKETS`
+    :type bucket: str
+    :return: The first day of the bucket, where weeks start on Mondays
+    :rtype: date
+    """
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    elif bucket == 'month':
+        return day.replace(day=1)
+    elif bucket == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day: date, bucket: str) -> date:
+    """Return the first day of the ``bucket`` after the one that starts on the ``day``.
+
+    :param day: The first day of the bucket
+    :type day: date
+    :param bucket: The bucket size, one of :data:`BUCKETS`
+    :type bucket: str
+    :return: The first day of the next bucket
+    :rtype: date
+    """
+    if bucket == 'week':
+        return day + timedelta(days=7)
+    elif bucket == 'month':
+        return (day + timedelta(days=32)).replace(day=1)
+    elif bucket == 'year':
+        return day.replace(year=day.year + 1)
+    return day + timedelta(days=1)
+
+
+def previous_bucket(day: date, bucket: str) -> date:
+    """Return the first day of the ``bucket`` before the one that starts on the ``day``.
+
+    :param day: The first day of the bucket
+    :type day: date
+    :param bucket: The bucket size, one of :data:`BUCKETS`
+    :type bucket: str
+    :return: The first day of the previous bucket
+    :rtype: date
+    """
+    if bucket == 'week':
+        return day - timedelta(days=7)
+    elif bucket == 'month':
+        return (day - timedelta(days=1)).replace(day=1)
+    elif bucket == 'year':
+        return day.replace(year=day.year - 1)
+    return day - timedelta(days=1)
+
+
+def bucket_starts(start_date: date, end_date: date, bucket: str, limit: int = None) -> list:
+    """Return the first days of the buckets between the ``start_date`` and the ``end_date``.
+
+    :param start_date: The first day of the period
+    :type start_date: date
+    :param end_date: The last day of the period
+    :type end_date: date
+    :param bucket: The bucket size, one of :data:`BUCKETS`
+    :type bucket: str
+    :param limit: The optional maximum number of buckets to return
+    :type limit: int
+    :rtype: list[date]
+    """
+    starts = []
+    day = bucket_start(start_date, bucket)
+    while day <= end_date and (limit is None or len(starts) < limit):
+        starts.append(day)
+        day = next_bucket(day, bucket)
+    return starts
+
+
+class BucketTotals(object):
+    """Totals per bucket, Category, and direction in columnar form.
+
+    The totals of each ``(category_id, direction)`` series are held in arrays with one entry per bucket, so that a
+    chart can plot them directly. Amounts are in pence.
+    """
+
+    def __init__(self, bucket: str, start_date: date, end_date: date):
+        """Create new, empty totals for the buckets between the ``start_date`` and the ``end_date``.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day of the period
+        :type start_date: date
+        :param end_date: The last day of the period
+        :type end_date: date
+        """
+        self.bucket = bucket
+        self.start_date = start_date
+        self.end_date = end_date
+        self.buckets = bucket_starts(start_date, end_date, bucket) if start_date and end_date else []
+        self.series = {}
+        self._positions = dict((day, idx) for idx, day in enumerate(self.buckets))
+
+    def add(self, day: date, category_id: int, title: str, direction: str, amount: int, count: int):
+        """Add the ``amount`` and ``count`` to the bucket that starts on the ``day`` in a series.
+
+        :param day: The first day of the bucket
+        :type day: date
+        :param category_id: The id of the series' Category
+        :type category_id: int
+        :param title: The title of the series' Category
+        :type title: str
+        :param direction: The direction of the series
+        :type direction: str
+        :param amount: The amount in pence
+        :type amount: int
+        :param count: The number of transactions
+        :type count: int
+        """
+        series = self.series.get((category_id, direction))
+        if series is None:
+            series = (title, [0] * len(self.buckets), [0] * len(self.buckets))
+            self.series[(category_id, direction)] = series
+        idx = self._positions[day]
+        series[1][idx] = series[1][idx] + amount
+        series[2][idx] = series[2][idx] + count
+
+    def rolling_averages(self, window: int, start_date: date) -> 'BucketTotals':
+        """Return the averages of the amounts over the ``window`` buckets up to each bucket from the ``start_date``.
+
+        The buckets before the ``start_date`` only provide the amounts for the first averages. The averages are rounded
+        to whole pence and the counts are not averaged.
+
+        :param window: The number of buckets to average over
+        :type window: int
+        :param start_date: The first day to return the averages for
+        :type start_date: date
+        :return: The averages
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+        averages = BucketTotals(self.bucket, start_date, self.end_date)
+        offset = len(self.buckets) - len(averages.buckets)
+        for key, (title, amounts, counts) in self.series.items():
+            rolling = []
+            total = 0
+            for idx, amount in enumerate(amounts):
+                total = total + amount
+                if idx >= window:
+                    total = total - amounts[idx - window]
+                rolling.append(round(total / window))
+            averages.series[key] = (title, rolling[offset:], counts[offset:])
+        return averages
+
+    def jsonapi(self) -> dict:
+        """Return the totals in JSONAPI format, with the series ordered by their total amount."""
+        ordered = sorted(self.series.items(), key=lambda item: (-sum(item[1][1]), item[0][0], item[0][1]))
+        return {
+            'type': 'analytics',
+            'id': f'{self.bucket}-{self.start_date}-{self.end_date}',
+            'attributes': {
+                'bucket': self.bucket,
+                'start': self.start_date.isoformat() if self.start_date else None,
+                'end': self.end_date.isoformat() if self.end_date else None,
+                'buckets': [day.isoformat() for day in self.buckets],
+                'series': [
+                    {
+                        'category': str(category_id),
+                        'title': title,
+                        'direction': direction,
+                        'amount': [to_pounds(amount) for amount in amounts],
+                        'count': counts,
+                    } for (category_id, direction), (title, amounts, counts) in ordered
+                ]
+            }
+        }
+
+
+class Analytics(ABC):
+    """Base class of the analytics backends, which compute totals per bucket, Category, and direction."""
+
+    @abstractmethod
+    async def data_range(self) -> tuple:
+        """Return the first and last day of the months that contain transactions.
+
+        :return: The ``(start_date, end_date)`` or ``(None, None)`` if there are no transactions
+        :rtype: tuple
+        """
+
+    @abstractmethod
+    async def totals(self, bucket: str, start_date: date, end_date: date, direction: str = None,
+                     category_id: int = None) -> BucketTotals:
+        """Compute the total amount and number of transactions per bucket, Category, and direction.
+
+        The Categories are grouped as in :func:`~major_bloodnok.queries.period_totals`.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day to include
+        :type start_date: date
+        :param end_date: The last day to include
+        :type end_date: date
+        :param direction: The optional direction of the transactions to sum
+        :type direction: str
+        :param category_id: The optional id of the Category to sum the children of
+        :type category_id: int
+        :return: The totals
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+
+    async def rolling_averages(self, bucket: str, start_date: date, end_date: date, window: int,
+                               direction: str = None, category_id: int = None) -> BucketTotals:
+        """Compute the average amount over the ``window`` buckets up to each bucket, per Category and direction.
+
+        The averages are computed over whole buckets, so the first bucket is not cut off at the ``start_date``. The
+        counts are the numbers of transactions in each bucket.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day to return the averages for
+        :type start_date: date
+        :param end_date: The last day to include
+        :type end_date: date
+        :param window: The number of buckets to average over
+        :type window: int
+        :param direction: The optional direction of the transactions to average
+        :type direction: str
+        :param category_id: The optional id of the Category to average the children of
+        :type category_id: int
+        :return: The averages
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+        totals = await self.totals(bucket, window_start(start_date, bucket, window), end_date, direction,
+                                   category_id)
+        return totals.rolling_averages(window, start_date)
+
+
+def window_start(start_date: date, bucket: str, window: int) -> date:
+    """Return the first day of the ``window`` buckets up to the one that the ``start_date`` is in.
+
+    :param start_date: The day in the last bucket of the window
+    :type start_date: date
+    :param bucket: The bucket size, one of :data:`BUCKETS`
+    :type bucket: str
+    :param window: The number of buckets in the window
+    :type window: int
+    :return: The first day of the window, which is never before the earliest representable date
+    :rtype: date
+    """
+    day = bucket_start(start_date, bucket)
+    for _ in range(window - 1):
+        try:
+            day = previous_bucket(day, bucket)
+        except (OverflowError, ValueError):
+            break
+    return day
+
+
+class SQLAnalytics(Analytics):
+    """Analytics that are computed by the database.
+
+    Each set of totals is computed with a single grouped query. Whole months are read from the monthly totals and
+    other periods are summed from the transactions.
+    """
+
+    def __init__(self, sessionmaker):
+        """Create new analytics.
+
+        :param sessionmaker: The sessionmaker to access the database with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        """
+        self._sessionmaker = sessionmaker
+
+    async def data_range(self) -> tuple:
+        """Return the first and last day of the months that contain transactions.
+
+        :return: The ``(start_date, end_date)`` or ``(None, None)`` if there are no transactions
+        :rtype: tuple
+        """
+        async with self._sessionmaker() as session:
+            stmt = select(func.min(MonthlyTotal.month), func.max(MonthlyTotal.month)).filter(MonthlyTotal.count > 0)
+            first, last = (await session.execute(stmt)).one()
+        if first is None:
+            return None, None
+        return first, next_bucket(last, 'month') - timedelta(days=1)
+
+    async def totals(self, bucket: str, start_date: date, end_date: date, direction: str = None,
+                     category_id: int = None) -> BucketTotals:
+        """Compute the total amount and number of transactions per bucket, Category, and direction.
+
+        The Categories are grouped as in :func:`~major_bloodnok.queries.period_totals`.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day to include
+        :type start_date: date
+        :param end_date: The last day to include
+        :type end_date: date
+        :param direction: The optional direction of the transactions to sum
+        :type direction: str
+        :param category_id: The optional id of the Category to sum the children of
+        :type category_id: int
+        :return: The totals
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+        totals = BucketTotals(bucket, start_date, end_date)
+        monthly = bucket in ('month', 'year') and start_date.day == 1 and next_bucket(end_date, 'day').day == 1
+        stmt = bucket_totals(bucket, start_date, end_date, direction, category_id, monthly)
+        async with self._sessionmaker() as session:
+            for day, group_id, title, row_direction, amount, count in await session.execute(stmt):
+                totals.add(day, group_id, title, row_direction, amount, count)
+        logger.debug(f'Computed {len(totals.series)} series over {len(totals.buckets)} {bucket} buckets')
+        return totals
+
+
+class ColumnarAnalytics(Analytics):
+    """Analytics that are computed with vectorised operations over an in-memory snapshot of the Transactions.
+
+    The :class:`~major_bloodnok.snapshot.TransactionSnapshot` is brought up to date before each computation. The
+    Categories are mapped to their groups with the cached Categories, so the totals of each Category's subtree are
+    summed in a single pass over the snapshot.
+    """
+
+    def __init__(self, snapshot: TransactionSnapshot, cache: Cache):
+        """Create new analytics.
+
+        :param snapshot: The snapshot of the Transactions to compute the analytics over
+        :type snapshot: :class:`~major_bloodnok.snapshot.TransactionSnapshot`
+        :param cache: The shared cache of Categories and Rules
+        :type cache: :class:`~major_bloodnok.cache.Cache`
+        """
+        self._snapshot = snapshot
+        self._cache = cache
+
+    async def data_range(self) -> tuple:
+        """Return the first and last day of the months that contain transactions.
+
+        :return: The ``(start_date, end_date)`` or ``(None, None)`` if there are no transactions
+        :rtype: tuple
+        """
+        await self._snapshot.refresh()
+        first, last = self._snapshot.day_range()
+        if first is None:
+            return None, None
+        return (bucket_start(date.fromordinal(first), 'month'),
+                next_bucket(bucket_start(date.fromordinal(last), 'month'), 'month') - timedelta(days=1))
+
+    def _groups(self, tree: CategoryTree, category_id: int) -> tuple:
+        """Determine the group of each Category index in the snapshot.
+
+        :return: The ``(group_ids, groups)``, where the ``group_ids`` are the ids of the Categories that the groups
+                 are named after and the ``groups`` the group of each Category index or -1
+        :rtype: tuple
+        """
+        if category_id is None:
+            roots = [(root_id, True) for root_id in tree.children.get(None, [])]
+        elif category_id in tree.titles:
+            roots = [(category_id, False)] + [(child_id, True) for child_id in tree.children.get(category_id, [])]
+        else:
+            roots = []
+        group_ids = []
+        groups = [-1] * len(self._snapshot.category_ids)
+        for root_id, descendants in roots:
+            stack = [root_id]
+            seen = set()
+            while stack:
+                current_id = stack.pop()
+                if current_id not in seen:
+                    seen.add(current_id)
+                    idx = self._snapshot.find_category(current_id)
+                    if idx is not None:
+                        groups[idx] = len(group_ids)
+                    if descendants:
+                        stack.extend(tree.children.get(current_id, []))
+            group_ids.append(root_id)
+        return group_ids, groups
+
+    async def _sums(self, bucket: str, start_date: date, end_date: date, direction: str, category_id: int) -> tuple:
+        """Sum the snapshot into empty totals for the buckets.
+
+        :return: The ``(totals, tree, group_ids, amounts, counts)``, where the ``amounts`` and ``counts`` are in the
+                 layout returned by :meth:`~major_bloodnok.snapshot.TransactionSnapshot.bucket_sums`
+        :rtype: tuple
+        """
+        await self._snapshot.refresh()
+        tree = await self._cache.categories()
+        totals = BucketTotals(bucket, start_date, end_date)
+        group_ids, groups = self._groups(tree, category_id)
+        code = None
+        if direction is not None:
+            code = self._snapshot.find_direction(direction)
+            if code is None:
+                group_ids, groups = [], [-1] * len(groups)
+        boundaries = [start_date.toordinal()] + [day.toordinal() for day in totals.buckets[1:]]
+        amounts, counts = self._snapshot.bucket_sums(boundaries, end_date.toordinal(), groups, len(group_ids), code)
+        return totals, tree, group_ids, amounts, counts
+
+    def _add_series(self, totals: BucketTotals, tree: CategoryTree, group_ids: list, amounts, counts, start: int = 0):
+        """Add the series with at least one Transaction from the ``amounts`` and ``counts`` to the ``totals``."""
+        directions = self._snapshot.direction_names
+        width = len(group_ids) * len(directions)
+        for offset in range(width):
+            series_counts = series(counts, offset, width)
+            if any(series_counts):
+                group_id = group_ids[offset // len(directions)]
+                totals.series[(group_id, directions[offset % len(directions)])] = (
+                    tree.titles[group_id], series(amounts, offset, width, start), series_counts[start:]
+                )
+
+    async def totals(self, bucket: str, start_date: date, end_date: date, direction: str = None,
+                     category_id: int = None) -> BucketTotals:
+        """Compute the total amount and number of transactions per bucket, Category, and direction.
+
+        The Categories are grouped as in :func:`~major_bloodnok.queries.period_totals`.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day to include
+        :type start_date: date
+        :param end_date: The last day to include
+        :type end_date: date
+        :param direction: The optional direction of the transactions to sum
+        :type direction: str
+        :param category_id: The optional id of the Category to sum the children of
+        :type category_id: int
+        :return: The totals
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+        totals, tree, group_ids, amounts, counts = await self._sums(bucket, start_date, end_date, direction,
+                                                                    category_id)
+        self._add_series(totals, tree, group_ids, amounts, counts)
+        logger.debug(f'Computed {len(totals.series)} series over {len(totals.buckets)} {bucket} buckets')
+        return totals
+
+    async def rolling_averages(self, bucket: str, start_date: date, end_date: date, window: int,
+                               direction: str = None, category_id: int = None) -> BucketTotals:
+        """Compute the average amount over the ``window`` buckets up to each bucket, per Category and direction.
+
+        The averages are computed over whole buckets, so the first bucket is not cut off at the ``start_date``. The
+        counts are the numbers of transactions in each bucket.
+
+        :param bucket: The bucket size, one of :data:`BUCKETS`
+        :type bucket: str
+        :param start_date: The first day to return the averages for
+        :type start_date: date
+        :param end_date: The last day to include
+        :type end_date: date
+        :param window: The number of buckets to average over
+        :type window: int
+        :param direction: The optional direction of the transactions to average
+        :type direction: str
+        :param category_id: The optional id of the Category to average the children of
+        :type category_id: int
+        :return: The averages
+        :rtype: :class:`~major_bloodnok.analytics.BucketTotals`
+        """
+        totals, tree, group_ids, amounts, counts = await self._sums(bucket, window_start(start_date, bucket, window),
+                                                                    end_date, direction, category_id)
+        averages = BucketTotals(bucket, start_date, end_date)
+        width = len(group_ids) * len(self._snapshot.direction_names)
+        if width:
+            amounts = rolling_means(amounts, width, window)
+        self._add_series(averages, tree, group_ids, amounts, counts, len(totals.buckets) - len(averages.buckets))
+        return averages
+
+
+def create_analytics(config: dict, sessionmaker, cache: Cache, events: EventBus) -> Analytics:
+    """Create the analytics backend.
+
+    The ``config`` is the ``analytics`` section of the configuration. Its ``backend`` is either ``sql`` (the default),
+    which computes the analytics in the database, or ``columnar``, which computes them over an in-memory snapshot of
+    the transactions. The snapshot uses NumPy if it is installed.
+
+    :param config: The analytics configuration to use
+    :type config: dict
+    :param sessionmaker: The shared sessionmaker to access the database with
+    :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+    :param cache: The shared cache of Categories and Rules
+    :type cache: :class:`~major_bloodnok.cache.Cache`
+    :param events: The bus that the data change events are published on
+    :type events: :class:`~major_bloodnok.events.EventBus`
+    :return: The new analytics backend
+    :rtype: :class:`~major_bloodnok.analytics.Analytics`
+    :raises ValueError: If the ``backend`` is not known
+    """
+    backend = config.get('backend', 'sql')
+    logger.debug(f'Creating {backend} analytics')
+    if backend == 'sql':
+        return SQLAnalytics(sessionmaker)
+    elif backend == 'columnar':
+        return ColumnarAnalytics(TransactionSnapshot(sessionmaker, cache, events), cache)
+    raise ValueError(f'Unknown analytics backend {backend}')
@@ -0,0 +1,173 @@
+"""In-process cache of the Categories and compiled Rules."""
+import asyncio
+import logging
+
+from datetime import datetime, timezone
+from multiprocessing import Array
+from sqlalchemy import select
+from time import time
+from uuid import uuid4
+
+from .models import Category
+from .rules import RuleEngine
+from .serialization import SERIALIZERS
+
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryTree(object):
+    """Snapshot of all Categories."""
+
+    def __init__(self, rows: list):
+        """Create a new snapshot from the Category ``rows``.
+
+        :param rows: The Categories, selected from the columns of the Category serializer, ordered by id
+        :type rows: list
+        """
+        serializer = SERIALIZERS[Category]
+        id_idx = serializer.index(Category.id)
+        parent_idx = serializer.index(Category.parent_id)
+        title_idx = serializer.index(Category.title)
+        self.titles = {}
+        self.children = {}
+        self.uncategorised_id = None
+        for row in rows:
+            self.titles[row[id_idx]] = row[title_idx]
+            self.children.setdefault(row[parent_idx], []).append(row[id_idx])
+            if row[title_idx] == 'Uncategorised' and row[parent_idx] is None:
+                self.uncategorised_id = row[id_idx]
+        self.body = '{"data": [' + ', '.join([serializer.encode(row) for row in rows]) + ']}'
+
+
+class Versions(object):
+    """Version counters that are shared by all worker processes.
+
+    The counters are kept in shared memory, so they must be created before the worker processes are forked. As the
+    counters restart with every new instance, versions are only comparable within the same :attr:`~Versions.epoch`.
+    """
+
+    CATEGORIES = 0
+    RULES = 1
+    DATA = 2
+    MODIFIED = 3
+    EVENTS = 4
+
+    def __init__(self):
+        """Create new version counters."""
+        self.epoch = uuid4().hex[:8]
+        self._counters = Array('q', [0, 0, 0, int(time()), 0])
+
+    def __getitem__(self, counter: int) -> int:
+        """Return the current value of the ``counter``."""
+        return self._counters[counter]
+
+    def increment(self, *counters: int):
+        """Increment the ``counters`` and the data version, and set the modification time."""
+        with self._counters.get_lock():
+            for counter in counters:
+                self._counters[counter] = self._counters[counter] + 1
+            self._counters[self.DATA] = self._counters[self.DATA] + 1
+            self._counters[self.MODIFIED] = int(time())
+
+    def notify(self, counter: int):
+        """Increment only the ``counter``, without changing the data version."""
+        with self._counters.get_lock():
+            self._counters[counter] = self._counters[counter] + 1
+
+
+class Cache(object):
+    """Application-level cache of the Categories and the compiled Rules.
+
+    Each part is loaded on first use and kept until the handlers that change it invalidate it. Invalidating increments
+    the part's version in the shared :class:`~major_bloodnok.cache.Versions`, so that the invalidation also applies
+    to the caches of all other worker processes. A cached part is only used while its version is current.
+
+    The cache also tracks the version of all data. Every write, including invalidating a part, increments the
+    :attr:`~Cache.data_version` and updates the :attr:`~Cache.modified` time.
+    """
+
+    def __init__(self, sessionmaker, versions: Versions = None):
+        """Create a new, empty cache.
+
+        :param sessionmaker: The sessionmaker to load the data with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        :param versions: The shared version counters. If not given, the cache uses its own counters.
+        :type versions: :class:`~major_bloodnok.cache.Versions`
+        """
+        self._sessionmaker = sessionmaker
+        self._versions = versions or Versions()
+        self._categories = (None, None)
+        self._rules = (None, None)
+        self._category_lock = asyncio.Lock()
+        self._rule_lock = asyncio.Lock()
+
+    @property
+    def epoch(self) -> str:
+        """The epoch of the version counters."""
+        return self._versions.epoch
+
+    @property
+    def category_version(self) -> int:
+        """The current version of the Categories."""
+        return self._versions[Versions.CATEGORIES]
+
+    @property
+    def rule_version(self) -> int:
+        """The current version of the Rules."""
+        return self._versions[Versions.RULES]
+
+    @property
+    def data_version(self) -> int:
+        """The current version of all data."""
+        return self._versions[Versions.DATA]
+
+    @property
+    def modified(self) -> datetime:
+        """The time in UTC when the data was last changed."""
+        return datetime.fromtimestamp(self._versions[Versions.MODIFIED], timezone.utc)
+
+    async def categories(self) -> CategoryTree:
+        """Return the Categories, loading them if needed.
+
+        :return: The Categories
+        :rtype: :class:`~major_bloodnok.cache.CategoryTree`
+        """
+        if self._categories[0] != self.category_version:
+            async with self._category_lock:
+                version = self.category_version
+                if self._categories[0] != version:
+                    async with self._sessionmaker() as session:
+                        stmt = select(*SERIALIZERS[Category].columns).order_by(Category.id)
+                        tree = CategoryTree(list(await session.execute(stmt)))
+                    logger.debug(f'Cached Categories version {version}')
+                    self._categories = (version, tree)
+        return self._categories[1]
+
+    async def rules(self) -> RuleEngine:
+        """Return the compiled Rules, loading them if needed.
+
+        :return: The compiled Rules
+        :rtype: :class:`~major_bloodnok.rules.RuleEngine`
+        """
+        if self._rules[0] != self.rule_version:
+            async with self._rule_lock:
+                version = self.rule_version
+                if self._rules[0] != version:
+                    async with self._sessionmaker() as session:
+                        engine = await RuleEngine.load(session)
+                    logger.debug(f'Cached Rules version {version}')
+                    self._rules = (version, engine)
+        return self._rules[1]
+
+    def changed(self):
+        """Record that the data has been changed."""
+        self._versions.increment()
+
+    def invalidate_categories(self):
+        """Invalidate the cached Categories after they have been changed."""
+        self._versions.increment(Versions.CATEGORIES)
+
+    def invalidate_rules(self):
+        """Invalidate the cached Rules after they have been changed."""
+        self._versions.increment(Versions.RULES)
@@ -0,0 +1,105 @@
+"""Maintenance of the category ancestry index."""
+import logging
+
+from sqlalchemy import select, insert, delete, literal, true, and_
+from sqlalchemy.orm import aliased
+
+from .models import Category, CategoryAncestor
+
+
+logger = logging.getLogger(__name__)
+
+
+class CategoryCycleError(ValueError):
+    """Error raised when a Category would become its own ancestor."""
+
+    pass
+
+
+def subtree(category_id: int):
+    """Create a query for the ids of the Category with the ``category_id`` and all its descendants.
+
+    :param category_id: The id of the Category at the root of the subtree
+    :type category_id: int
+    :return: The query selecting the Category ids
+    :rtype: :class:`~sqlalchemy.sql.expression.Select`
+    """
+    return select(CategoryAncestor.descendant_id).filter(CategoryAncestor.ancestor_id == category_id)
+
+
+async def add_category(session, category: Category):
+    """Add the ancestry of a new ``category`` to the index.
+
+    The ``category`` must already have been flushed, so that its id is available.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param category: The new Category
+    :type category: :class:`~major_bloodnok.models.Category`
+    """
+    await session.execute(insert(CategoryAncestor).values(ancestor_id=category.id, descendant_id=category.id,
+                                                          depth=0))
+    if category.parent_id is not None:
+        await session.execute(insert(CategoryAncestor).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(CategoryAncestor.ancestor_id, literal(category.id), CategoryAncestor.depth + 1).
+            filter(CategoryAncestor.descendant_id == category.parent_id)
+        ))
+
+
+async def move_category(session, category: Category, parent_id: int):
+    """Move the ``category`` and all its descendants below the Category with the ``parent_id``.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param category: The Category to move
+    :type category: :class:`~major_bloodnok.models.Category`
+    :param parent_id: The id of the new parent Category or ``None`` to make the ``category`` a top-level Category
+    :type parent_id: int
+    :raises CategoryCycleError: If the new parent is the ``category`` itself or one of its descendants
+    """
+    if parent_id is not None:
+        stmt = select(CategoryAncestor.depth).filter(and_(CategoryAncestor.ancestor_id == category.id,
+                                                          CategoryAncestor.descendant_id == parent_id))
+        if (await session.execute(stmt)).first() is not None:
+            raise CategoryCycleError(f'Category {parent_id} is a descendant of Category {category.id}')
+    await session.execute(delete(CategoryAncestor).filter(and_(
+        CategoryAncestor.descendant_id.in_(subtree(category.id)),
+        CategoryAncestor.ancestor_id.not_in(subtree(category.id))
+    )).execution_options(synchronize_session=False))
+    if parent_id is not None:
+        ancestors = aliased(CategoryAncestor)
+        descendants = aliased(CategoryAncestor)
+        await session.execute(insert(CategoryAncestor).from_select(
+            ['ancestor_id', 'descendant_id', 'depth'],
+            select(ancestors.ancestor_id, descendants.descendant_id, ancestors.depth + descendants.depth + 1).
+            select_from(ancestors).join(descendants, true()).
+            filter(and_(ancestors.descendant_id == parent_id, descendants.ancestor_id == category.id))
+        ))
+    category.parent_id = parent_id
+
+
+async def rebuild_ancestors(session):
+    """Rebuild the complete ancestry index from the Category parents.
+
+    Categories that are part of a cycle are logged and only linked to the ancestors outside the cycle.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    """
+    parents = dict(list(await session.execute(select(Category.id, Category.parent_id))))
+    rows = []
+    for category_id in parents:
+        ancestor_id = category_id
+        depth = 0
+        seen = set()
+        while ancestor_id is not None and ancestor_id not in seen:
+            seen.add(ancestor_id)
+            rows.append({'ancestor_id': ancestor_id, 'descendant_id': category_id, 'depth': depth})
+            ancestor_id = parents.get(ancestor_id)
+            depth = depth + 1
+        if ancestor_id is not None:
+            logger.warning(f'Category {category_id} is part of a cycle')
+    await session.execute(delete(CategoryAncestor))
+    if rows:
+        await session.execute(insert(CategoryAncestor), rows)
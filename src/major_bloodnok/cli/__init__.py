@@ -9,6 +9,7 @@ try:
 except ImportError:
     from yaml import Loader
 
+from .bench import bench
 from .db import db
 from .server import server
 
@@ -29,5 +30,6 @@ def main(ctx):
     ctx.obj = {'config': config}
 
 
+main.add_command(bench)
 main.add_command(db)
 main.add_command(server)
@@ -0,0 +1,817 @@
+"""Benchmark cli commands."""
+import asyncio
+import click
+import json
+import logging
+import platform
+import random
+import resource
+import tracemalloc
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import cycle
+from multiprocessing import Pool, get_context
+from sqlalchemy import select, insert, func, Column, Date, Float, Index, Integer, MetaData, String, Table
+from tempfile import TemporaryDirectory
+from time import perf_counter, time
+from tornado.escape import json_decode, json_encode
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.testing import bind_unused_port
+
+from ..amounts import PENCE, parse_amount
+from ..analytics import ColumnarAnalytics, SQLAnalytics
+from ..cache import Cache, Versions
+from ..categories import add_category
+from ..events import EventBus
+from ..executor import create_executor
+from ..importer.dates import DateParser, parse_fallback
+from ..models import create_engine, create_sessionmaker, Base, Category, Transaction
+from ..queries import duplicate_candidates
+from ..serialization import SERIALIZERS
+from ..server import create_application
+from ..snapshot import TransactionSnapshot, numpy
+from .synthetic import SyntheticDataset, synthetic_csv
+
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Return the ``fraction`` percentile of the ``values``."""
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))] if values else 0
+
+
+def cmd_dates(rows: int, sample: int):
+    """Benchmark the parsing of the dates of a statement.
+
+    As :mod:`dateparser` is slow, it only parses the first ``sample`` dates and its time is scaled to all ``rows``.
+
+    @param rows The number of dates to parse
+    @type rows int
+    @param sample The number of dates to parse with :mod:`dateparser`
+    @type sample int
+    """
+    values = [line.split(',')[0] for line in synthetic_csv(rows).splitlines()[1:]]
+    started = perf_counter()
+    fallback = [parse_fallback(value) for value in values[:sample]]
+    fallback_time = (perf_counter() - started) * len(values) / min(sample, len(values))
+    started = perf_counter()
+    dates = DateParser()
+    dates.detect(values)
+    fast = [dates.parse(value) for value in values]
+    fast_time = perf_counter() - started
+    if fast[:sample] != fallback:
+        logger.error('The parsed dates differ')
+    click.echo(f'Detected format: {dates.format}')
+    click.echo(f'dateparser: {fallback_time / rows * 100000:8.2f}s per 100k rows (from {min(sample, rows)} rows)')
+    click.echo(f'DateParser: {fast_time / rows * 100000:8.2f}s per 100k rows ({fallback_time / fast_time:.0f}x)')
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of dates to parse')
+@click.option('--sample', default=2000, help='The number of dates to parse with dateparser')
+def dates(rows, sample):
+    """Benchmark the parsing of statement dates."""
+    cmd_dates(rows, sample)
+
+
+def sample_latencies(url: str, stop, results):
+    """Sample the latency of requests to the ``url`` until ``stop`` is set.
+
+    The ``(start, latency)`` of each request is put into the ``results``. This runs in its own process, so that the
+    measurements are not delayed when the server blocks its event loop.
+
+    @param url The URL to request
+    @type url str
+    @param stop The event that ends the sampling
+    @type stop multiprocessing.Event
+    @param results The queue to put the samples into
+    @type results multiprocessing.Queue
+    """
+    async def sample():
+        client = AsyncHTTPClient()
+        samples = []
+        while not stop.is_set():
+            started = time()
+            await client.fetch(url, request_timeout=3600)
+            samples.append((started, time() - started))
+            await asyncio.sleep(0.01)
+        return samples
+
+    results.put(asyncio.run(sample()))
+
+
+async def cmd_import_latency(rows: int, executor_config: dict):
+    """Benchmark the latency of the dashboards while a CSV import is in progress.
+
+    The application is served in-process on a temporary database. A separate process requests the dashboards
+    repeatedly, first while the server is idle and then while a CSV file with ``rows`` transactions is uploaded and
+    imported by a background job.
+
+    @param rows The number of transactions to import
+    @type rows int
+    @param executor_config The executor configuration to use
+    @type executor_config dict
+    """
+    with TemporaryDirectory() as tmp_dir:
+        config = {'database': {'dsn': f'sqlite+aiosqlite:///{tmp_dir}/bench.db'},
+                  'server': {'debug': False},
+                  'executor': executor_config,
+                  'jobs': {'directory': tmp_dir}}
+        engine = create_engine(config['database'])
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessionmaker = create_sessionmaker(engine)
+        async with sessionmaker() as session:
+            async with session.begin():
+                category = Category(title='Uncategorised', parent_id=None)
+                session.add(category)
+                await session.flush()
+                await add_category(session, category)
+        executor = create_executor(executor_config)
+        sockets = bind_sockets(0, '127.0.0.1')
+        app = create_application(config, sessionmaker, executor=executor)
+        server = HTTPServer(app)
+        server.add_sockets(sockets)
+        app.settings['jobs'].start()
+        url = f'http://127.0.0.1:{sockets[0].getsockname()[1]}'
+        context = get_context('spawn')
+        stop = context.Event()
+        results = context.Queue()
+        sampler = context.Process(target=sample_latencies, args=(url + '/api/dashboards', stop, results))
+        sampler.start()
+        body = synthetic_csv(rows)
+        await asyncio.sleep(3)
+        import_started = time()
+        response = await AsyncHTTPClient().fetch(url + '/api/transactions', method='POST', body=body,
+                                                 headers={'Content-Type': 'text/csv'}, request_timeout=3600)
+        while True:
+            job = json_decode((await AsyncHTTPClient().fetch(url + response.headers['Location'])).body)['data']
+            if job['attributes']['status'] in ('completed', 'failed'):
+                break
+            await asyncio.sleep(0.1)
+        import_finished = time()
+        stop.set()
+        while sampler.is_alive() and results.empty():
+            await asyncio.sleep(0.1)
+        samples = results.get(timeout=10)
+        sampler.join()
+        server.stop()
+        await app.settings['jobs'].stop()
+        if executor is not None:
+            executor.shutdown()
+        await engine.dispose()
+    idle = [latency for started, latency in samples if started < import_started]
+    busy = [latency for started, latency in samples if import_started <= started < import_finished]
+    click.echo(f'Import of {rows} rows: {import_finished - import_started:.1f}s')
+    for name, latencies in (('idle', idle), ('import', busy)):
+        click.echo(f'Dashboards {name:6}: {len(latencies):5} requests, p50 {percentile(latencies, 0.5) * 1000:7.1f}ms, '
+                   f'p99 {percentile(latencies, 0.99) * 1000:7.1f}ms, max {max(latencies, default=0) * 1000:7.1f}ms')
+
+
+@click.command('import-latency')
+@click.option('--rows', default=50000, help='The number of rows to import')
+@click.option('--executor', 'executor_type', default='thread', type=click.Choice(['thread', 'process', 'none']),
+              help='The executor to parse and categorise in')
+@click.option('--workers', default=None, type=int, help='The number of executor threads or processes')
+def import_latency(rows, executor_type, workers):
+    """Benchmark the dashboard latency during an import."""
+    asyncio.run(cmd_import_latency(rows, {'type': executor_type, 'workers': workers}))
+
+
+async def cmd_serialization(rows: int):
+    """Benchmark the serialization of Transaction listings.
+
+    The ORM path loads model instances and encodes their ``jsonapi()``. The fast path selects the columns and encodes
+    them with the precompiled serializer. Both run against the same in-memory database.
+
+    @param rows The number of Transactions to serialize
+    @type rows int
+    """
+    engine = create_engine({'dsn': 'sqlite+aiosqlite://'})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        start = date(2000, 1, 1)
+        await conn.execute(insert(Transaction), [
+            {'category_id': 1, 'date': start + timedelta(days=idx % 3650), 'description': f'PAYMENT {idx}',
+             'amount': random.randint(100, 50000), 'direction': random.choice(['in', 'out']),
+             'initiator': 'DEB'}
+            for idx in range(rows)
+        ])
+    sessionmaker = create_sessionmaker(engine)
+    async with sessionmaker() as session:
+        started = perf_counter()
+        result = await session.execute(select(Transaction).order_by(Transaction.id))
+        orm_body = json_encode({'data': [item.jsonapi() for item in result.scalars()]})
+        orm_time = perf_counter() - started
+    serializer = SERIALIZERS[Transaction]
+    async with sessionmaker() as session:
+        started = perf_counter()
+        result = await session.execute(select(*serializer.columns).order_by(Transaction.id))
+        fast_body = '{"data": [' + ', '.join([serializer.encode(row) for row in result]) + ']}'
+        fast_time = perf_counter() - started
+    await engine.dispose()
+    if orm_body != fast_body:
+        logger.error('The serialized outputs differ')
+    click.echo(f'ORM:        {rows / orm_time:12.0f} rows/s')
+    click.echo(f'Serializer: {rows / fast_time:12.0f} rows/s ({orm_time / fast_time:.1f}x)')
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of rows to serialize')
+def serialization(rows):
+    """Benchmark the serialization of listings."""
+    asyncio.run(cmd_serialization(rows))
+
+
+def float_transactions_table() -> Table:
+    """Return the transactions table with the former floating point amounts in pounds."""
+    return Table('transactions', MetaData(),
+                 Column('id', Integer, primary_key=True),
+                 Column('category_id', Integer),
+                 Column('date', Date),
+                 Column('description', String(255)),
+                 Column('amount', Float),
+                 Column('direction', String(16)),
+                 Column('initiator', String(255)),
+                 Index('ix_float_date_description_amount_direction', 'date', 'description', 'amount', 'direction'))
+
+
+async def time_amounts(table, parse, lines: list, repeat: int) -> tuple:
+    """Time the analysis and dedupe of the ``lines`` with amounts in the ``table``.
+
+    The lines are inserted into an in-memory database. The analysis sums the amounts per day and direction, as the
+    rebuild of the monthly totals does. As in the import, the amounts are parsed first and the dedupe then looks up
+    all parsed lines in the keys loaded for their dates.
+
+    @param table The transactions table to use
+    @param parse The function that parses an amount
+    @param lines The ``(date, description, amount, direction)`` of the transactions, with the amounts as text
+    @type lines list
+    @param repeat The number of times to run each part
+    @type repeat int
+    @return The ``(parse_time, analysis_time, dedupe_time, totals)``, where the ``totals`` are the sums per direction
+    @rtype tuple
+    """
+    engine = create_engine({'dsn': 'sqlite+aiosqlite://'})
+    async with engine.begin() as conn:
+        await conn.run_sync(table.metadata.create_all)
+        await conn.execute(insert(table), [
+            {'category_id': 1, 'date': day, 'description': description, 'amount': parse(amount),
+             'direction': direction, 'initiator': 'DEB'}
+            for day, description, amount, direction in lines
+        ])
+        analysis_stmt = select(table.c.date, table.c.direction, func.sum(table.c.amount), func.count(table.c.id)).\
+            group_by(table.c.date, table.c.direction)
+        dedupe_stmt = duplicate_candidates(lines[0][0], lines[-1][0])
+        if table is not Transaction.__table__:
+            dedupe_stmt = select(table.c.date, table.c.description, table.c.amount, table.c.direction).\
+                filter(table.c.date.between(lines[0][0], lines[-1][0]))
+        started = perf_counter()
+        for _ in range(repeat):
+            keys = [(day, description, parse(amount), direction) for day, description, amount, direction in lines]
+        parse_time = (perf_counter() - started) / repeat
+        started = perf_counter()
+        for _ in range(repeat):
+            totals = {}
+            for _, direction, amount, _ in await conn.execute(analysis_stmt):
+                totals[direction] = totals.get(direction, 0) + amount
+        analysis_time = (perf_counter() - started) / repeat
+        started = perf_counter()
+        for _ in range(repeat):
+            existing = set(tuple(row) for row in await conn.execute(dedupe_stmt))
+            duplicates = sum(1 for key in keys if key in existing)
+        dedupe_time = (perf_counter() - started) / repeat
+    await engine.dispose()
+    if duplicates != len(lines):
+        logger.error(f'Only {duplicates} of {len(lines)} lines were found as duplicates')
+    return parse_time, analysis_time, dedupe_time, totals
+
+
+async def cmd_amounts(rows: int, repeat: int):
+    """Benchmark the analysis and dedupe with amounts in integer pence against floating point pounds.
+
+    Both use the same synthetic transactions, whose exact totals are computed with :class:`~decimal.Decimal`.
+
+    @param rows The number of transactions to use
+    @type rows int
+    @param repeat The number of times to run each part
+    @type repeat int
+    """
+    dates = DateParser(['%d %b %Y'])
+    lines = []
+    exact = {}
+    for line in synthetic_csv(rows).splitlines()[1:]:
+        values = line.split(',')
+        direction = 'in' if values[4] else 'out'
+        amount = values[4] or values[3]
+        lines.append((dates.parse(values[0]), values[2], amount, direction))
+        exact[direction] = exact.get(direction, Decimal(0)) + Decimal(amount)
+    float_results = await time_amounts(float_transactions_table(), float, lines, repeat)
+    pence_results = await time_amounts(Transaction.__table__, parse_amount, lines, repeat)
+    for name, (parse_time, analysis_time, dedupe_time, totals) in (('Float', float_results), ('Pence', pence_results)):
+        if name == 'Pence':
+            totals = dict((direction, Decimal(amount) / PENCE) for direction, amount in totals.items())
+        errors = ', '.join(f'{direction} {Decimal(totals[direction]) - exact[direction]:+.2E}'
+                           for direction in sorted(exact))
+        click.echo(f'{name}: parse {parse_time * 1000:7.1f}ms, analysis {analysis_time * 1000:7.1f}ms, '
+                   f'dedupe {dedupe_time * 1000:7.1f}ms, total errors {errors}')
+    click.echo(f'Speed-up: parse {float_results[0] / pence_results[0]:.2f}x, '
+               f'analysis {float_results[1] / pence_results[1]:.2f}x, '
+               f'dedupe {float_results[2] / pence_results[2]:.2f}x')
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of transactions to use')
+@click.option('--repeat', default=5, help='The number of times to run each part')
+def amounts(rows, repeat):
+    """Benchmark the analysis and dedupe of amounts in pence."""
+    asyncio.run(cmd_amounts(rows, repeat))
+
+
+def comparable(totals) -> tuple:
+    """Return the buckets and the series with at least one transaction of the ``totals``, in a comparable form."""
+    data = totals.jsonapi()['attributes']
+    return data['buckets'], sorted((series['category'], series['direction'], series['amount'], series['count'])
+                                   for series in data['series'] if any(series['count']))
+
+
+async def cmd_analytics(rows: int, repeat: int):
+    """Benchmark the columnar analytics against the SQL analytics.
+
+    Both backends run against the same in-memory database, with a synthetic dataset of ``rows`` transactions over ten
+    years in a two-level Category tree. The snapshot's initial load and an incremental refresh after an import are
+    timed separately. The results of both backends are compared for each query.
+
+    @param rows The number of transactions to use
+    @type rows int
+    @param repeat The number of times to run each query
+    @type repeat int
+    """
+    engine = create_engine({'dsn': 'sqlite+aiosqlite://'})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    sessionmaker = create_sessionmaker(engine)
+    dataset = SyntheticDataset(rows, depth=2, breadth=3)
+    async with sessionmaker() as session:
+        async with session.begin():
+            await dataset.populate(session, categorise=True)
+            subtree_id = (await session.execute(select(Category.id).filter(Category.title == 'Category 1'))).scalar()
+    versions = Versions()
+    cache = Cache(sessionmaker, versions)
+    events = EventBus({}, sessionmaker, versions)
+    await events.publish('transactions', {'action': 'import', 'inserted': rows})
+    snapshot = TransactionSnapshot(sessionmaker, cache, events)
+    sql = SQLAnalytics(sessionmaker)
+    columnar = ColumnarAnalytics(snapshot, cache)
+    started = perf_counter()
+    await snapshot.refresh()
+    click.echo(f'Snapshot ({"numpy" if numpy is not None else "array"}): loaded {len(snapshot)} rows in '
+               f'{(perf_counter() - started) * 1000:.1f}ms')
+    start = date(2015, 1, 1)
+    end = date(2024, 12, 31)
+    queries = [
+        ('monthly totals', 'totals', ('month', start, end)),
+        ('weekly totals', 'totals', ('week', start, end, 'out')),
+        ('daily totals', 'totals', ('day', start, end)),
+        ('daily totals in a year', 'totals', ('day', date(2020, 1, 1), date(2020, 12, 31))),
+        ('subtree weekly totals', 'totals', ('week', start, end, None, subtree_id)),
+        ('3-month rolling averages', 'rolling_averages', ('month', start, end, 3)),
+        ('28-day rolling averages', 'rolling_averages', ('day', start, end, 28, 'out')),
+    ]
+    for name, method, args in queries:
+        times = []
+        results = []
+        for backend in (sql, columnar):
+            started = perf_counter()
+            for _ in range(repeat):
+                result = await getattr(backend, method)(*args)
+            times.append((perf_counter() - started) / repeat)
+            results.append(comparable(result))
+        click.echo(f'{name:25}: SQL {times[0] * 1000:8.1f}ms, columnar {times[1] * 1000:8.1f}ms '
+                   f'({times[0] / times[1]:6.1f}x), {"same" if results[0] == results[1] else "DIFFERENT"} results')
+    async with sessionmaker() as session:
+        async with session.begin():
+            await session.execute(insert(Transaction), [
+                {'category_id': 1, 'date': day, 'description': description, 'amount': amount, 'direction': direction,
+                 'initiator': transaction_type}
+                for day, transaction_type, description, amount, direction in dataset.transactions(rows, rows // 100)
+            ])
+    await events.publish('transactions', {'action': 'import', 'inserted': rows // 100})
+    started = perf_counter()
+    await snapshot.refresh()
+    click.echo(f'Snapshot: refreshed with {rows // 100} new rows in {(perf_counter() - started) * 1000:.1f}ms')
+    await engine.dispose()
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of transactions to use')
+@click.option('--repeat', default=5, help='The number of times to run each query')
+def analytics(rows, repeat):
+    """Benchmark the columnar analytics against the SQL analytics."""
+    asyncio.run(cmd_analytics(rows, repeat))
+
+
+async def cmd_generate(config: dict, rows: int, depth: int, breadth: int, rules: int, seed: int, csv_path: str,
+                       database: bool, categorise: bool):
+    """Generate a synthetic dataset as a bank statement CSV file and/or in the configured database.
+
+    @param config The configuration to use
+    @type config dict
+    @param rows The number of transactions
+    @type rows int
+    @param depth The number of levels of the Category tree
+    @type depth int
+    @param breadth The number of children of each Category
+    @type breadth int
+    @param rules The number of Rules
+    @type rules int
+    @param seed The seed for the random choices
+    @type seed int
+    @param csv_path The path of the CSV file to write or ``None``
+    @type csv_path str
+    @param database Whether to add the dataset to the configured database
+    @type database bool
+    @param categorise Whether to assign the transactions in the database to the Categories of their Rules
+    @type categorise bool
+    """
+    dataset = SyntheticDataset(rows, depth, breadth, rules, seed=seed)
+    if csv_path:
+        with open(csv_path, 'w') as out_f:
+            out_f.write(dataset.csv())
+        click.echo(f'Wrote {rows} transactions to {csv_path}')
+    if database:
+        engine = create_engine(config['database'])
+        async with create_sessionmaker(engine)() as session:
+            async with session.begin():
+                await dataset.populate(session, categorise)
+        await engine.dispose()
+        click.echo(f'Added {rows} transactions, {len(dataset.categories)} Categories, and {len(dataset.rules)} Rules '
+                   'to the database')
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of transactions to generate')
+@click.option('--depth', default=2, help='The number of levels of the Category tree')
+@click.option('--breadth', default=4, help='The number of children of each Category')
+@click.option('--rules', default=20, help='The number of Rules')
+@click.option('--seed', default=0, help='The seed for the random choices')
+@click.option('--csv', 'csv_path', default=None, type=click.Path(dir_okay=False, writable=True),
+              help='Write the transactions to this CSV file')
+@click.option('--database', is_flag=True, default=False,
+              help='Add the dataset to the configured database, which must have been initialised')
+@click.option('--categorise', is_flag=True, default=False,
+              help='Assign the transactions in the database to the Categories of their Rules')
+@click.pass_context
+def generate(ctx, rows, depth, breadth, rules, seed, csv_path, database, categorise):
+    """Generate a synthetic dataset."""
+    if not csv_path and not database:
+        raise click.UsageError('Use --csv, --database, or both')
+    asyncio.run(cmd_generate(ctx.obj['config'], rows, depth, breadth, rules, seed, csv_path, database, categorise))
+
+
+def peak_memory() -> float:
+    """Return the peak resident memory of the process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if platform.system() == 'Darwin' else peak / 1024
+
+
+def latency_summary(latencies: list, duration: float) -> dict:
+    """Summarise the ``latencies`` in seconds of the requests that were completed in ``duration`` seconds.
+
+    @param latencies The latencies of the requests
+    @type latencies list
+    @param duration The number of seconds that all requests took
+    @type duration float
+    @return The number of ``requests``, the ``throughput`` in requests per second, and the ``latency_ms`` mean and
+            percentiles in milliseconds
+    @rtype dict
+    """
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / duration if duration else 0,
+        'latency_ms': {
+            'mean': sum(latencies) / len(latencies) * 1000 if latencies else 0,
+            'p50': percentile(latencies, 0.5) * 1000,
+            'p90': percentile(latencies, 0.9) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': max(latencies, default=0) * 1000,
+        }
+    }
+
+
+async def drive_endpoint(client, url: str, path: str, requests: int, concurrency: int) -> dict:
+    """Request the ``path`` ``requests`` times with ``concurrency`` concurrent requests.
+
+    If a response links to a next page, the same client requests that page next, until the last page has been
+    reached and it starts again with the ``path``. One request is sent before the timing starts, to load the caches.
+
+    @param client The HTTP client to use
+    @type client :class:`~tornado.httpclient.AsyncHTTPClient`
+    @param url The base URL of the server
+    @type url str
+    @param path The path to request
+    @type path str
+    @param requests The number of requests to time
+    @type requests int
+    @param concurrency The number of concurrent requests
+    @type concurrency int
+    @return The :func:`latency_summary` of the requests, with the number of ``errors`` and the mean response
+            ``bytes``
+    @rtype dict
+    """
+    latencies = []
+    errors = 0
+    size = 0
+    pending = iter(range(requests))
+
+    async def run_client():
+        nonlocal errors, size
+        current = path
+        for _ in pending:
+            started = perf_counter()
+            response = await client.fetch(url + current, raise_error=False, request_timeout=600)
+            latencies.append(perf_counter() - started)
+            if response.code == 200:
+                size = size + len(response.body)
+                current = json_decode(response.body).get('links', {}).get('next') or path
+            else:
+                errors = errors + 1
+                current = path
+
+    await client.fetch(url + path, raise_error=False, request_timeout=600)
+    started = perf_counter()
+    await asyncio.gather(*[run_client() for _ in range(concurrency)])
+    result = latency_summary(latencies, perf_counter() - started)
+    result['errors'] = errors
+    result['bytes'] = size // max(len(latencies) - errors, 1)
+    return result
+
+
+async def drive_job(client, url: str, path: str, body: str = '', headers: dict = None) -> tuple:
+    """Submit a background job with a ``POST`` to the ``path`` and wait for it to complete.
+
+    @param client The HTTP client to use
+    @type client :class:`~tornado.httpclient.AsyncHTTPClient`
+    @param url The base URL of the server
+    @type url str
+    @param path The path to submit the job to
+    @type path str
+    @param body The body of the request
+    @type body str
+    @param headers The headers of the request
+    @type headers dict
+    @return The ``(seconds, job)``, where the ``job`` is the final state of the job
+    @rtype tuple
+    """
+    started = perf_counter()
+    response = await client.fetch(url + path, method='POST', body=body, headers=headers, request_timeout=3600)
+    while True:
+        job = json_decode((await client.fetch(url + response.headers['Location'])).body)['data']
+        if job['attributes']['status'] in ('completed', 'failed'):
+            return perf_counter() - started, job
+        await asyncio.sleep(0.02)
+
+
+def compare_reports(report: dict, baseline: dict) -> list:
+    """Compare the endpoint results of the ``report`` with those of the ``baseline`` report.
+
+    @param report The new report
+    @type report dict
+    @param baseline The report to compare with
+    @type baseline dict
+    @return One line per endpoint in both reports, with the relative changes
+    @rtype list
+    """
+    def change(new: float, old: float) -> str:
+        return f'{(new - old) / old:+7.1%}' if old else '    n/a'
+
+    lines = []
+    for name, result in report['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if old is None:
+            continue
+        if 'latency_ms' in result:
+            new_latency = result['latency_ms']
+            old_latency = old['latency_ms']
+            lines.append(f'{name:16}: p50 {new_latency["p50"]:8.1f}ms '
+                         f'({change(new_latency["p50"], old_latency["p50"])}), '
+                         f'p99 {new_latency["p99"]:8.1f}ms ({change(new_latency["p99"], old_latency["p99"])}), '
+                         f'throughput {result["throughput"]:8.1f}/s '
+                         f'({change(result["throughput"], old["throughput"])})')
+        else:
+            lines.append(f'{name:16}: {result["seconds"]:8.2f}s ({change(result["seconds"], old["seconds"])}), '
+                         f'throughput {result["throughput"]:8.1f} rows/s '
+                         f'({change(result["throughput"], old["throughput"])})')
+    return lines
+
+
+async def cmd_endpoints(rows: int, import_rows: int, depth: int, breadth: int, rules: int, seed: int, requests: int,
+                        concurrency: int, trace_memory: bool) -> dict:
+    """Benchmark the API endpoints in-process on a synthetic dataset.
+
+    The dataset of ``rows`` uncategorised transactions over the ten years up to the end of the current year is added
+    directly to a temporary database and the application is served in-process. First a CSV file with ``import_rows``
+    new transactions is imported and all Rules are applied, each as a background job. Then each read endpoint is
+    requested ``requests`` times. The peak resident memory of the process is recorded after each endpoint. With
+    ``trace_memory``, the peak memory allocated by Python while running each endpoint is also recorded, which slows
+    down all requests.
+
+    @param rows The number of transactions in the database
+    @type rows int
+    @param import_rows The number of transactions to import
+    @type import_rows int
+    @param depth The number of levels of the Category tree
+    @type depth int
+    @param breadth The number of children of each Category
+    @type breadth int
+    @param rules The number of Rules
+    @type rules int
+    @param seed The seed for the random choices
+    @type seed int
+    @param requests The number of requests per read endpoint
+    @type requests int
+    @param concurrency The number of concurrent requests
+    @type concurrency int
+    @param trace_memory Whether to trace the memory allocations
+    @type trace_memory bool
+    @return The report with the ``parameters``, the ``environment``, and the results per endpoint
+    @rtype dict
+    """
+    report = {
+        'started': datetime.now(timezone.utc).isoformat(),
+        'parameters': {'rows': rows, 'import_rows': import_rows, 'depth': depth, 'breadth': breadth, 'rules': rules,
+                       'seed': seed, 'requests': requests, 'concurrency': concurrency},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'endpoints': {}
+    }
+    with TemporaryDirectory() as tmp_dir:
+        config = {'database': {'dsn': f'sqlite+aiosqlite:///{tmp_dir}/bench.db'},
+                  'server': {'debug': False},
+                  'jobs': {'directory': tmp_dir}}
+        engine = create_engine(config['database'])
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessionmaker = create_sessionmaker(engine)
+        dataset = SyntheticDataset(rows, depth, breadth, rules, seed=seed,
+                                   start=date(date.today().year - 9, 1, 1))
+        started = perf_counter()
+        async with sessionmaker() as session:
+            async with session.begin():
+                await dataset.populate(session)
+        report['setup_seconds'] = perf_counter() - started
+        executor = create_executor({})
+        app = create_application(config, sessionmaker, executor=executor)
+        sock, port = bind_unused_port()
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        app.settings['events'].start()
+        app.settings['jobs'].start()
+        client = AsyncHTTPClient(force_instance=True, max_clients=max(concurrency, 10))
+        url = f'http://127.0.0.1:{port}'
+        if trace_memory:
+            tracemalloc.start()
+        year = dataset.start.year + dataset.years // 2
+        phases = [
+            ('import', ('/api/transactions', dataset.csv(rows, import_rows), {'Content-Type': 'text/csv'})),
+            ('rule application', ('/api/rules/apply', '')),
+            ('dashboards', '/api/dashboards'),
+            ('listing', '/api/transactions?page[limit]=50'),
+            ('uncategorised', '/api/uncategorised?page[limit]=50'),
+            ('analysis', f'/api/analysis?filter[timePeriod]={year}&filter[direction]=out'),
+            ('analytics', '/api/analytics?bucket=week'),
+        ]
+        try:
+            for name, endpoint in phases:
+                if trace_memory:
+                    tracemalloc.reset_peak()
+                if isinstance(endpoint, tuple):
+                    seconds, job = await drive_job(client, url, *endpoint)
+                    job_result = job['attributes']['result'] or {}
+                    processed = job_result.get('inserted', sum(job_result.get('affected', {}).values()))
+                    result = {'status': job['attributes']['status'], 'seconds': seconds, 'rows': processed,
+                              'throughput': processed / seconds}
+                else:
+                    result = await drive_endpoint(client, url, endpoint, requests, concurrency)
+                result['peak_rss_mb'] = peak_memory()
+                if trace_memory:
+                    result['peak_traced_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+                report['endpoints'][name] = result
+                logger.debug(f'Benchmarked {name}')
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+            client.close()
+            server.stop()
+            await app.settings['jobs'].stop()
+            await app.settings['events'].stop()
+            if executor is not None:
+                executor.shutdown()
+            await engine.dispose()
+    return report
+
+
+@click.command()
+@click.option('--rows', default=100000, help='The number of transactions in the database')
+@click.option('--import-rows', default=10000, help='The number of transactions to import')
+@click.option('--depth', default=2, help='The number of levels of the Category tree')
+@click.option('--breadth', default=4, help='The number of children of each Category')
+@click.option('--rules', default=20, help='The number of Rules')
+@click.option('--seed', default=0, help='The seed for the random choices')
+@click.option('--requests', default=200, help='The number of requests per read endpoint')
+@click.option('--concurrency', default=4, help='The number of concurrent requests')
+@click.option('--trace-memory', is_flag=True, default=False, help='Record the peak Python memory per endpoint')
+@click.option('--output', default=None, type=click.Path(dir_okay=False, writable=True),
+              help='Write the JSON report to this file instead of the standard output')
+@click.option('--baseline', default=None, type=click.Path(exists=True, dir_okay=False),
+              help='A previous JSON report to compare with')
+def endpoints(rows, import_rows, depth, breadth, rules, seed, requests, concurrency, trace_memory, output,
+              baseline):
+    """Benchmark the API endpoints and report the results as JSON.
+
+    The comparison with the --baseline report is written to the standard error.
+    """
+    report = asyncio.run(cmd_endpoints(rows, import_rows, depth, breadth, rules, seed, requests, concurrency,
+                                       trace_memory))
+    if output:
+        with open(output, 'w') as out_f:
+            json.dump(report, out_f, indent=2)
+    else:
+        click.echo(json.dumps(report, indent=2))
+    if baseline:
+        with open(baseline) as in_f:
+            for line in compare_reports(report, json.load(in_f)):
+                click.echo(line, err=True)
+
+
+async def load_client(url: str, paths: list, concurrency: int, duration: float) -> int:
+    """Request the ``paths`` with ``concurrency`` concurrent requests for ``duration`` seconds.
+
+    @param url The base URL of the server
+    @type url str
+    @param paths The paths to request in turn
+    @type paths list
+    @param concurrency The number of concurrent requests
+    @type concurrency int
+    @param duration The number of seconds to run for
+    @type duration float
+    @return The number of completed requests
+    @rtype int
+    """
+    client = AsyncHTTPClient(max_clients=concurrency)
+    paths = cycle(paths)
+    deadline = perf_counter() + duration
+    completed = 0
+
+    async def run():
+        nonlocal completed
+        while perf_counter() < deadline:
+            await client.fetch(url + next(paths))
+            completed = completed + 1
+
+    await asyncio.gather(*[run() for _ in range(concurrency)])
+    return completed
+
+
+def run_load_client(url: str, paths: list, concurrency: int, duration: float) -> int:
+    """Run a single load client process."""
+    return asyncio.run(load_client(url, paths, concurrency, duration))
+
+
+@click.command()
+@click.option('--url', default='http://localhost:6543', help='The base URL of the running server')
+@click.option('--path', 'paths', multiple=True, default=['/api/categories', '/api/dashboards',
+                                                         '/api/transactions?page[limit]=30'],
+              help='A path to request; can be repeated')
+@click.option('--clients', default=4, help='The number of client processes')
+@click.option('--concurrency', default=8, help='The number of concurrent requests per client process')
+@click.option('--duration', default=10.0, help='The number of seconds to run for')
+def load(url, paths, clients, concurrency, duration):
+    """Load test the read endpoints of a running server.
+
+    Comparing the throughput of servers with different ``server.workers`` settings shows how the read endpoints
+    scale with the number of worker processes.
+    """
+    with Pool(clients) as pool:
+        completed = pool.starmap(run_load_client, [(url, list(paths), concurrency, duration)] * clients)
+    click.echo(f'{sum(completed)} requests in {duration:.0f}s: {sum(completed) / duration:.0f} requests/s')
+
+
+@click.group()
+def bench():
+    """Benchmark commands."""
+    pass
+
+
+bench.add_command(amounts)
+bench.add_command(analytics)
+bench.add_command(dates)
+bench.add_command(endpoints)
+bench.add_command(generate)
+bench.add_command(import_latency)
+bench.add_command(load)
+bench.add_command(serialization)
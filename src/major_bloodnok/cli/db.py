@@ -3,14 +3,29 @@ import asyncio
 import click
 import logging
 
-from sqlalchemy import select
+from sqlalchemy import select, insert, func, cast, inspect, text, Integer, MetaData, Table
 
-from ..models import create_engine, create_sessionmaker, Base, Category
+from ..amounts import PENCE
+from ..categories import add_category, rebuild_ancestors
+from ..queries import check_query_plans
+from ..rollups import rebuild_rollups
+from ..models import create_engine, create_sessionmaker, Base, Category, MonthlyTotal, Transaction
+from ..models.search import create_search_index, drop_search_index, rebuild_search_index
 
 
 logger = logging.getLogger(__name__)
 
 
+def create_indexes(conn):
+    """Create any indexes that are missing from existing tables.
+
+    @param conn The database connection to use
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def cmd_init(config: dict, drop_existing: bool):
     """Initialise the database.
 
@@ -19,19 +34,25 @@ async def cmd_init(config: dict, drop_existing: bool):
     @param drop_existing Drop existing database tables
     @type drop_existing bool
     """
-    engine = create_engine(config['database']['dsn'])
+    engine = create_engine(config['database'])
     async with engine.begin() as conn:
         if drop_existing:
             logger.debug('Dropping existing database tables')
             await conn.run_sync(Base.metadata.drop_all)
         logger.debug('Creating the database')
         await conn.run_sync(Base.metadata.create_all)
-        async with create_sessionmaker(config['database']['dsn'])() as session:
-            async with session.begin():
-                stmt = select(Category).filter(Category.title == 'Uncategorised')
-                result = await conn.execute(stmt)
-                if not result.scalars().first():
-                    session.add(Category(title='Uncategorised', parent_id=None))
+        await conn.run_sync(create_indexes)
+        await conn.run_sync(create_search_index)
+    async with create_sessionmaker(engine)() as session:
+        async with session.begin():
+            stmt = select(Category).filter(Category.title == 'Uncategorised')
+            result = await session.execute(stmt)
+            if not result.scalars().first():
+                category = Category(title='Uncategorised', parent_id=None)
+                session.add(category)
+                await session.flush()
+                await add_category(session, category)
+    await engine.dispose()
     logger.debug('Database created')
 
 
@@ -43,6 +64,154 @@ def init(ctx, drop_existing):
     asyncio.run(cmd_init(ctx.obj['config'], drop_existing))
 
 
+async def cmd_rebuild_ancestors(config: dict):
+    """Rebuild the category ancestry index.
+
+    @param config The configuration to use
+    @type config dict
+    """
+    engine = create_engine(config['database'])
+    async with create_sessionmaker(engine)() as session:
+        async with session.begin():
+            await rebuild_ancestors(session)
+    await engine.dispose()
+    logger.debug('Category ancestry rebuilt')
+
+
+@click.command('rebuild-ancestors')
+@click.pass_context
+def rebuild_ancestors_cmd(ctx):
+    """Rebuild the category ancestry index."""
+    asyncio.run(cmd_rebuild_ancestors(ctx.obj['config']))
+
+
+async def cmd_rebuild_rollups(config: dict):
+    """Rebuild the monthly totals.
+
+    @param config The configuration to use
+    @type config dict
+    """
+    engine = create_engine(config['database'])
+    async with create_sessionmaker(engine)() as session:
+        async with session.begin():
+            await rebuild_rollups(session)
+    await engine.dispose()
+    logger.debug('Monthly totals rebuilt')
+
+
+@click.command('rebuild-rollups')
+@click.pass_context
+def rebuild_rollups_cmd(ctx):
+    """Rebuild the monthly totals."""
+    asyncio.run(cmd_rebuild_rollups(ctx.obj['config']))
+
+
+async def cmd_check_indexes(config: dict) -> bool:
+    """Check that the hot queries use the indexes.
+
+    @param config The configuration to use
+    @type config dict
+    @return Whether all hot queries use the indexes
+    @rtype bool
+    """
+    engine = create_engine(config['database'])
+    async with create_sessionmaker(engine)() as session:
+        results = await check_query_plans(session)
+    await engine.dispose()
+    for name, (uses_index, plan) in results.items():
+        click.echo(f'{name}: {"ok" if uses_index else "FULL SCAN"}')
+        for line in plan:
+            click.echo(f'    {line}')
+    return all(uses_index for uses_index, _ in results.values())
+
+
+@click.command('check-indexes')
+@click.pass_context
+def check_indexes(ctx):
+    """Check that the hot queries use the indexes."""
+    if not asyncio.run(cmd_check_indexes(ctx.obj['config'])):
+        ctx.exit(1)
+
+
+def migrate_amounts(conn) -> bool:
+    """Convert the amounts of an existing database from floating point pounds to integer pence.
+
+    The transactions table is recreated with the integer column and the amounts are copied over, rounded to the
+    nearest penny, and the search index is rebuilt. The monthly totals table is recreated empty and needs to be
+    rebuilt afterwards.
+
+    @param conn The database connection to use
+    @return Whether the amounts needed converting
+    @rtype bool
+    """
+    columns = dict((column['name'], column['type']) for column in inspect(conn).get_columns('transactions'))
+    if isinstance(columns['amount'], Integer):
+        return False
+    table = Transaction.__table__
+    drop_search_index(conn)
+    for index in table.indexes:
+        index.drop(conn, checkfirst=True)
+    conn.execute(text('ALTER TABLE transactions RENAME TO transactions_float'))
+    old_table = Table('transactions_float', MetaData(), autoload_with=conn)
+    table.create(conn)
+    names = [column.name for column in table.columns]
+    conn.execute(insert(table).from_select(names, select(*[
+        cast(func.round(old_table.c.amount * PENCE), Integer) if name == 'amount' else old_table.c[name]
+        for name in names
+    ])))
+    rebuild_search_index(conn)
+    old_table.drop(conn)
+    MonthlyTotal.__table__.drop(conn)
+    MonthlyTotal.__table__.create(conn)
+    return True
+
+
+async def cmd_migrate_amounts(config: dict):
+    """Convert the amounts of an existing database to integer pence and rebuild the monthly totals.
+
+    @param config The configuration to use
+    @type config dict
+    """
+    engine = create_engine(config['database'])
+    async with create_sessionmaker(engine)() as session:
+        async with session.begin():
+            conn = await session.connection()
+            if await conn.run_sync(migrate_amounts):
+                await rebuild_rollups(session)
+                logger.debug('Amounts converted to pence')
+            else:
+                logger.debug('Amounts are already in pence')
+    await engine.dispose()
+
+
+@click.command('migrate-amounts')
+@click.pass_context
+def migrate_amounts_cmd(ctx):
+    """Convert the amounts to integer pence."""
+    asyncio.run(cmd_migrate_amounts(ctx.obj['config']))
+
+
+async def cmd_rebuild_search(config: dict):
+    """Rebuild the transaction search index.
+
+    @param config The configuration to use
+    @type config dict
+    """
+    engine = create_engine(config['database'])
+    async with engine.begin() as conn:
+        if not await conn.run_sync(create_search_index):
+            await conn.run_sync(rebuild_search_index)
+    await engine.dispose()
+    logger.debug('Search index rebuilt')
+
+
+@click.command('rebuild-search')
+@click.pass_context
+def rebuild_search_cmd(ctx):
+    """Rebuild the transaction search index."""
+    asyncio.run(cmd_rebuild_search(ctx.obj['config']))
+
+
 @click.group()
 def db():
     """Database commands."""
@@ -50,3 +219,8 @@ def db():
 
 
 db.add_command(init)
+db.add_command(rebuild_ancestors_cmd)
+db.add_command(rebuild_rollups_cmd)
+db.add_command(rebuild_search_cmd)
+db.add_command(check_indexes)
+db.add_command(migrate_amounts_cmd)
@@ -0,0 +1,178 @@
+"""Synthetic datasets for the benchmarks."""
+import logging
+import random
+import re
+
+from datetime import date, timedelta
+from sqlalchemy import select, insert
+
+from ..categories import add_category
+from ..models import Category, Rule, Transaction
+from ..models.search import rebuild_search_index
+from ..rollups import rebuild_rollups
+
+
+logger = logging.getLogger(__name__)
+
+
+PAYEES = [('SALARY ACME LTD', 'BGC', 'in'), ('TESCO STORES', 'DEB', 'out'), ('AMAZON MARKETPLACE', 'DEB', 'out'),
+          ('SHELL PETROL', 'DEB', 'out'), ('NETFLIX.COM', 'DD', 'out'), ('COUNCIL TAX', 'DD', 'out'),
+          ('CAFE NERO', 'DEB', 'out'), ('SAVINGS', 'TRANSFER', 'out'), ('REFUND', 'BGC', 'in')]
+CSV_HEADER = 'Date,Type,Description, Money Out,Money In,Balance'
+INSERT_CHUNK_SIZE = 10000
+
+
+class SyntheticDataset(object):
+    """Reproducible synthetic Categories, Rules, and transactions.
+
+    The Categories form a tree below the ``Uncategorised`` Category, with ``breadth`` children per Category down to
+    the given ``depth``. The transactions are spread evenly over ``years`` years from the ``start`` and are paid to
+    twice as many payees as there are Rules, each of which matches one payee and assigns a random leaf Category. The
+    same ``seed`` always generates the same dataset.
+    """
+
+    def __init__(self, rows: int, depth: int = 2, breadth: int = 4, rules: int = 20, years: int = 10, seed: int = 0,
+                 start: date = date(2015, 1, 1)):
+        """Generate a new dataset.
+
+        @param rows The number of transactions
+        @type rows int
+        @param depth The number of levels of the Category tree
+        @type depth int
+        @param breadth The number of children of each Category
+        @type breadth int
+        @param rules The number of Rules
+        @type rules int
+        @param years The number of years that the transactions span
+        @type years int
+        @param seed The seed for the random choices
+        @type seed int
+        @param start The first day of the transactions
+        @type start date
+        """
+        self.rows = rows
+        self.start = start
+        self.years = years
+        self.seed = seed
+        rng = random.Random(seed)
+        self.categories = []
+        level = [None]
+        for _ in range(depth):
+            next_level = []
+            for parent_idx in level:
+                for child_idx in range(breadth):
+                    parent_title = self.categories[parent_idx][0] if parent_idx is not None else 'Category'
+                    self.categories.append((f'{parent_title} {child_idx + 1}', parent_idx))
+                    next_level.append(len(self.categories) - 1)
+            level = next_level
+        self.payees = []
+        for idx in range(max(2 * rules, len(PAYEES))):
+            name, transaction_type, direction = PAYEES[idx % len(PAYEES)]
+            self.payees.append((f'{name} {idx:04d}', transaction_type, direction))
+        self.rules = []
+        self._rule_payees = {}
+        for name, _, direction in rng.sample(self.payees, min(rules, len(self.payees))):
+            self._rule_payees[(name, direction)] = len(self.rules)
+            self.rules.append((re.escape(name) + ' ', direction, rng.choice(level)))
+
+    def transactions(self, first_idx: int = 0, count: int = None):
+        """Generate the transactions.
+
+        @param first_idx The index of the first transaction, which offsets the dates and descriptions
+        @type first_idx int
+        @param count The number of transactions or ``None`` for the dataset's number of rows
+        @type count int
+        @return The ``(date, type, description, amount, direction)`` of each transaction, with the amount in pence
+        @rtype generator
+        """
+        rng = random.Random(self.seed + first_idx)
+        days = self.years * 365
+        for idx in range(first_idx, first_idx + (self.rows if count is None else count)):
+            payee, transaction_type, direction = rng.choice(self.payees)
+            amount = rng.randint(100, 300000 if direction == 'in' else 30000)
+            day = self.start + timedelta(days=idx % self.rows * days // self.rows)
+            yield day, transaction_type, f'{payee} {idx}', amount, direction
+
+    def csv(self, first_idx: int = 0, count: int = None) -> str:
+        """Generate the transactions as a bank statement CSV.
+
+        @param first_idx The index of the first transaction
+        @type first_idx int
+        @param count The number of transactions or ``None`` for the dataset's number of rows
+        @type count int
+        @return The CSV text
+        @rtype str
+        """
+        lines = [CSV_HEADER]
+        for day, transaction_type, description, amount, direction in self.transactions(first_idx, count):
+            amount = f'{amount // 100}.{amount % 100:02}'
+            if direction == 'in':
+                lines.append(f'{day:%d %b %Y},{transaction_type},{description},,{amount},0')
+            else:
+                lines.append(f'{day:%d %b %Y},{transaction_type},{description},{amount},,0')
+        return '\n'.join(lines) + '\n'
+
+    async def populate(self, session, categorise: bool = False) -> int:
+        """Add the dataset to the database.
+
+        The ``Uncategorised`` Category is created if it does not exist yet. The transactions are inserted in bulk and
+        the monthly totals and the search index are rebuilt afterwards.
+
+        @param session The database session to use
+        @type session :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+        @param categorise Whether to assign the transactions that a Rule matches to its Category, as if the Rules had
+                          been applied, instead of leaving all transactions uncategorised
+        @type categorise bool
+        @return The id of the ``Uncategorised`` Category
+        @rtype int
+        """
+        stmt = select(Category).filter(Category.title == 'Uncategorised', Category.parent_id.is_(None))
+        uncategorised = (await session.execute(stmt)).scalars().first()
+        if uncategorised is None:
+            uncategorised = Category(title='Uncategorised', parent_id=None)
+            session.add(uncategorised)
+            await session.flush()
+            await add_category(session, uncategorised)
+        category_ids = []
+        for title, parent_idx in self.categories:
+            category = Category(title=title, parent_id=category_ids[parent_idx] if parent_idx is not None else None)
+            session.add(category)
+            await session.flush()
+            await add_category(session, category)
+            category_ids.append(category.id)
+        rule_category_ids = []
+        for pattern, direction, category_idx in self.rules:
+            rule_category_ids.append(category_ids[category_idx] if category_idx is not None else uncategorised.id)
+            session.add(Rule(description=pattern, direction=direction, category_id=rule_category_ids[-1]))
+        await session.flush()
+        values = []
+        for day, transaction_type, description, amount, direction in self.transactions():
+            category_id = uncategorised.id
+            rule_idx = self._rule_payees.get((description.rsplit(' ', 1)[0], direction))
+            if categorise and rule_idx is not None:
+                category_id = rule_category_ids[rule_idx]
+            values.append({'category_id': category_id, 'date': day, 'description': description, 'amount': amount,
+                           'direction': direction, 'initiator': transaction_type})
+            if len(values) == INSERT_CHUNK_SIZE:
+                await session.execute(insert(Transaction), values)
+                values = []
+        if values:
+            await session.execute(insert(Transaction), values)
+        await rebuild_rollups(session)
+        await (await session.connection()).run_sync(rebuild_search_index)
+        logger.debug(f'Added {self.rows} synthetic transactions, {len(category_ids)} Categories, and '
+                     f'{len(self.rules)} Rules')
+        return uncategorised.id
+
+
+def synthetic_csv(rows: int, seed: int = 0) -> str:
+    """Generate a synthetic bank statement CSV with ``rows`` transactions spread over ten years.
+
+    @param rows The number of transactions to generate
+    @type rows int
+    @param seed The seed for the random amounts and payees
+    @type seed int
+    @return The CSV text
+    @rtype str
+    """
+    return SyntheticDataset(rows, seed=seed).csv()
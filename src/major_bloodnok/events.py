@@ -0,0 +1,230 @@
+"""Publish and subscribe bus for data change events."""
+import asyncio
+import json
+import logging
+
+from sqlalchemy import select, delete, func
+
+from .cache import Versions
+from .models import Event
+
+
+logger = logging.getLogger(__name__)
+
+
+PRUNE_INTERVAL = 100
+
+
+class Subscription(object):
+    """Subscription to the events of an :class:`~major_bloodnok.events.EventBus`.
+
+    Events are buffered until they are fetched with :meth:`~Subscription.get`. If more than ``size`` events are
+    buffered, the buffered events are dropped and :attr:`~Subscription.overflowed` is set, so that the subscriber can
+    reload its data instead.
+    """
+
+    def __init__(self, last_id: int, size: int):
+        """Create a new subscription.
+
+        :param last_id: The id of the last event that the subscriber has seen
+        :type last_id: int
+        :param size: The maximum number of buffered events
+        :type size: int
+        """
+        self.last_id = last_id
+        self.overflowed = False
+        self.closed = False
+        self._size = size
+        self._events = []
+        self._ready = asyncio.Event()
+
+    def put(self, event: tuple):
+        """Buffer the ``(id, topic, payload)`` ``event``, unless the subscriber has already seen it."""
+        if event[0] > self.last_id:
+            self.last_id = event[0]
+            self._events.append(event)
+            if len(self._events) > self._size:
+                self.reset(event[0])
+            self._ready.set()
+
+    def reset(self, last_id: int):
+        """Drop the buffered events and mark the subscription as overflowed at the ``last_id``."""
+        self.last_id = last_id
+        self.overflowed = True
+        self._events = []
+        self._ready.set()
+
+    def close(self):
+        """Close the subscription."""
+        self.closed = True
+        self._ready.set()
+
+    async def get(self, timeout: float) -> list:
+        """Wait for and return the buffered events.
+
+        :param timeout: The number of seconds to wait for
+        :type timeout: float
+        :return: The buffered ``(id, topic, payload)`` events, which are empty if the timeout passed
+        :rtype: list
+        """
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        events = self._events
+        self._events = []
+        return events
+
+
+class EventBus(object):
+    """Bus that publishes data change events to all subscribers in all worker processes.
+
+    Published events are stored in the database and the ``EVENTS`` counter of the shared
+    :class:`~major_bloodnok.cache.Versions` is incremented. The bus checks the counter every ``events.poll_interval``
+    seconds, or straight away for events published in the same process, and only then loads the new events and passes
+    them on to its subscribers. The last ``events.retain`` events are kept, so that subscribers that reconnect receive
+    the events that they missed.
+    """
+
+    def __init__(self, config: dict, sessionmaker, versions: Versions):
+        """Create a new, stopped bus.
+
+        :param config: The configuration to use
+        :type config: dict
+        :param sessionmaker: The sessionmaker to access the database with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        :param versions: The version counters shared with the other worker processes
+        :type versions: :class:`~major_bloodnok.cache.Versions`
+        """
+        events_config = config.get('events', {})
+        self._sessionmaker = sessionmaker
+        self._versions = versions
+        self._poll_interval = events_config.get('poll_interval', 0.25)
+        self._retain = events_config.get('retain', 1000)
+        self._buffer_size = events_config.get('buffer_size', 1000)
+        self._subscriptions = set()
+        self._last_id = 0
+        self._version = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    async def publish(self, topic: str, payload: dict) -> int:
+        """Publish an event.
+
+        Events should be published once the changes that they describe have been committed.
+
+        :param topic: The topic of the event
+        :type topic: str
+        :param payload: The payload of the event
+        :type payload: dict
+        :return: The id of the event
+        :rtype: int
+        """
+        async with self._sessionmaker() as session:
+            async with session.begin():
+                event = Event(topic=topic, payload=json.dumps(payload))
+                session.add(event)
+                await session.flush()
+                if event.id % PRUNE_INTERVAL == 0:
+                    await session.execute(delete(Event).filter(Event.id <= event.id - self._retain))
+        self._versions.notify(Versions.EVENTS)
+        self._wakeup.set()
+        return event.id
+
+    @property
+    def version(self) -> int:
+        """The current version of the events, which changes whenever an event is published."""
+        return self._versions[Versions.EVENTS]
+
+    async def last_event_id(self) -> int:
+        """Return the id of the last stored event or 0 if there are no events."""
+        async with self._sessionmaker() as session:
+            return (await session.execute(select(func.max(Event.id)))).scalar() or 0
+
+    async def events_after(self, event_id: int) -> list:
+        """Return the stored events after the ``event_id``.
+
+        :param event_id: The id after which to return the events
+        :type event_id: int
+        :return: The ``(id, topic, payload)`` of the events
+        :rtype: list
+        """
+        async with self._sessionmaker() as session:
+            stmt = select(Event.id, Event.topic, Event.payload).filter(Event.id > event_id).order_by(Event.id)
+            return [tuple(row) for row in await session.execute(stmt)]
+
+    async def subscribe(self, after: int = None) -> Subscription:
+        """Subscribe to the events.
+
+        :param after: The id of the last event that the subscriber has seen. If it is given, the stored events after
+                      it are passed on first. If events after it are no longer stored, the subscription starts out as
+                      overflowed instead.
+        :type after: int
+        :return: The new subscription
+        :rtype: :class:`~major_bloodnok.events.Subscription`
+        """
+        async with self._lock:
+            if not self._subscriptions:
+                self._version = self._versions[Versions.EVENTS]
+                async with self._sessionmaker() as session:
+                    first_id, last_id = (await session.execute(select(func.min(Event.id), func.max(Event.id)))).one()
+                self._last_id = last_id or 0
+            else:
+                first_id = None
+            subscription = Subscription(self._last_id if after is None else after, self._buffer_size)
+            if after is not None:
+                if first_id is None:
+                    async with self._sessionmaker() as session:
+                        first_id = (await session.execute(select(func.min(Event.id)))).scalar()
+                if first_id is not None and after < first_id - 1:
+                    subscription.reset(self._last_id)
+                else:
+                    for event in await self.events_after(after):
+                        subscription.put(event)
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """Remove the ``subscription``."""
+        self._subscriptions.discard(subscription)
+
+    def start(self):
+        """Start passing on the events to the subscribers."""
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self):
+        """Stop passing on the events and close all subscriptions."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for subscription in self._subscriptions:
+            subscription.close()
+        self._subscriptions.clear()
+
+    async def _dispatch(self):
+        """Pass on new events to the subscribers until the bus is stopped.
+
+        Errors are logged and loading the new events is retried after ``events.poll_interval`` seconds.
+        """
+        while True:
+            self._wakeup.clear()
+            version = self._versions[Versions.EVENTS]
+            if self._subscriptions and version != self._version:
+                try:
+                    async with self._lock:
+                        events = await self.events_after(self._last_id)
+                        self._version = version
+                        for event in events:
+                            for subscription in self._subscriptions:
+                                subscription.put(event)
+                        if events:
+                            self._last_id = events[-1][0]
+                except Exception:
+                    logger.exception('Failed to pass on the new events')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
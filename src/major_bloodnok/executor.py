@@ -0,0 +1,49 @@
+"""Executors for CPU-heavy work."""
+import asyncio
+import logging
+import multiprocessing
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_executor(config: dict) -> Executor:
+    """Create the executor for CPU-heavy work.
+
+    The ``config`` is the ``executor`` section of the configuration. Its ``type`` is either ``thread`` (the default),
+    ``process``, or ``none``, which runs the work directly on the event loop. The ``workers`` key sets the number of
+    threads or processes. Processes are started with ``spawn``, so that they do not inherit the server's threads and
+    database connections.
+
+    :param config: The executor configuration to use
+    :type config: dict
+    :return: The new executor or ``None`` if the work runs on the event loop
+    :rtype: :class:`~concurrent.futures.Executor`
+    :raises ValueError: If the executor ``type`` is not known
+    """
+    executor_type = config.get('type', 'thread')
+    logger.debug(f'Creating {executor_type} executor')
+    if executor_type == 'thread':
+        return ThreadPoolExecutor(max_workers=config.get('workers'))
+    elif executor_type == 'process':
+        return ProcessPoolExecutor(max_workers=config.get('workers'), mp_context=multiprocessing.get_context('spawn'))
+    elif executor_type == 'none':
+        return None
+    raise ValueError(f'Unknown executor type {executor_type}')
+
+
+async def run(executor: Executor, func, *args):
+    """Run ``func`` with the ``args`` in the ``executor``, or directly if there is no executor.
+
+    With a process executor, ``func``, the ``args``, and the result must be picklable.
+
+    :param executor: The executor to run in
+    :type executor: :class:`~concurrent.futures.Executor`
+    :param func: The function to run
+    :return: The result of the function
+    """
+    if executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
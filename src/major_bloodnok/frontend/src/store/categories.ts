@@ -131,6 +131,13 @@ function createJSONAPIStore(cls) {
         });
     }
 
+    function patch(item: JSONAPIItem) {
+        categories.update((categories) => {
+            categories[item.id] = item as unknown as Category;
+            return categories;
+        });
+    }
+
     return {
         subscribe: categories.subscribe,
         load,
@@ -138,6 +145,7 @@ function createJSONAPIStore(cls) {
         lookup,
         create,
         update,
+        patch,
     }
 }
 
@@ -0,0 +1,34 @@
+import { dashboard } from './dashboard';
+import { transactions, unclassified } from './transactions';
+import { categories } from './categories';
+
+let source = null as EventSource;
+
+function reloadTransactions() {
+    transactions.reset();
+    unclassified.reset();
+    dashboard.load();
+}
+
+export function connectEvents() {
+    if (source === null) {
+        source = new EventSource('/api/events?filter[topic]=categories,transactions');
+        source.addEventListener('categories', (ev: MessageEvent) => {
+            categories.patch(JSON.parse(ev.data).data);
+        });
+        source.addEventListener('transactions', (ev: MessageEvent) => {
+            const change = JSON.parse(ev.data);
+            if (change.action === 'update') {
+                transactions.patch(change.data);
+                unclassified.reset();
+                dashboard.load();
+            } else {
+                reloadTransactions();
+            }
+        });
+        source.addEventListener('reset', () => {
+            categories.load();
+            reloadTransactions();
+        });
+    }
+}
@@ -2,6 +2,8 @@ import { dashboard } from './dashboard';
 import { transactions, unclassified } from './transactions';
 import { categories } from './categories';
 import { analysisTimePeriods } from './analysis';
+import { waitForJob } from './jobs';
+import { connectEvents } from './events';
 
 export {
     dashboard,
@@ -12,4 +14,7 @@ export {
     categories,
 
     analysisTimePeriods,
+
+    waitForJob,
+    connectEvents,
 };
@@ -0,0 +1,17 @@
+export async function waitForJob(url: string, progress?: (job: JSONAPIItem) => void) {
+    while (true) {
+        const response = await fetch(url);
+        if (response.ok) {
+            const job = (await response.json()).data as JSONAPIItem;
+            if (progress) {
+                progress(job);
+            }
+            if (job.attributes.status === 'completed' || job.attributes.status === 'failed') {
+                return job;
+            }
+        }
+        await new Promise((resolve) => {
+            setTimeout(resolve, 1000);
+        });
+    }
+}
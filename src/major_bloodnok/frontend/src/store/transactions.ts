@@ -1,32 +1,35 @@
 import { writable, derived } from "svelte/store";
 
+function parseDate(entry) {
+    const parts = entry.attributes.date.split('-');
+    const date = new Date();
+    date.setFullYear(parseInt(parts[0]));
+    date.setMonth(parseInt(parts[1]));
+    date.setDate(parseInt(parts[2]));
+    entry.attributes.date = date;
+}
+
 function createTransactionsStore(cls: string) {
     const { subscribe, set, update } = writable([]);
     let loading = false;
-    let offset = 0;
+    const first = '/api/' + cls + '?page[limit]=30';
+    let next = first;
 
     async function load() {
-        if (!loading) {
+        if (!loading && next) {
             loading = true;
             try {
-                const url = '/api/' + cls + '?page[offset]=' + offset + '&page[limit]=30';
-                const response = await fetch(url);
+                const response = await fetch(next);
                 if (response.ok) {
-                    const data = (await response.json()).data;
+                    const body = await response.json();
+                    const data = body.data;
                     for (const entry of data) {
-                        const parts = entry.attributes.date.split('-');
-                        const date = new Date();
-                        date.setFullYear(parseInt(parts[0]));
-                        date.setMonth(parseInt(parts[1]));
-                        date.setDate(parseInt(parts[2]));
-                        entry.attributes.date = date;
+                        parseDate(entry);
                     }
                     update((existing) => {
                         return existing.concat(data);
                     });
-                    if (data.length > 0) {
-                        offset = offset + data.length;
-                    }
+                    next = body.links ? body.links.next : null;
                 }
                 loading = false;
             } catch(e) {
@@ -38,16 +41,26 @@ function createTransactionsStore(cls: string) {
 
     async function reset() {
         set([]);
-        offset = 0;
+        next = first;
         await load();
     }
 
+    function patch(entry) {
+        parseDate(entry);
+        update((existing) => {
+            return existing.map((item) => {
+                return item.id === entry.id ? entry : item;
+            });
+        });
+    }
+
     load();
 
     return {
         subscribe,
         load,
         reset,
+        patch,
     }
 }
 
@@ -0,0 +1,5 @@
+"""Transaction import package."""
+from .dates import DateParser  # noqa
+from .formats import FORMATS, RowParser, StatementFormat, detect_format, register_format  # noqa
+from .pipeline import ImportResult, import_transactions  # noqa
+from .stream import CSVStreamParser  # noqa
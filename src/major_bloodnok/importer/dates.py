@@ -0,0 +1,100 @@
+"""Fast parser for the dates in bank statements."""
+import dateparser
+import logging
+
+from datetime import date, datetime
+
+
+logger = logging.getLogger(__name__)
+
+
+DATE_FORMATS = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%d-%b-%Y', '%d-%b-%y', '%m/%d/%Y', '%d/%m/%Y', '%m/%d/%y',
+                '%d/%m/%y', '%m.%d.%Y', '%d.%m.%Y', '%m-%d-%Y', '%d-%m-%Y']
+SAMPLE_SIZE = 100
+
+
+def parse_fallback(value: str) -> date:
+    """Parse a single date ``value`` with :mod:`dateparser`.
+
+    :param value: The date to parse
+    :type value: str
+    :return: The parsed date or ``None`` if the value is not a date
+    :rtype: date
+    """
+    parsed = dateparser.parse(value, settings={'PREFER_DAY_OF_MONTH': 'last'})
+    return parsed.date() if parsed is not None else None
+
+
+class DateParser():
+    """Parser for the dates in a single statement.
+
+    The format of the dates is detected from a sample of the statement's dates, by using the one of the
+    :data:`DATE_FORMATS` that parses most of them. Formats that put the month first come before those that put the
+    day first and win ties, matching :mod:`dateparser` for ambiguous dates. The detected format is
+    then used to parse all dates with :meth:`~datetime.datetime.strptime`, memoising the result for each distinct
+    value. Values that do not match the format are parsed with :mod:`dateparser`.
+    """
+
+    def __init__(self, formats: list = None):
+        """Create a new parser.
+
+        :param formats: The formats to detect, by default the :data:`DATE_FORMATS`
+        :type formats: list[str]
+        """
+        self.formats = formats or DATE_FORMATS
+        self.format = None
+        self._memo = {}
+
+    def __getstate__(self) -> dict:
+        """Return the state for pickling, without the memoised dates."""
+        return {'formats': self.formats, 'format': self.format, '_memo': {}}
+
+    def detect(self, values: list) -> str:
+        """Detect the format of the dates from a sample of the ``values``.
+
+        :param values: The date values to detect the format from
+        :type values: list[str]
+        :return: The detected format or ``None`` if no format matches any value
+        :rtype: str
+        """
+        sample = [value.strip() for value in values[:SAMPLE_SIZE] if value and value.strip()]
+        best = 0
+        for date_format in self.formats:
+            matches = 0
+            for value in sample:
+                try:
+                    datetime.strptime(value, date_format)
+                    matches = matches + 1
+                except ValueError:
+                    pass
+            if matches > best:
+                best = matches
+                self.format = date_format
+        if self.format is not None:
+            logger.debug(f'Detected date format {self.format}')
+        else:
+            logger.debug('No date format detected')
+        return self.format
+
+    def parse(self, value: str) -> date:
+        """Parse a single date ``value``.
+
+        :param value: The date to parse
+        :type value: str
+        :return: The parsed date
+        :rtype: date
+        :raises ValueError: If the value is not a valid date
+        """
+        parsed = self._memo.get(value)
+        if parsed is None:
+            if self.format is not None:
+                try:
+                    parsed = datetime.strptime(value.strip(), self.format).date()
+                except ValueError:
+                    parsed = None
+            if parsed is None and value and value.strip():
+                parsed = parse_fallback(value)
+            if parsed is None:
+                raise ValueError(f'Invalid date {value}')
+            self._memo[value] = parsed
+        return parsed
@@ -0,0 +1,218 @@
+"""Adapters for the CSV formats of different banks' statements."""
+import logging
+
+from .dates import DateParser
+from ..amounts import parse_amount
+
+
+logger = logging.getLogger(__name__)
+
+
+def _normalise(name: str) -> str:
+    return name.strip().lower()
+
+
+def _amount(value: str) -> int:
+    return parse_amount(value.replace(',', ''))
+
+
+def _decimal_comma_amount(value: str) -> int:
+    return parse_amount(value.replace('.', '').replace(',', '.'))
+
+
+class StatementFormat(object):
+    """Adapter for the CSV format of one bank's statements.
+
+    The format maps the statement's columns onto the transaction fields. Amounts are either in a single signed
+    ``amount`` column, where negative amounts are going out, or split into ``money_in`` and ``money_out`` columns.
+    Amounts are parsed exactly into pence and amounts with more than two decimal places are rejected.
+    Columns are matched by name, ignoring case and surrounding whitespace, so a format matches any statement whose
+    header contains all of the format's columns. The ``initiator`` column is optional and transactions with one of
+    the ``transfers`` initiators are marked as transfers. If the ``date_format`` is not given, it is detected from
+    the statement's dates.
+    """
+
+    def __init__(self, name: str, date: str, description: str, amount: str = None, money_in: str = None,
+                 money_out: str = None, initiator: str = None, transfers: list = None, decimal_comma: bool = False,
+                 date_format: str = None):
+        """Create a new format.
+
+        :param name: The unique name of the format
+        :type name: str
+        :param date: The name of the date column
+        :type date: str
+        :param description: The name of the description column
+        :type description: str
+        :param amount: The name of the signed amount column
+        :type amount: str
+        :param money_in: The name of the incoming amount column, if the amounts are split
+        :type money_in: str
+        :param money_out: The name of the outgoing amount column, if the amounts are split
+        :type money_out: str
+        :param initiator: The name of the optional initiator column
+        :type initiator: str
+        :param transfers: The initiators that mark a transfer
+        :type transfers: list[str]
+        :param decimal_comma: Whether the amounts use a decimal comma
+        :type decimal_comma: bool
+        :param date_format: The :meth:`~datetime.datetime.strptime` format of the dates
+        :type date_format: str
+        :raises ValueError: If neither an ``amount`` nor both ``money_in`` and ``money_out`` columns are given
+        """
+        if amount is None and (money_in is None or money_out is None):
+            raise ValueError(f'Format {name} needs an amount column or money in and out columns')
+        self.name = name
+        self.date = date
+        self.description = description
+        self.amount = amount
+        self.money_in = money_in
+        self.money_out = money_out
+        self.initiator = initiator
+        self.transfers = transfers if transfers is not None else ['TRANSFER']
+        self.decimal_comma = decimal_comma
+        self.date_format = date_format
+
+    @property
+    def columns(self) -> list:
+        """The names of the columns that a statement must contain."""
+        if self.amount is not None:
+            return [self.date, self.description, self.amount]
+        return [self.date, self.description, self.money_in, self.money_out]
+
+    def matches(self, header: list) -> bool:
+        """Return whether the statement with the ``header`` is in this format.
+
+        :param header: The names of the statement's columns
+        :type header: list[str]
+        :rtype: bool
+        """
+        names = set(_normalise(name) for name in header)
+        return all(_normalise(column) in names for column in self.columns)
+
+    def compile(self, header: list, dates: DateParser = None) -> 'RowParser':
+        """Compile the parser for the rows of the statement with the ``header``.
+
+        :param header: The names of the statement's columns
+        :type header: list[str]
+        :param dates: The parser for the statement's dates
+        :type dates: :class:`~major_bloodnok.importer.dates.DateParser`
+        :return: The parser for the statement's rows
+        :rtype: :class:`~major_bloodnok.importer.formats.RowParser`
+        """
+        return RowParser(self, header, dates)
+
+
+class RowParser(object):
+    """Parser that turns the rows of one statement into transaction rows.
+
+    The function that parses a row is compiled once for each statement, with the indices of the statement's columns
+    fixed, so that parsing a row does not need to build a dictionary or look up the columns by name. When pickled,
+    the parser is compiled again when it is unpickled.
+    """
+
+    def __init__(self, statement_format: StatementFormat, header: list, dates: DateParser = None):
+        """Compile a new parser.
+
+        :param statement_format: The format of the statement
+        :type statement_format: :class:`~major_bloodnok.importer.formats.StatementFormat`
+        :param header: The names of the statement's columns
+        :type header: list[str]
+        :param dates: The parser for the statement's dates. If not given, a new parser for the format's dates is used.
+        :type dates: :class:`~major_bloodnok.importer.dates.DateParser`
+        """
+        self.format = statement_format
+        self.header = header
+        if dates is None:
+            dates = DateParser([statement_format.date_format] if statement_format.date_format else None)
+        self.dates = dates
+        indices = dict((_normalise(name), idx) for idx, name in reversed(list(enumerate(header))))
+        self.date_index = indices[_normalise(statement_format.date)]
+        namespace = {'_date': self.dates.parse,
+                     '_amount': _decimal_comma_amount if statement_format.decimal_comma else _amount,
+                     '_transfers': frozenset(statement_format.transfers)}
+        source = ['def parse(values):',
+                  f'    date = _date(values[{self.date_index}])']
+        if statement_format.amount is not None:
+            source.extend([f'    amount = _amount(values[{indices[_normalise(statement_format.amount)]}])',
+                           "    direction = 'out' if amount < 0 else 'in'"])
+        else:
+            money_in = indices[_normalise(statement_format.money_in)]
+            money_out = indices[_normalise(statement_format.money_out)]
+            source.extend([f'    if values[{money_in}]:',
+                           f'        amount = _amount(values[{money_in}])',
+                           "        direction = 'in'",
+                           f'    elif values[{money_out}]:',
+                           f'        amount = _amount(values[{money_out}])',
+                           "        direction = 'out'",
+                           '    else:',
+                           "        raise ValueError('No amount')"])
+        if statement_format.initiator is not None and _normalise(statement_format.initiator) in indices:
+            source.extend([f'    initiator = values[{indices[_normalise(statement_format.initiator)]}]',
+                           '    if initiator in _transfers:',
+                           "        direction = 'trans'"])
+        else:
+            source.append("    initiator = ''")
+        source.append(f'    return (date, values[{indices[_normalise(statement_format.description)]}], '
+                      'abs(amount), direction, initiator)')
+        exec(compile('\n'.join(source) + '\n', f'<statement format {statement_format.name}>', 'exec'), namespace)
+        self.parse = namespace['parse']
+
+    def __reduce__(self):
+        """Pickle the parser as its format, header, and date parser."""
+        return (RowParser, (self.format, self.header, self.dates))
+
+    def detect_dates(self, rows: list):
+        """Detect the format of the dates from the ``rows``, if it has not been detected yet.
+
+        :param rows: The rows to detect the date format from
+        :type rows: list[list[str]]
+        """
+        if self.dates.format is None:
+            self.dates.detect([values[self.date_index] for values in rows if len(values) > self.date_index])
+
+
+FORMATS = {}
+
+
+def register_format(statement_format: StatementFormat):
+    """Register the ``statement_format`` for detection.
+
+    Formats that are registered later are tried first and replace earlier formats with the same name.
+
+    :param statement_format: The format to register
+    :type statement_format: :class:`~major_bloodnok.importer.formats.StatementFormat`
+    """
+    FORMATS.pop(statement_format.name, None)
+    FORMATS[statement_format.name] = statement_format
+    logger.debug(f'Registered statement format {statement_format.name}')
+
+
+def detect_format(header: list, name: str = None) -> StatementFormat:
+    """Detect the format of the statement with the ``header``.
+
+    :param header: The names of the statement's columns
+    :type header: list[str]
+    :param name: The name of the format to use instead of detecting it
+    :type name: str
+    :return: The most recently registered format that matches the ``header``, or the named format
+    :rtype: :class:`~major_bloodnok.importer.formats.StatementFormat`
+    :raises ValueError: If no format matches the ``header`` or the named format is unknown or does not match it
+    """
+    if name is not None:
+        if name not in FORMATS:
+            raise ValueError(f'Unknown statement format {name}')
+        elif not FORMATS[name].matches(header):
+            raise ValueError(f'The statement does not match the statement format {name}')
+        return FORMATS[name]
+    for statement_format in reversed(list(FORMATS.values())):
+        if statement_format.matches(header):
+            logger.debug(f'Detected statement format {statement_format.name}')
+            return statement_format
+    raise ValueError(f'Unknown statement format with the columns {", ".join(header)}')
+
+
+register_format(StatementFormat('signed', 'Date', 'Description', amount='Amount', initiator='Type'))
+register_format(StatementFormat('debit-credit', 'Date', 'Description', money_in='Credit', money_out='Debit',
+                                initiator='Type'))
+register_format(StatementFormat('money-in-out', 'Date', 'Description', money_in='Money In', money_out='Money Out',
+                                initiator='Type'))
@@ -0,0 +1,129 @@
+"""Bulk import pipeline for transactions."""
+import logging
+
+from sqlalchemy import select, insert, func
+from typing import Iterable
+
+from .formats import RowParser
+from ..executor import run
+from ..models import Transaction
+from ..queries import duplicate_candidates
+from ..rollups import add_delta, apply_deltas
+from ..search import index_transactions
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImportResult():
+    """The counts of inserted, duplicate, and rejected lines of an import."""
+
+    def __init__(self):
+        """Create a new result with all counts at zero."""
+        self.inserted = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    def jsonapi(self) -> dict:
+        """Return the result as a JSONAPI meta object."""
+        return {
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'rejected': self.rejected,
+        }
+
+
+def prepare_lines(lines: list, parser: RowParser, engine=None) -> tuple:
+    """Parse, deduplicate, and categorise the ``lines``.
+
+    This is the CPU-bound part of an import. It does not use the database, so that it can run in an executor.
+
+    :param lines: The CSV lines to prepare
+    :type lines: list[list[str]]
+    :param parser: The parser for the lines of the statement
+    :type parser: :class:`~major_bloodnok.importer.formats.RowParser`
+    :param engine: The optional compiled rules to categorise the lines with
+    :type engine: :class:`~major_bloodnok.rules.RuleEngine`
+    :return: The ``(rows, rejected, duplicates)``, where ``rows`` maps the ``(date, description, amount, direction)``
+             of each unique line to its ``(date, description, amount, direction, initiator, category_id)`` row. The
+             ``category_id`` is ``None`` if no rule matches.
+    :rtype: tuple
+    """
+    rows = {}
+    rejected = 0
+    duplicates = 0
+    parse = parser.parse
+    for line in lines:
+        try:
+            row = parse(line)
+        except (IndexError, ValueError) as e:
+            logger.debug(f'Rejected line {line}: {e}')
+            rejected = rejected + 1
+            continue
+        if row[:4] in rows:
+            duplicates = duplicates + 1
+        else:
+            rows[row[:4]] = row + (engine.classify(row[1], row[3]) if engine is not None else None, )
+    return rows, rejected, duplicates
+
+
+async def import_transactions(session, lines: Iterable[list], parser: RowParser, category_id: int,
+                              result: ImportResult = None, engine=None, executor=None) -> ImportResult:
+    """Import the transactions in ``lines`` into the database.
+
+    If the format of the ``parser``'s dates has not been detected yet, it is detected from the ``lines``. All lines
+    are then parsed with the ``parser`` and categorised using the ``engine``, in the ``executor`` if one is given.
+    They are then checked for duplicates against the database with a single query over the date range that the lines
+    cover. A line is a duplicate if a transaction with the same date, description, amount, and direction already exists,
+    either in the database or earlier in ``lines``. The new transactions are then added with a single bulk insert
+    and indexed for search, and the monthly totals are updated.
+
+    :param session: The database session to import into
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param lines: The CSV lines to import
+    :type lines: Iterable[list[str]]
+    :param parser: The parser for the lines of the statement that the ``lines`` belong to
+    :type parser: :class:`~major_bloodnok.importer.formats.RowParser`
+    :param category_id: The id of the category to assign to the new transactions
+    :type category_id: int
+    :param result: An optional existing result to add the counts to
+    :type result: :class:`~major_bloodnok.importer.ImportResult`
+    :param engine: The optional compiled rules to categorise new transactions with
+    :type engine: :class:`~major_bloodnok.rules.RuleEngine`
+    :param executor: The optional executor to parse and categorise the lines in
+    :type executor: :class:`~concurrent.futures.Executor`
+    :return: The counts of inserted, duplicate, and rejected lines
+    :rtype: :class:`~major_bloodnok.importer.ImportResult`
+    """
+    if result is None:
+        result = ImportResult()
+    lines = list(lines)
+    parser.detect_dates(lines)
+    rows, rejected, duplicates = await run(executor, prepare_lines, lines, parser, engine)
+    result.rejected = result.rejected + rejected
+    result.duplicates = result.duplicates + duplicates
+    if rows:
+        dates = [key[0] for key in rows]
+        for existing in await session.execute(duplicate_candidates(min(dates), max(dates))):
+            if tuple(existing) in rows:
+                del rows[tuple(existing)]
+                result.duplicates = result.duplicates + 1
+    if rows:
+        values = []
+        deltas = {}
+        for (date, description, amount, direction, initiator, classified) in rows.values():
+            values.append({
+                'date': date,
+                'description': description,
+                'amount': amount,
+                'direction': direction,
+                'initiator': initiator,
+                'category_id': classified if classified is not None else category_id,
+            })
+            add_delta(deltas, date, direction, values[-1]['category_id'], amount)
+        last_id = (await session.execute(select(func.max(Transaction.id)))).scalar() or 0
+        await session.execute(insert(Transaction), values)
+        await index_transactions(session, last_id)
+        await apply_deltas(session, deltas)
+        result.inserted = result.inserted + len(rows)
+    return result
@@ -0,0 +1,134 @@
+"""Incremental CSV parser for streamed uploads."""
+import codecs
+
+from csv import reader
+from io import StringIO
+
+
+DELIMITERS = [',', ';', '\t', '|']
+
+
+def sniff_encoding(data: bytes) -> str:
+    """Sniff the encoding of the start of a CSV file.
+
+    Files with a byte order mark use the marked encoding. Otherwise files that are valid UTF-8 are UTF-8 and all
+    other files are assumed to be Windows-1252, which most banks use for their exports.
+
+    :param data: The start of the file
+    :type data: bytes
+    :return: The name of the encoding
+    :rtype: str
+    """
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    elif data.startswith(codecs.BOM_UTF16_LE) or data.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(data)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def sniff_delimiter(line: str) -> str:
+    """Sniff the delimiter of a CSV file from its header ``line``.
+
+    :param line: The header line
+    :type line: str
+    :return: The one of the :data:`DELIMITERS` that occurs most often in the ``line``
+    :rtype: str
+    """
+    return max(DELIMITERS, key=line.count)
+
+
+class CSVStreamParser():
+    """Parser that turns a stream of byte chunks into CSV lines.
+
+    Chunks can be split at arbitrary points. Multi-byte characters that span two chunks are decoded correctly and
+    quoted values that contain newlines are only parsed once the closing quote has been seen. The first line is
+    used as the :attr:`~CSVStreamParser.header` and all further lines are returned as lists of values. Unless they
+    are given, the encoding is sniffed from the first chunk and the delimiter from the header.
+    """
+
+    def __init__(self, encoding: str = None, delimiter: str = None):
+        """Create a new parser.
+
+        :param encoding: The encoding of the data or ``None`` to sniff it from the first chunk
+        :type encoding: str
+        :param delimiter: The delimiter of the values or ``None`` to sniff it from the header
+        :type delimiter: str
+        """
+        self._encoding = encoding
+        self._decoder = codecs.getincrementaldecoder(encoding)() if encoding is not None else None
+        self._delimiter = delimiter
+        self._buffer = ''
+        self._offset = 0
+        self._quoted = False
+        self.header = None
+
+    def feed(self, chunk: bytes) -> list:
+        """Feed the next ``chunk`` of data into the parser.
+
+        :param chunk: The next chunk of raw data
+        :type chunk: bytes
+        :return: The CSV lines completed by the ``chunk``
+        :rtype: list[list[str]]
+        :raises UnicodeDecodeError: If the ``chunk`` cannot be decoded
+        """
+        if self._decoder is None:
+            self._encoding = sniff_encoding(chunk)
+            self._decoder = codecs.getincrementaldecoder(self._encoding)()
+        self._buffer = self._buffer + self._decoder.decode(chunk)
+        end = self._scan()
+        if end == 0:
+            return []
+        complete = self._buffer[:end]
+        self._buffer = self._buffer[end:]
+        self._offset = self._offset - end
+        return self._parse(complete)
+
+    def close(self) -> list:
+        """Signal the end of the data and return any remaining CSV lines.
+
+        :return: The remaining CSV lines
+        :rtype: list[list[str]]
+        """
+        if self._decoder is None:
+            return []
+        self._buffer = self._buffer + self._decoder.decode(b'', final=True)
+        complete = self._buffer
+        self._buffer = ''
+        self._offset = 0
+        return self._parse(complete)
+
+    def _scan(self) -> int:
+        """Scan the buffer for the end of the last complete line, tracking whether the scan is inside quotes."""
+        end = 0
+        pos = self._offset
+        while True:
+            quote = self._buffer.find('"', pos)
+            if self._quoted:
+                if quote < 0:
+                    break
+                self._quoted = False
+                pos = quote + 1
+            else:
+                newline = self._buffer.find('\n', pos)
+                if newline >= 0 and (quote < 0 or newline < quote):
+                    end = newline + 1
+                    pos = end
+                elif quote >= 0:
+                    self._quoted = True
+                    pos = quote + 1
+                else:
+                    break
+        self._offset = len(self._buffer)
+        return end
+
+    def _parse(self, text: str) -> list:
+        if self._delimiter is None:
+            self._delimiter = sniff_delimiter(text.split('\n', 1)[0])
+        lines = [values for values in reader(StringIO(text, newline=''), delimiter=self._delimiter) if values]
+        if self.header is None and lines:
+            self.header = lines.pop(0)
+        return lines
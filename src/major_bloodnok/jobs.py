@@ -0,0 +1,373 @@
+"""Background job queue for imports and the application of Rules."""
+import asyncio
+import codecs
+import json
+import logging
+import os
+
+from datetime import datetime
+from sqlalchemy import select, update, and_, exists
+from uuid import uuid4
+
+from .executor import run
+from .importer import CSVStreamParser, ImportResult, detect_format, import_transactions
+from .importer.stream import sniff_encoding
+from .metrics import start_timing
+from .models import Job
+from .rules import apply_rules
+
+
+logger = logging.getLogger(__name__)
+
+
+READ_CHUNK_SIZE = 65536
+TRANSACTIONS_QUEUE = 'transactions'
+
+
+def scan_upload(path: str) -> tuple:
+    """Estimate the number of lines after the header in the CSV file at ``path`` and sniff its encoding.
+
+    The encoding is sniffed from the whole file and not just from its start, because exports in Windows-1252 are often
+    plain ASCII until far into the file.
+
+    :param path: The path of the CSV file
+    :type path: str
+    :return: The estimated number of lines and the name of the encoding
+    :rtype: tuple[int, str]
+    """
+    count = 0
+    last = b'\n'
+    start = None
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    utf8 = True
+    with open(path, 'rb') as in_f:
+        for chunk in iter(lambda: in_f.read(READ_CHUNK_SIZE), b''):
+            if start is None:
+                start = chunk
+            count = count + chunk.count(b'\n')
+            last = chunk[-1:]
+            if utf8:
+                try:
+                    decoder.decode(chunk)
+                except UnicodeDecodeError:
+                    utf8 = False
+    if last != b'\n':
+        count = count + 1
+    encoding = sniff_encoding(start or b'')
+    if encoding == 'utf-8':
+        try:
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            utf8 = False
+        if not utf8:
+            encoding = 'cp1252'
+    return max(count - 1, 0), encoding
+
+
+async def run_import(queue: 'JobQueue', job: Job):
+    """Import the transactions from the CSV file in the ``job``'s ``path`` parameter.
+
+    The lines are imported and committed in batches of ``importer.batch_size`` lines. The ``job``'s progress is
+    updated in the same transaction as each batch, so that an interrupted import resumes after the last committed
+    batch. After each batch, the number of inserted transactions and the job's progress are published. Unless
+    ``importer.encoding`` is set, the encoding is sniffed from the whole file before any line is imported. The file is
+    deleted once the import has completed or failed.
+
+    :param queue: The queue that runs the job
+    :type queue: :class:`~major_bloodnok.jobs.JobQueue`
+    :param job: The job to run
+    :type job: :class:`~major_bloodnok.models.Job`
+    :raises ValueError: If the file is not a CSV file in a known statement format
+    """
+    params = json.loads(job.params)
+    importer_config = queue.config.get('importer', {})
+    batch_size = importer_config.get('batch_size', 10000)
+    try:
+        total, encoding = await run(queue.executor, scan_upload, params['path'])
+        result = ImportResult()
+        if job.result:
+            for key, value in json.loads(job.result).items():
+                setattr(result, key, value)
+        processed = job.progress
+        skip = job.progress
+        category_id = (await queue.cache.categories()).uncategorised_id
+        engine = await queue.cache.rules()
+        parser = CSVStreamParser(importer_config.get('encoding') or encoding, importer_config.get('delimiter'))
+        row_parser = None
+        lines = []
+        with open(params['path'], 'rb') as in_f:
+            while True:
+                chunk = in_f.read(READ_CHUNK_SIZE)
+                try:
+                    new_lines = parser.feed(chunk) if chunk else parser.close()
+                except UnicodeDecodeError:
+                    raise ValueError('The upload is not in the expected encoding')
+                if skip:
+                    skipped = min(skip, len(new_lines))
+                    new_lines = new_lines[skipped:]
+                    skip = skip - skipped
+                lines.extend(new_lines)
+                if row_parser is None and parser.header is not None:
+                    row_parser = detect_format(parser.header, params.get('format')).compile(parser.header)
+                if lines and (len(lines) >= batch_size or not chunk):
+                    inserted = result.inserted
+                    async with queue.sessionmaker() as session:
+                        async with session.begin():
+                            await import_transactions(session, lines, row_parser, category_id, result, engine,
+                                                      queue.executor)
+                            processed = processed + len(lines)
+                            await session.execute(update(Job).filter(Job.id == job.id).values(
+                                progress=processed, total=max(total, processed), result=json.dumps(result.jsonapi())
+                            ))
+                    queue.cache.changed()
+                    if result.inserted > inserted:
+                        await queue.events.publish('transactions', {'action': 'import',
+                                                                    'inserted': result.inserted - inserted})
+                    await queue.publish_job(job.id)
+                    lines = []
+                if not chunk:
+                    break
+        if row_parser is None:
+            raise ValueError('The upload has no header')
+    except Exception:
+        os.remove(params['path'])
+        raise
+    os.remove(params['path'])
+
+
+async def run_apply_rules(queue: 'JobQueue', job: Job):
+    """Apply all Rules to the uncategorised transactions and publish the number of transactions per Rule.
+
+    :param queue: The queue that runs the job
+    :type queue: :class:`~major_bloodnok.jobs.JobQueue`
+    :param job: The job to run
+    :type job: :class:`~major_bloodnok.models.Job`
+    """
+    categories = await queue.cache.categories()
+    engine = await queue.cache.rules()
+    async with queue.sessionmaker() as session:
+        async with session.begin():
+            affected = await apply_rules(session, engine, categories.uncategorised_id, executor=queue.executor)
+            categorised = sum(affected.values())
+            await session.execute(update(Job).filter(Job.id == job.id).values(
+                progress=categorised, total=categorised,
+                result=json.dumps({'affected': {str(key): value for key, value in affected.items()}})
+            ))
+    if affected:
+        queue.cache.changed()
+        await queue.events.publish('transactions', {'action': 'categorise',
+                                                    'affected': {str(key): value for key, value in affected.items()}})
+    logger.debug(f'Categorised {categorised} transactions')
+
+
+JOB_TYPES = {
+    'import': run_import,
+    'apply-rules': run_apply_rules,
+}
+
+
+class JobQueue(object):
+    """Queue that runs the background jobs stored in the database.
+
+    Jobs are run in the order in which they were submitted. Jobs in the same queue are run one after the other, even
+    across worker processes, as a job is only claimed while no other job in its queue is running. As the application
+    has a single account, all jobs that change the transactions share the :data:`TRANSACTIONS_QUEUE`.
+
+    Submitting a job wakes up the queue in the current process and the database is polled every
+    ``jobs.poll_interval`` seconds for jobs submitted by other processes. Jobs that were still running when a previous
+    server stopped are reset to pending when the queue starts and are then resumed. Uploaded files are stored in the
+    ``jobs.directory`` until their import has been run. Whenever a job's status or progress changes, the job is
+    published in the ``jobs`` topic. If the queue has metrics, the duration and the database work of each job are
+    recorded in them.
+    """
+
+    def __init__(self, config: dict, sessionmaker, cache, events, executor=None, metrics=None):
+        """Create a new, stopped queue.
+
+        :param config: The configuration to use
+        :type config: dict
+        :param sessionmaker: The sessionmaker to access the database with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        :param cache: The cache to get the Categories and Rules from, which also identifies the server
+        :type cache: :class:`~major_bloodnok.cache.Cache`
+        :param events: The bus to publish the changes to
+        :type events: :class:`~major_bloodnok.events.EventBus`
+        :param executor: The executor for CPU-heavy work
+        :type executor: :class:`~concurrent.futures.Executor`
+        :param metrics: The metrics to record the jobs in
+        :type metrics: :class:`~major_bloodnok.metrics.Metrics`
+        """
+        jobs_config = config.get('jobs', {})
+        self.config = config
+        self.sessionmaker = sessionmaker
+        self.cache = cache
+        self.events = events
+        self.executor = executor
+        self.metrics = metrics
+        self.directory = jobs_config.get('directory', 'jobs')
+        self.poll_interval = jobs_config.get('poll_interval', 5)
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+        self._running = {}
+
+    def upload_path(self) -> str:
+        """Return a new path to store an uploaded file at.
+
+        :return: The path in the ``jobs.directory``
+        :rtype: str
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        return os.path.abspath(os.path.join(self.directory, f'{uuid4().hex}.csv'))
+
+    async def submit(self, type_: str, params: dict, queue: str = TRANSACTIONS_QUEUE) -> Job:
+        """Submit a new job.
+
+        :param type_: The type of the job, one of the :data:`JOB_TYPES`
+        :type type_: str
+        :param params: The parameters of the job
+        :type params: dict
+        :param queue: The queue to run the job in
+        :type queue: str
+        :return: The new job
+        :rtype: :class:`~major_bloodnok.models.Job`
+        """
+        async with self.sessionmaker() as session:
+            async with session.begin():
+                job = Job(type=type_, queue=queue, status='pending', params=json.dumps(params), progress=0,
+                          created=datetime.utcnow())
+                session.add(job)
+        logger.debug(f'Submitted {type_} job {job.id}')
+        self._wakeup.set()
+        await self.events.publish('jobs', {'action': 'create', 'data': job.jsonapi()})
+        return job
+
+    async def publish_job(self, job_id: int):
+        """Publish the current state of the job with the ``job_id``.
+
+        :param job_id: The id of the job to publish
+        :type job_id: int
+        """
+        async with self.sessionmaker() as session:
+            job = (await session.execute(select(Job).filter(Job.id == job_id))).scalars().first()
+        await self.events.publish('jobs', {'action': 'update', 'data': job.jsonapi()})
+
+    def start(self):
+        """Start running the jobs."""
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    async def stop(self):
+        """Stop running the jobs.
+
+        Running jobs are cancelled and their uncommitted work is rolled back. They are resumed when a queue is next
+        started.
+        """
+        tasks = list(self._running.values())
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._dispatcher = None
+
+    async def _dispatch(self):
+        """Claim and run pending jobs until the queue is stopped.
+
+        Errors are logged and the pending jobs are checked again after ``jobs.poll_interval`` seconds, so that a
+        transient database error does not stop the queue.
+        """
+        resumed = False
+        while True:
+            self._wakeup.clear()
+            try:
+                if not resumed:
+                    await self._resume()
+                    resumed = True
+                async with self.sessionmaker() as session:
+                    stmt = select(Job.id, Job.queue).filter(Job.status == 'pending').order_by(Job.id)
+                    pending = list(await session.execute(stmt))
+                busy = set(self._running.keys())
+                for job_id, queue in pending:
+                    if queue not in busy:
+                        busy.add(queue)
+                        if await self._claim(job_id, queue):
+                            self._running[queue] = asyncio.ensure_future(self._run(job_id, queue))
+            except Exception:
+                logger.exception('Failed to dispatch the pending jobs')
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _resume(self):
+        """Reset the jobs that were still running when a previous server stopped to pending."""
+        async with self.sessionmaker() as session:
+            async with session.begin():
+                result = await session.execute(update(Job).filter(and_(
+                    Job.status == 'running',
+                    Job.worker != self.cache.epoch
+                )).values(status='pending').execution_options(synchronize_session=False))
+        if result.rowcount:
+            logger.info(f'Resuming {result.rowcount} interrupted jobs')
+
+    async def _claim(self, job_id: int, queue: str) -> bool:
+        """Claim the pending job with the ``job_id``, unless another job in its ``queue`` is running."""
+        running = Job.__table__.alias('running')
+        async with self.sessionmaker() as session:
+            async with session.begin():
+                result = await session.execute(update(Job).filter(and_(
+                    Job.id == job_id,
+                    Job.status == 'pending',
+                    ~exists().where(and_(running.c.queue == queue, running.c.status == 'running'))
+                )).values(status='running', worker=self.cache.epoch, started=datetime.utcnow()).
+                    execution_options(synchronize_session=False))
+        return result.rowcount == 1
+
+    async def _run(self, job_id: int, queue: str):
+        """Run the job with the ``job_id`` and record whether it completed or failed."""
+        timing = start_timing()
+        job_type = None
+        try:
+            try:
+                async with self.sessionmaker() as session:
+                    job = (await session.execute(select(Job).filter(Job.id == job_id))).scalars().first()
+                job_type = job.type
+                logger.debug(f'Running {job.type} job {job.id}')
+                await self.events.publish('jobs', {'action': 'update', 'data': job.jsonapi()})
+                await JOB_TYPES[job.type](self, job)
+                values = {'status': 'completed'}
+            except Exception as e:
+                logger.exception(f'{job_type} job {job_id} failed')
+                values = {'status': 'failed', 'error': str(e)}
+            await self._finish(job_id, values)
+            logger.debug(f'Job {job_id} {values["status"]}')
+            if self.metrics is not None and job_type is not None:
+                self.metrics.observe_job(job_type, values['status'], timing)
+            try:
+                await self.publish_job(job_id)
+            except Exception:
+                logger.exception(f'Failed to publish the {values["status"]} job {job_id}')
+        finally:
+            del self._running[queue]
+            self._wakeup.set()
+
+    async def _finish(self, job_id: int, values: dict):
+        """Record the final ``values`` of the job with the ``job_id``.
+
+        As the job blocks its queue until it is no longer running, failures are logged and the update is retried every
+        ``jobs.poll_interval`` seconds until it succeeds.
+
+        :param job_id: The id of the job
+        :type job_id: int
+        :param values: The final status and the error, if any, of the job
+        :type values: dict
+        """
+        values['finished'] = datetime.utcnow()
+        while True:
+            try:
+                async with self.sessionmaker() as session:
+                    async with session.begin():
+                        await session.execute(update(Job).filter(Job.id == job_id).values(**values))
+                return
+            except Exception:
+                logger.exception(f'Failed to record the {values["status"]} status of job {job_id}, retrying')
+                await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,278 @@
+"""Request and job metrics in the Prometheus text format."""
+import logging
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from sqlalchemy.event import listen
+from time import perf_counter
+
+from .models import pool_statistics
+
+
+logger = logging.getLogger(__name__)
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+POOL_METRICS = {
+    'checkouts': ('db_pool_checkouts_total', 'counter', 'The number of connections checked out of the pool.'),
+    'checkins': ('db_pool_checkins_total', 'counter', 'The number of connections returned to the pool.'),
+    'wait_total': ('db_pool_wait_seconds_total', 'counter', 'The time spent waiting for a connection.'),
+    'wait_max': ('db_pool_wait_max_seconds', 'gauge', 'The longest wait for a connection.'),
+    'size': ('db_pool_size', 'gauge', 'The number of connections the pool keeps open.'),
+    'checked_out': ('db_pool_checked_out', 'gauge', 'The number of connections currently checked out.'),
+    'overflow': ('db_pool_overflow', 'gauge', 'The number of connections beyond the pool size.'),
+}
+current_timing = ContextVar('current_timing', default=None)
+
+
+class Timing(object):
+    """Wall-clock time and database work of a single request or job.
+
+    The SQL statements that are executed while the timing is the :data:`current_timing` are counted towards it.
+    """
+
+    def __init__(self):
+        """Start a new timing."""
+        self.started = perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        """Return the seconds since the timing was started."""
+        return perf_counter() - self.started
+
+    def record_statement(self, duration: float):
+        """Record a single SQL statement that took ``duration`` seconds.
+
+        :param duration: The time the statement took
+        :type duration: float
+        """
+        self.statements = self.statements + 1
+        self.db_time = self.db_time + duration
+
+
+def start_timing() -> Timing:
+    """Start a new :class:`~major_bloodnok.metrics.Timing` and make it the :data:`current_timing`.
+
+    The timing applies to the current context, which is inherited by the tasks created in it.
+
+    :return: The new timing
+    :rtype: :class:`~major_bloodnok.metrics.Timing`
+    """
+    timing = Timing()
+    current_timing.set(timing)
+    return timing
+
+
+def format_labels(names: tuple, values: tuple) -> str:
+    """Format the label ``names`` and ``values`` as a Prometheus label set.
+
+    :param names: The names of the labels
+    :type names: tuple
+    :param values: The values of the labels
+    :type values: tuple
+    :return: The label set, which is empty if there are no labels
+    :rtype: str
+    """
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter(object):
+    """Counter metric with a value per label set."""
+
+    def __init__(self, name: str, description: str, labels: tuple = ()):
+        """Create a new counter.
+
+        :param name: The name of the metric
+        :type name: str
+        :param description: The help text of the metric
+        :type description: str
+        :param labels: The names of the labels
+        :type labels: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {} if labels else {(): 0}
+
+    def inc(self, labels: tuple = (), amount: float = 1):
+        """Increment the value for the ``labels`` by ``amount``."""
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        """Render the counter as lines of the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{format_labels(self.labels, labels)} {value}')
+        return lines
+
+
+class Histogram(object):
+    """Histogram metric with cumulative buckets per label set."""
+
+    def __init__(self, name: str, description: str, labels: tuple = (), buckets: tuple = DURATION_BUCKETS):
+        """Create a new histogram.
+
+        :param name: The name of the metric
+        :type name: str
+        :param description: The help text of the metric
+        :type description: str
+        :param labels: The names of the labels
+        :type labels: tuple
+        :param buckets: The upper bounds of the buckets in ascending order, without the implicit ``+Inf`` bucket
+        :type buckets: tuple
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+
+    def observe(self, labels: tuple, value: float):
+        """Add the ``value`` to the histogram for the ``labels``."""
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 2)
+            self.values[labels] = counts
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] = counts[-1] + value
+
+    def render(self) -> list:
+        """Render the histogram as lines of the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for labels, counts in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                total = total + count
+                label_set = format_labels(self.labels + ('le', ), labels + (bound, ))
+                lines.append(f'{self.name}_bucket{label_set} {total}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, labels)} {counts[-1]}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, labels)} {total}')
+        return lines
+
+
+class Metrics(object):
+    """Registry of the request, job, and database metrics of a server process.
+
+    Requests are labelled with the name of their handler, so that all requests to the same route share their
+    histograms, and jobs with their type. For each, the duration, the number of SQL statements, and the time spent in
+    the database are recorded, the latter two collected through the SQLAlchemy event hooks of the engine passed to
+    :meth:`~major_bloodnok.metrics.Metrics.instrument`. Requests that execute more than ``metrics.statement_threshold``
+    SQL statements are also logged as warnings, which makes N+1 query patterns stand out. The duration buckets are
+    configured by ``metrics.buckets`` and the statement count buckets by ``metrics.statement_buckets``.
+
+    Each worker process has its own metrics, which only cover the requests and jobs that it ran.
+    """
+
+    def __init__(self, config: dict):
+        """Create a new, empty registry.
+
+        :param config: The configuration to use
+        :type config: dict
+        """
+        metrics_config = config.get('metrics', {})
+        buckets = metrics_config.get('buckets', DURATION_BUCKETS)
+        statement_buckets = metrics_config.get('statement_buckets', STATEMENT_BUCKETS)
+        self.statement_threshold = metrics_config.get('statement_threshold', 100)
+        self._engine = None
+        self.requests = Counter('http_requests_total', 'The number of completed requests.',
+                                ('route', 'method', 'status'))
+        self.request_duration = Histogram('http_request_duration_seconds', 'The duration of the requests.',
+                                          ('route', 'method'), buckets)
+        self.request_statements = Histogram('http_request_db_statements', 'The SQL statements run per request.',
+                                            ('route', 'method'), statement_buckets)
+        self.request_db_duration = Histogram('http_request_db_duration_seconds',
+                                             'The time spent in the database per request.', ('route', 'method'),
+                                             buckets)
+        self.job_duration = Histogram('job_duration_seconds', 'The duration of the background jobs.',
+                                      ('type', 'status'), buckets)
+        self.job_statements = Histogram('job_db_statements', 'The SQL statements run per background job.',
+                                        ('type', ), statement_buckets)
+        self.job_db_duration = Histogram('job_db_duration_seconds',
+                                         'The time spent in the database per background job.', ('type', ), buckets)
+        self.statements = Counter('db_statements_total', 'The number of SQL statements run.')
+        self.db_duration = Counter('db_duration_seconds_total', 'The time spent running SQL statements.')
+
+    def instrument(self, engine):
+        """Count the SQL statements run by the ``engine`` and the time they take.
+
+        The statements are also recorded in the :data:`current_timing`, if there is one. The statistics of the
+        engine's connection pool are included in the metrics as well.
+
+        :param engine: The engine to instrument
+        :type engine: :class:`~sqlalchemy.ext.asyncio.AsyncEngine`
+        """
+        self._engine = engine
+        listen(engine.sync_engine, 'before_cursor_execute', self._before_cursor_execute)
+        listen(engine.sync_engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = perf_counter() - conn.info['metrics_started'].pop()
+        self.statements.inc()
+        self.db_duration.inc(amount=duration)
+        timing = current_timing.get()
+        if timing is not None:
+            timing.record_statement(duration)
+
+    def observe_request(self, route: str, method: str, status: int, duration: float, timing: Timing):
+        """Record a completed request.
+
+        :param route: The name of the route that handled the request
+        :type route: str
+        :param method: The HTTP method of the request
+        :type method: str
+        :param status: The status code of the response
+        :type status: int
+        :param duration: The duration of the request in seconds
+        :type duration: float
+        :param timing: The timing of the request's database work
+        :type timing: :class:`~major_bloodnok.metrics.Timing`
+        """
+        self.requests.inc((route, method, str(status)))
+        self.request_duration.observe((route, method), duration)
+        self.request_statements.observe((route, method), timing.statements)
+        self.request_db_duration.observe((route, method), timing.db_time)
+        if self.statement_threshold and timing.statements > self.statement_threshold:
+            logger.warning(f'{method} {route} ran {timing.statements} SQL statements in {timing.db_time:.3f}s')
+
+    def observe_job(self, type_: str, status: str, timing: Timing):
+        """Record a finished background job.
+
+        :param type_: The type of the job
+        :type type_: str
+        :param status: Whether the job ``completed`` or ``failed``
+        :type status: str
+        :param timing: The timing of the job
+        :type timing: :class:`~major_bloodnok.metrics.Timing`
+        """
+        self.job_duration.observe((type_, status), timing.elapsed)
+        self.job_statements.observe((type_, ), timing.statements)
+        self.job_db_duration.observe((type_, ), timing.db_time)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text format.
+
+        :return: The metrics
+        :rtype: str
+        """
+        lines = []
+        for metric in (self.requests, self.request_duration, self.request_statements, self.request_db_duration,
+                       self.job_duration, self.job_statements, self.job_db_duration, self.statements,
+                       self.db_duration):
+            lines.extend(metric.render())
+        stats = pool_statistics(self._engine) if self._engine is not None else None
+        if stats is not None:
+            for key, (name, kind, description) in POOL_METRICS.items():
+                lines.extend([f'# HELP {name} {description}', f'# TYPE {name} {kind}', f'{name} {stats[key]}'])
+        return '\n'.join(lines) + '\n'
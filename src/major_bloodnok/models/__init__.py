@@ -1,29 +1,62 @@
 """Database models."""
 import logging
 
+from sqlalchemy.event import listen
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from .meta import Base  # noqa
 from .transaction import Transaction  # noqa
 from .category import Category  # noqa
+from .category_ancestor import CategoryAncestor  # noqa
 from .rule import Rule  # noqa
+from .monthly_total import MonthlyTotal  # noqa
+from .job import Job  # noqa
+from .event import Event  # noqa
+from .pool import InstrumentedQueuePool, pool_statistics  # noqa
+from .search import register_functions
 
 
 logger = logging.getLogger(__name__)
 
 
-def create_engine(dsn: str):
-    """Create a database engine."""
-    logger.debug(f'Creating engine for {dsn}')
-    return create_async_engine(dsn)
-
-
-def create_sessionmaker(dsn: str):
-    """Create a database session."""
+def create_engine(config: dict):
+    """Create a database engine.
+
+    The ``config`` is the ``database`` section of the configuration. Apart from the ``dsn``, it can contain a ``pool``
+    section with the keys ``size``, ``max_overflow``, ``timeout``, ``pre_ping``, and ``recycle``, which configure the
+    connection pool. In-memory SQLite databases always use a single, static connection. On SQLite, the
+    ``rule_match`` function is registered on each connection.
+
+    :param config: The database configuration to use
+    :type config: dict
+    """
+    logger.debug(f'Creating engine for {config["dsn"]}')
+    url = make_url(config['dsn'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        engine = create_async_engine(url)
+    else:
+        pool = config.get('pool', {})
+        engine = create_async_engine(
+            url,
+            poolclass=InstrumentedQueuePool,
+            pool_size=pool.get('size', 5),
+            max_overflow=pool.get('max_overflow', 10),
+            pool_timeout=pool.get('timeout', 30),
+            pool_pre_ping=pool.get('pre_ping', False),
+            pool_recycle=pool.get('recycle', -1),
+        )
+    if url.get_backend_name() == 'sqlite':
+        listen(engine.sync_engine, 'connect', register_functions)
+    return engine
+
+
+def create_sessionmaker(engine):
+    """Create a database sessionmaker bound to the given ``engine``."""
     logger.debug('Creating sessionmaker')
     return sessionmaker(
-        create_engine(dsn),
+        engine,
         expire_on_commit=False,
         class_=AsyncSession
     )
@@ -20,7 +20,7 @@ class Category(Base):
         data = json.loads(body)
         obj = Category(title=data['attributes']['title'])
         if 'relationships' in data and 'parent' in data['relationships']:
-            obj.parent_id = data['relationships']['parent']['data']['id']
+            obj.parent_id = int(data['relationships']['parent']['data']['id'])
         return obj
 
     def update(self, new_obj):
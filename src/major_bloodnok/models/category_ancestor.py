@@ -0,0 +1,17 @@
+"""Database model for the category ancestry closure table."""
+from sqlalchemy import Column, Integer, ForeignKey
+
+from .meta import Base
+
+
+class CategoryAncestor(Base):
+    """Category ancestry model class.
+
+    Links every category to itself and to each of its ancestors, together with the number of levels between them.
+    """
+
+    __tablename__ = 'category_ancestors'
+
+    ancestor_id = Column(Integer, ForeignKey('categories.id'), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey('categories.id'), primary_key=True, index=True)
+    depth = Column(Integer)
@@ -0,0 +1,17 @@
+"""Database model for data change events."""
+from sqlalchemy import Column, Integer, String, Text
+
+from .meta import Base
+
+
+class Event(Base):
+    """Event model class.
+
+    The ``payload`` is stored as encoded JSON, so that it can be sent to clients as it is.
+    """
+
+    __tablename__ = 'events'
+
+    id = Column(Integer, primary_key=True)
+    topic = Column(String(32))
+    payload = Column(Text)
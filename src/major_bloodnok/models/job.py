@@ -0,0 +1,61 @@
+"""Database model for background jobs."""
+import json
+
+from datetime import datetime
+from sqlalchemy import Column, Index, Integer, DateTime, String, Text
+
+from .meta import Base
+
+
+class Job(Base):
+    """Job model class.
+
+    The ``params`` and ``result`` are stored as JSON. The ``progress`` counts the units of work that have been
+    committed, out of an estimated ``total``. Times are in UTC.
+    """
+
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        Index('ix_jobs_status_queue', 'status', 'queue'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    type = Column(String(32))
+    queue = Column(String(255))
+    status = Column(String(16))
+    worker = Column(String(32))
+    params = Column(Text)
+    progress = Column(Integer)
+    total = Column(Integer)
+    result = Column(Text)
+    error = Column(Text)
+    created = Column(DateTime)
+    started = Column(DateTime)
+    finished = Column(DateTime)
+
+    def jsonapi(self):
+        """Return the Job in JSONAPI format.
+
+        The ``throughput`` is the number of units of work per second since the Job was last started.
+        """
+        throughput = None
+        if self.started is not None and self.progress:
+            elapsed = ((self.finished or datetime.utcnow()) - self.started).total_seconds()
+            if elapsed > 0:
+                throughput = round(self.progress / elapsed, 1)
+        return {
+            'type': 'jobs',
+            'id': str(self.id),
+            'attributes': {
+                'type': self.type,
+                'status': self.status,
+                'progress': self.progress,
+                'total': self.total,
+                'throughput': throughput,
+                'result': json.loads(self.result) if self.result else None,
+                'error': self.error,
+                'created': self.created.isoformat() + 'Z' if self.created else None,
+                'started': self.started.isoformat() + 'Z' if self.started else None,
+                'finished': self.finished.isoformat() + 'Z' if self.finished else None,
+            }
+        }
@@ -0,0 +1,23 @@
+"""Database model for the monthly transaction totals."""
+from sqlalchemy import Column, Index, Integer, Date, String, ForeignKey
+
+from .meta import Base
+from ..amounts import Amount
+
+
+class MonthlyTotal(Base):
+    """Monthly total model class.
+
+    Holds the sum in pence and number of the transactions in each month, direction, and category.
+    """
+
+    __tablename__ = 'monthly_totals'
+    __table_args__ = (
+        Index('ix_monthly_totals_direction_month', 'direction', 'month'),
+    )
+
+    month = Column(Date, primary_key=True)
+    direction = Column(String(16), primary_key=True)
+    category_id = Column(Integer, ForeignKey('categories.id'), primary_key=True)
+    amount = Column(Amount)
+    count = Column(Integer)
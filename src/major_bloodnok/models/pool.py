@@ -0,0 +1,83 @@
+"""Instrumented database connection pool."""
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from time import perf_counter
+
+
+class PoolStatistics():
+    """Checkout and wait-time statistics for a connection pool."""
+
+    def __init__(self):
+        """Create new statistics without any checkouts."""
+        self.checkouts = 0
+        self.checkins = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_checkout(self, wait: float):
+        """Record a single checkout that had to wait ``wait`` seconds.
+
+        :param wait: The time spent waiting for the connection
+        :type wait: float
+        """
+        self.checkouts = self.checkouts + 1
+        self.wait_total = self.wait_total + wait
+        if wait > self.wait_max:
+            self.wait_max = wait
+
+    def record_checkin(self):
+        """Record a single checkin."""
+        self.checkins = self.checkins + 1
+
+    def as_dict(self) -> dict:
+        """Return the statistics as a dictionary."""
+        return {
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'wait_total': self.wait_total,
+            'wait_mean': self.wait_total / self.checkouts if self.checkouts else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Asyncio queue pool that records checkout and wait-time statistics."""
+
+    def __init__(self, *args, **kwargs):
+        """Create a new pool with empty statistics, passing all arguments on to the queue pool."""
+        super().__init__(*args, **kwargs)
+        self.statistics = PoolStatistics()
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.statistics.record_checkout(perf_counter() - start)
+
+    def _do_return_conn(self, conn):
+        self.statistics.record_checkin()
+        super()._do_return_conn(conn)
+
+    def recreate(self):
+        """Recreate the pool, keeping the statistics collected so far."""
+        pool = super().recreate()
+        pool.statistics = self.statistics
+        return pool
+
+
+def pool_statistics(engine) -> dict:
+    """Return the current pool statistics for the given ``engine``.
+
+    :param engine: The engine to report on
+    :type engine: :class:`~sqlalchemy.ext.asyncio.AsyncEngine`
+    :return: The statistics or ``None`` if the engine's pool is not instrumented
+    :rtype: dict
+    """
+    pool = engine.sync_engine.pool
+    if isinstance(pool, InstrumentedQueuePool):
+        stats = pool.statistics.as_dict()
+        stats['size'] = pool.size()
+        stats['checked_out'] = pool.checkedout()
+        stats['overflow'] = pool.overflow()
+        return stats
+    return None
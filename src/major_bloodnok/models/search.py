@@ -0,0 +1,92 @@
+"""Trigram search index over the transaction descriptions.
+
+On SQLite the index is an external content FTS5 table with the ``trigram`` tokenizer. New transactions are indexed in
+bulk with :func:`~major_bloodnok.search.index_transactions`, in the same transaction that inserts them, which is much
+faster than indexing them one by one in a trigger. Changed and deleted transactions are kept in sync by triggers.
+"""
+import re
+
+from functools import lru_cache
+from sqlalchemy import Integer, String, text
+from sqlalchemy.sql import table, column
+
+
+SEARCH_TABLE = 'transactions_search'
+TRIGRAM_LENGTH = 3
+
+search_table = table(SEARCH_TABLE, column('rowid', Integer), column('description', String))
+
+SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(description, content='transactions', "
+    "content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON transactions BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description) VALUES ('delete', old.id, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF description ON transactions BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, description) VALUES ('delete', old.id, old.description); "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+]
+
+
+def create_search_index(conn) -> bool:
+    """Create the search index and its triggers, if they do not exist yet.
+
+    If the index is new, the existing transactions are indexed. Other databases than SQLite have no search index.
+
+    :param conn: The database connection to use
+    :return: Whether the index was created
+    :rtype: bool
+    """
+    if conn.dialect.name != 'sqlite':
+        return False
+    exists = conn.execute(text('SELECT 1 FROM sqlite_master WHERE name = :name'), {'name': SEARCH_TABLE}).first()
+    for statement in SEARCH_DDL:
+        conn.execute(text(statement))
+    if not exists:
+        rebuild_search_index(conn)
+    return not exists
+
+
+def rebuild_search_index(conn):
+    """Rebuild the search index from the transactions.
+
+    :param conn: The database connection to use
+    """
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')"))
+
+
+def drop_search_index(conn):
+    """Drop the search index and its triggers.
+
+    :param conn: The database connection to use
+    """
+    if conn.dialect.name == 'sqlite':
+        for name in ('delete', 'update'):
+            conn.execute(text(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{name}'))
+        conn.execute(text(f'DROP TABLE IF EXISTS {SEARCH_TABLE}'))
+
+
+@lru_cache(maxsize=64)
+def _compile(pattern: str):
+    return re.compile(pattern)
+
+
+def rule_match(pattern: str, description: str) -> bool:
+    """Return whether the Rule ``pattern`` matches the ``description``, in the same way as the Rules are applied.
+
+    This is registered as the ``rule_match`` SQL function on SQLite connections.
+
+    :param pattern: The regular expression pattern
+    :type pattern: str
+    :param description: The transaction's description
+    :type description: str
+    :rtype: bool
+    """
+    if description is None:
+        return False
+    return _compile(pattern).match(description) is not None
+
+
+def register_functions(dbapi_connection, connection_record):
+    """Register the SQL functions on a new SQLite ``dbapi_connection``."""
+    dbapi_connection.create_function('rule_match', 2, rule_match, deterministic=True)
@@ -1,19 +1,30 @@
 """Database model for account transactions."""
-from sqlalchemy import Column, Integer, Date, Float, String, ForeignKey
+from sqlalchemy import Column, Index, Integer, Date, String, ForeignKey, event
 
 from .meta import Base
+from .search import create_search_index, drop_search_index
+from ..amounts import Amount, to_pounds
 
 
 class Transaction(Base):
-    """Transaction model class."""
+    """Transaction model class.
+
+    The ``amount`` is stored in integer pence and is output in pounds. The descriptions are indexed in the search
+    index, which is created and dropped with the table.
+    """
 
     __tablename__ = 'transactions'
+    __table_args__ = (
+        Index('ix_transactions_category_id_date', 'category_id', 'date'),
+        Index('ix_transactions_direction_date', 'direction', 'date'),
+        Index('ix_transactions_date_description_amount_direction', 'date', 'description', 'amount', 'direction'),
+    )
 
     id = Column(Integer, primary_key=True)
     category_id = Column(Integer, ForeignKey('categories.id'))
     date = Column(Date)
     description = Column(String(255))
-    amount = Column(Float)
+    amount = Column(Amount)
     direction = Column(String(16))
     initiator = Column(String(255))
 
@@ -25,7 +36,7 @@ class Transaction(Base):
             'attributes': {
                 'date': self.date.isoformat(),
                 'description': self.description,
-                'amount': self.amount,
+                'amount': to_pounds(self.amount),
                 'direction': self.direction,
                 'initiator': self.initiator
             },
@@ -38,3 +49,13 @@ class Transaction(Base):
                 }
             }
         }
+
+
+@event.listens_for(Transaction.__table__, 'after_create')
+def _create_search_index(target, connection, **kwargs):
+    create_search_index(connection)
+
+
+@event.listens_for(Transaction.__table__, 'before_drop')
+def _drop_search_index(target, connection, **kwargs):
+    drop_search_index(connection)
@@ -0,0 +1,216 @@
+"""Queries on the hot paths and the checks that they use the indexes."""
+from datetime import date
+from sqlalchemy import select, and_, or_, func, desc, literal_column, Date
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, ColumnElement, Executable
+
+from .models import Base, Category, CategoryAncestor, MonthlyTotal, Transaction
+from .search import pattern_condition, search_condition
+
+
+def uncategorised_transactions(category_id: int):
+    """Create the query for the Transactions in the uncategorised Category, newest first.
+
+    :param category_id: The id of the uncategorised Category
+    :type category_id: int
+    """
+    return select(Transaction).filter(Transaction.category_id == category_id).\
+        order_by(desc(Transaction.date), desc(Transaction.id))
+
+
+def matching_transactions(condition):
+    """Create the query for the Transactions that match the ``condition``, newest first.
+
+    :param condition: The condition that the Transactions must match
+    """
+    return select(Transaction).filter(condition).order_by(desc(Transaction.date), desc(Transaction.id))
+
+
+def duplicate_candidates(start_date: date, end_date: date):
+    """Create the query for the duplicate keys of the Transactions between ``start_date`` and ``end_date``.
+
+    :param start_date: The first date to include
+    :type start_date: date
+    :param end_date: The last date to include
+    :type end_date: date
+    """
+    return select(Transaction.date, Transaction.description, Transaction.amount, Transaction.direction).\
+        filter(and_(Transaction.date >= start_date, Transaction.date <= end_date))
+
+
+def category_groups(category_id: int = None):
+    """Create the condition for the Categories that the amounts are summed per.
+
+    By default these are the top-level Categories. If the ``category_id`` is given, then these are the children of
+    that Category and the Category itself, which sums the amounts directly in it. The condition applies to the
+    ``Category`` joined as the ancestor in the ``CategoryAncestor`` index.
+
+    :param category_id: The optional id of the Category to sum the children of
+    :type category_id: int
+    """
+    if category_id is not None:
+        return or_(Category.parent_id == category_id, and_(Category.id == category_id, CategoryAncestor.depth == 0))
+    return Category.parent_id.is_(None)
+
+
+def period_totals(direction: str, start_date: date, end_date: date, category_id: int = None):
+    """Create the query for the total amount per Category in a period.
+
+    By default the amounts are summed per top-level Category. If the ``category_id`` is given, then the amounts are
+    summed per child of that Category, with the amounts directly in that Category summed separately.
+
+    :param direction: The direction of the Transactions to sum
+    :type direction: str
+    :param start_date: The first month to include
+    :type start_date: date
+    :param end_date: The first month after the period
+    :type end_date: date
+    :param category_id: The optional id of the Category to sum the children of
+    :type category_id: int
+    """
+    amount = func.sum(MonthlyTotal.amount)
+    return select(Category.id, Category.title, amount).\
+        join(CategoryAncestor, CategoryAncestor.descendant_id == MonthlyTotal.category_id).\
+        join(Category, Category.id == CategoryAncestor.ancestor_id).\
+        filter(and_(category_groups(category_id),
+                    MonthlyTotal.direction == direction,
+                    MonthlyTotal.month >= start_date,
+                    MonthlyTotal.month < end_date)).\
+        group_by(Category.id, Category.title).\
+        having(amount > 0).\
+        order_by(desc(amount))
+
+
+class DateBucket(ColumnElement):
+    """Start of the ``day``, ``week``, ``month``, or ``year`` bucket that a date is in.
+
+    Weeks start on Mondays.
+    """
+
+    inherit_cache = False
+    type = Date()
+
+    def __init__(self, column, bucket: str):
+        """Create the bucket start of the dates in the ``column``.
+
+        :param column: The date column or expression
+        :type column: :class:`~sqlalchemy.sql.expression.ColumnElement`
+        :param bucket: The bucket size, one of ``day``, ``week``, ``month``, or ``year``
+        :type bucket: str
+        """
+        self.column = column
+        self.bucket = bucket
+
+
+@compiles(DateBucket)
+def _compile_date_bucket(element, compiler, **kwargs):
+    column = compiler.process(element.column, **kwargs)
+    if element.bucket == 'day':
+        return column
+    return f'CAST(date_trunc(\'{element.bucket}\', {column}) AS DATE)'
+
+
+@compiles(DateBucket, 'sqlite')
+def _compile_date_bucket_sqlite(element, compiler, **kwargs):
+    column = compiler.process(element.column, **kwargs)
+    if element.bucket == 'day':
+        return column
+    elif element.bucket == 'week':
+        return f"date({column}, '-6 days', 'weekday 1')"
+    return f"date({column}, 'start of {element.bucket}')"
+
+
+def bucket_totals(bucket: str, start_date: date, end_date: date, direction: str = None, category_id: int = None,
+                  monthly: bool = False):
+    """Create the query for the total amount and number of Transactions per bucket, Category, and direction.
+
+    The Categories are grouped as in :func:`~major_bloodnok.queries.period_totals`. If ``monthly`` is set, the totals
+    are read from the monthly totals, which requires ``month`` or ``year`` buckets and a period of whole months.
+    Otherwise they are summed from the Transactions.
+
+    :param bucket: The bucket size, one of ``day``, ``week``, ``month``, or ``year``
+    :type bucket: str
+    :param start_date: The first day to include
+    :type start_date: date
+    :param end_date: The last day to include
+    :type end_date: date
+    :param direction: The optional direction of the Transactions to sum
+    :type direction: str
+    :param category_id: The optional id of the Category to sum the children of
+    :type category_id: int
+    :param monthly: Whether to read the totals from the monthly totals
+    :type monthly: bool
+    """
+    if monthly:
+        source = MonthlyTotal
+        day, row_direction, category = MonthlyTotal.month, MonthlyTotal.direction, MonthlyTotal.category_id
+        amount, count = func.sum(MonthlyTotal.amount), func.sum(MonthlyTotal.count)
+    else:
+        source = Transaction
+        day, row_direction, category = Transaction.date, Transaction.direction, Transaction.category_id
+        amount, count = func.sum(Transaction.amount), func.count(Transaction.id)
+    date_bucket = DateBucket(day, bucket)
+    conditions = [category_groups(category_id), day >= start_date, day <= end_date]
+    if direction is not None:
+        conditions.append(row_direction == direction)
+    return select(date_bucket, Category.id, Category.title, row_direction, amount, count).\
+        select_from(source).\
+        join(CategoryAncestor, CategoryAncestor.descendant_id == category).\
+        join(Category, Category.id == CategoryAncestor.ancestor_id).\
+        filter(and_(*conditions)).\
+        group_by(date_bucket, Category.id, Category.title, row_direction)
+
+
+class Explain(Executable, ClauseElement):
+    """Query plan of a statement.
+
+    The statement is wrapped in an untyped ``SELECT *``, so that the rows of the plan are not processed as rows of
+    the statement. The wrapper at most adds a scan over the statement's results to the plan.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        """Create the query plan of the ``statement``.
+
+        :param statement: The statement to explain
+        :type statement: :class:`~sqlalchemy.sql.expression.Select`
+        """
+        self.statement = select(literal_column('*')).select_from(statement.subquery())
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kwargs):
+    if compiler.dialect.name == 'sqlite':
+        return 'EXPLAIN QUERY PLAN ' + compiler.process(element.statement, **kwargs)
+    return 'EXPLAIN ' + compiler.process(element.statement, **kwargs)
+
+
+HOT_QUERIES = {
+    'uncategorised listing': lambda: uncategorised_transactions(1),
+    'period analysis': lambda: period_totals('out', date(2000, 1, 1), date(2001, 1, 1)),
+    'weekly analytics': lambda: bucket_totals('week', date(2000, 1, 1), date(2000, 12, 31), 'out'),
+    'monthly analytics': lambda: bucket_totals('month', date(2000, 1, 1), date(2000, 12, 31), monthly=True),
+    'duplicate lookup': lambda: duplicate_candidates(date(2000, 1, 1), date(2000, 12, 31)),
+    'transaction search': lambda: matching_transactions(search_condition('TESCO', 'sqlite')),
+    'rule preview': lambda: matching_transactions(pattern_condition('^TESCO.*', 'sqlite')),
+}
+
+
+async def check_query_plans(session) -> dict:
+    """Check that the hot queries use the indexes.
+
+    A query uses the indexes if its plan contains no scans of a table that do not use an index.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :return: The ``(uses_index, plan)`` of each query in :data:`HOT_QUERIES`, keyed by the query's name
+    :rtype: dict
+    """
+    results = {}
+    for name, query in HOT_QUERIES.items():
+        plan = [' '.join(str(value) for value in row) for row in await session.execute(Explain(query()))]
+        full_scans = [line for line in plan if 'SCAN' in line.upper() and 'INDEX' not in line.upper()
+                      and any(word in Base.metadata.tables for word in line.split())]
+        results[name] = (not full_scans, plan)
+    return results
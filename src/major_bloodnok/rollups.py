@@ -0,0 +1,99 @@
+"""Maintenance of the monthly transaction totals."""
+import logging
+
+from datetime import date
+from sqlalchemy import select, insert, update, delete, bindparam, and_, func
+
+from .models import MonthlyTotal, Transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(day: date) -> date:
+    """Return the first day of the month that the ``day`` is in.
+
+    :param day: The day to get the month for
+    :type day: date
+    :return: The first day of the month
+    :rtype: date
+    """
+    return day.replace(day=1)
+
+
+def add_delta(deltas: dict, day: date, direction: str, category_id: int, amount: int, count: int = 1):
+    """Add a change in the totals to the ``deltas``.
+
+    :param deltas: The ``(amount, count)`` changes, keyed by ``(month, direction, category_id)``
+    :type deltas: dict
+    :param day: The date of the changed transactions
+    :type day: date
+    :param direction: The direction of the changed transactions
+    :type direction: str
+    :param category_id: The category of the changed transactions
+    :type category_id: int
+    :param amount: The change in the amount in pence
+    :type amount: int
+    :param count: The change in the number of transactions
+    :type count: int
+    """
+    key = (month_start(day), direction, category_id)
+    total = deltas.get(key, (0, 0))
+    deltas[key] = (total[0] + amount, total[1] + count)
+
+
+async def apply_deltas(session, deltas: dict):
+    """Apply the ``deltas`` to the monthly totals.
+
+    Existing totals are updated and new ones are inserted, each with a single ``executemany``.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param deltas: The ``(amount, count)`` changes, keyed by ``(month, direction, category_id)``
+    :type deltas: dict
+    """
+    if not deltas:
+        return
+    stmt = select(MonthlyTotal.month, MonthlyTotal.direction, MonthlyTotal.category_id).\
+        filter(MonthlyTotal.month.in_(set(key[0] for key in deltas)))
+    existing = set(tuple(row) for row in await session.execute(stmt))
+    updates = []
+    inserts = []
+    for (month, direction, category_id), (amount, count) in deltas.items():
+        if (month, direction, category_id) in existing:
+            updates.append({'b_month': month, 'b_direction': direction, 'b_category_id': category_id,
+                            'b_amount': amount, 'b_count': count})
+        else:
+            inserts.append({'month': month, 'direction': direction, 'category_id': category_id,
+                            'amount': amount, 'count': count})
+    if updates:
+        stmt = update(MonthlyTotal).filter(and_(
+            MonthlyTotal.month == bindparam('b_month'),
+            MonthlyTotal.direction == bindparam('b_direction'),
+            MonthlyTotal.category_id == bindparam('b_category_id')
+        )).values(amount=MonthlyTotal.amount + bindparam('b_amount'),
+                  count=MonthlyTotal.count + bindparam('b_count'))
+        await session.execute(stmt.execution_options(synchronize_session=False), updates)
+    if inserts:
+        await session.execute(insert(MonthlyTotal), inserts)
+
+
+async def rebuild_rollups(session):
+    """Rebuild all monthly totals from the transactions.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    """
+    stmt = select(Transaction.date, Transaction.direction, Transaction.category_id, func.sum(Transaction.amount),
+                  func.count(Transaction.id)).\
+        group_by(Transaction.date, Transaction.direction, Transaction.category_id)
+    deltas = {}
+    for day, direction, category_id, amount, count in await session.execute(stmt):
+        add_delta(deltas, day, direction, category_id, amount, count)
+    await session.execute(delete(MonthlyTotal))
+    if deltas:
+        await session.execute(insert(MonthlyTotal), [
+            {'month': month, 'direction': direction, 'category_id': category_id, 'amount': amount, 'count': count}
+            for (month, direction, category_id), (amount, count) in deltas.items()
+        ])
+    logger.debug(f'Rebuilt {len(deltas)} monthly totals')
@@ -0,0 +1,242 @@
+"""Rule-based categorisation of transactions."""
+import logging
+import re
+
+from sqlalchemy import select, update, and_
+
+from .executor import run
+from .models import Rule, Transaction
+from .rollups import add_delta, apply_deltas
+
+
+logger = logging.getLogger(__name__)
+
+
+PREFIX_LENGTH = 4
+UPDATE_BATCH_SIZE = 500
+METACHARACTERS = frozenset('.^$*+?{}[]|()\\')
+compiled_engines = {}
+
+
+def literal_prefix(pattern: str) -> str:
+    """Determine the literal prefix that every match of the ``pattern`` must start with.
+
+    Only the first :data:`PREFIX_LENGTH` characters are considered. Patterns that contain an alternation anywhere
+    are treated as having no literal prefix.
+
+    :param pattern: The regular expression pattern
+    :type pattern: str
+    :return: The literal prefix, which can be empty
+    :rtype: str
+    """
+    if '|' in pattern:
+        return ''
+    prefix = []
+    pos = 1 if pattern.startswith('^') else 0
+    while pos < len(pattern) and len(prefix) < PREFIX_LENGTH:
+        if pattern[pos] == '\\' and pos + 1 < len(pattern) and not pattern[pos + 1].isalnum():
+            literal = pattern[pos + 1]
+            step = 2
+        elif pattern[pos] not in METACHARACTERS:
+            literal = pattern[pos]
+            step = 1
+        else:
+            break
+        if pattern[pos + step:pos + step + 1] in ('*', '+', '?', '{'):
+            break
+        prefix.append(literal)
+        pos = pos + step
+    return ''.join(prefix)
+
+
+class RuleEngine():
+    """Compiled set of categorisation rules.
+
+    The rules are grouped by their direction and indexed by the literal prefix of their pattern, so that a
+    transaction is only matched against the rules that can possibly match it. Within each prefix, consecutive rules
+    are combined into a single regular expression alternation, with each rule's pattern wrapped in its own group,
+    which is used to identify the matching rule. Patterns that contain groups or global flags cannot be combined
+    safely and are matched on their own. If more than one rule matches, the rule that was created first wins.
+    """
+
+    def __init__(self, rules: list):
+        """Compile the given ``rules``.
+
+        :param rules: The ``(id, pattern, direction, category_id)`` of each rule in priority order
+        :type rules: list[tuple]
+        """
+        self._source = tuple(tuple(rule) for rule in rules)
+        runs = {}
+        self._rules = []
+        default_flags = re.compile('').flags
+        for rule_id, pattern, direction, category_id in rules:
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                logger.warning(f'Ignoring invalid rule pattern {pattern}: {e}')
+                continue
+            priority = len(self._rules)
+            self._rules.append((rule_id, category_id))
+            combinable = compiled.groups == 0 and compiled.flags == default_flags
+            prefix = literal_prefix(pattern) if compiled.flags == default_flags else ''
+            segments = runs.setdefault(direction, {}).setdefault(prefix, [])
+            if combinable:
+                if segments and isinstance(segments[-1], list):
+                    segments[-1].append((pattern, priority))
+                else:
+                    segments.append([(pattern, priority)])
+            else:
+                segments.append((compiled, (priority, )))
+        self._index = {}
+        for direction, prefixes in runs.items():
+            self._index[direction] = {}
+            for prefix, segments in prefixes.items():
+                self._index[direction][prefix] = [
+                    (re.compile('|'.join(f'({pattern})' for pattern, _ in segment)),
+                     tuple(priority for _, priority in segment))
+                    if isinstance(segment, list) else segment for segment in segments
+                ]
+
+    def __reduce__(self):
+        """Pickle the engine as its rules, so that it can be sent to a process executor."""
+        return (restore_engine, (self._source, ))
+
+    @classmethod
+    async def load(cls, session) -> 'RuleEngine':
+        """Load and compile all rules from the database.
+
+        :param session: The database session to load the rules with
+        :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+        :return: The compiled rules
+        :rtype: :class:`~major_bloodnok.rules.RuleEngine`
+        """
+        stmt = select(Rule.id, Rule.description, Rule.direction, Rule.category_id).order_by(Rule.id)
+        return cls(list(await session.execute(stmt)))
+
+    def match(self, description: str, direction: str) -> tuple:
+        """Find the first rule that matches a single transaction.
+
+        :param description: The transaction's description
+        :type description: str
+        :param direction: The transaction's direction
+        :type direction: str
+        :return: The ``(id, category_id)`` of the first matching rule or ``None`` if no rule matches
+        :rtype: tuple
+        """
+        prefixes = self._index.get(direction)
+        if not prefixes:
+            return None
+        best = None
+        for length in range(min(len(description), PREFIX_LENGTH) + 1):
+            for regex, priorities in prefixes.get(description[:length], ()):
+                if best is not None and priorities[0] > best:
+                    break
+                match = regex.match(description)
+                if match:
+                    priority = priorities[match.lastindex - 1] if len(priorities) > 1 else priorities[0]
+                    if best is None or priority < best:
+                        best = priority
+                    break
+        if best is not None:
+            return self._rules[best]
+        return None
+
+    def classify(self, description: str, direction: str) -> int:
+        """Classify a single transaction.
+
+        :param description: The transaction's description
+        :type description: str
+        :param direction: The transaction's direction
+        :type direction: str
+        :return: The id of the category of the first matching rule or ``None`` if no rule matches
+        :rtype: int
+        """
+        rule = self.match(description, direction)
+        if rule is not None:
+            return rule[1]
+        return None
+
+
+def restore_engine(rules: tuple) -> RuleEngine:
+    """Restore a pickled :class:`~major_bloodnok.rules.RuleEngine`.
+
+    The most recently restored engine is kept, so that a process executor only compiles the rules again when they
+    change.
+
+    :param rules: The ``(id, pattern, direction, category_id)`` of each rule in priority order
+    :type rules: tuple
+    :return: The compiled rules
+    :rtype: :class:`~major_bloodnok.rules.RuleEngine`
+    """
+    engine = compiled_engines.get(rules)
+    if engine is None:
+        compiled_engines.clear()
+        engine = RuleEngine(rules)
+        compiled_engines[rules] = engine
+    return engine
+
+
+def match_transactions(engine: RuleEngine, transactions: list) -> list:
+    """Match the ``transactions`` against the rules in the ``engine``.
+
+    This does not use the database, so that it can run in an executor.
+
+    :param engine: The compiled rules to match with
+    :type engine: :class:`~major_bloodnok.rules.RuleEngine`
+    :param transactions: The ``(id, description, direction, date, amount)`` of each transaction
+    :type transactions: list[tuple]
+    :return: The ``(transaction, rule)`` pairs of the transactions that match a rule, with the ``rule`` as returned
+             by :meth:`~major_bloodnok.rules.RuleEngine.match`
+    :rtype: list[tuple]
+    """
+    matches = []
+    for transaction in transactions:
+        rule = engine.match(transaction[1], transaction[2])
+        if rule is not None:
+            matches.append((transaction, rule))
+    return matches
+
+
+async def apply_rules(session, engine: RuleEngine, category_id: int, dry_run: bool = False,
+                      executor=None) -> dict:
+    """Apply the rules in the ``engine`` to all uncategorised transactions.
+
+    The matches are computed in memory, in the ``executor`` if one is given, and written back with one ``UPDATE`` per
+    target category, each restricted to batches of :data:`UPDATE_BATCH_SIZE` transaction ids. The monthly totals are
+    updated to match.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param engine: The compiled rules to apply
+    :type engine: :class:`~major_bloodnok.rules.RuleEngine`
+    :param category_id: The id of the uncategorised Category
+    :type category_id: int
+    :param dry_run: Only count the matching transactions without updating them
+    :type dry_run: bool
+    :param executor: The optional executor to match the transactions in
+    :type executor: :class:`~concurrent.futures.Executor`
+    :return: The number of transactions affected by each rule, keyed by the rule's id
+    :rtype: dict
+    """
+    stmt = select(Transaction.id, Transaction.description, Transaction.direction, Transaction.date,
+                  Transaction.amount).filter(Transaction.category_id == category_id)
+    transactions = [tuple(row) for row in await session.execute(stmt)]
+    affected = {}
+    updates = {}
+    deltas = {}
+    matches = await run(executor, match_transactions, engine, transactions)
+    for (transaction_id, _, direction, day, amount), rule in matches:
+        affected[rule[0]] = affected.get(rule[0], 0) + 1
+        updates.setdefault(rule[1], []).append(transaction_id)
+        add_delta(deltas, day, direction, category_id, -amount, -1)
+        add_delta(deltas, day, direction, rule[1], amount)
+    if not dry_run:
+        for target_id, transaction_ids in updates.items():
+            for offset in range(0, len(transaction_ids), UPDATE_BATCH_SIZE):
+                stmt = update(Transaction).filter(and_(
+                    Transaction.id.in_(transaction_ids[offset:offset + UPDATE_BATCH_SIZE]),
+                    Transaction.category_id == category_id
+                )).values(category_id=target_id).execution_options(synchronize_session=False)
+                await session.execute(stmt)
+        await apply_deltas(session, deltas)
+    return affected
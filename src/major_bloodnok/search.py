@@ -0,0 +1,104 @@
+"""Search for transactions by their description."""
+import re
+
+from sqlalchemy import select, insert, and_, func
+
+from .models import Transaction
+from .models.search import TRIGRAM_LENGTH, search_table
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+
+def _phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def required_literals(pattern: str) -> list:
+    """Determine the literal strings that every match of the ``pattern`` must contain.
+
+    Only the runs of literal characters at the top level of the pattern are considered, so the result may miss some
+    required literals, but never contains a string that a match does not contain.
+
+    :param pattern: The regular expression pattern
+    :type pattern: str
+    :return: The required literals
+    :rtype: list[str]
+    :raises re.error: If the ``pattern`` is not a valid regular expression
+    """
+    literals = []
+    run = []
+    for op, value in sre_parse.parse(pattern):
+        if op == sre_parse.LITERAL:
+            run.append(chr(value))
+        else:
+            if run:
+                literals.append(''.join(run))
+            run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def _indexed(values: list):
+    """Return the condition that the descriptions contain all ``values``, using the search index."""
+    return Transaction.id.in_(select(search_table.c.rowid).
+                              filter(search_table.c.description.match(' AND '.join(_phrase(v) for v in values))))
+
+
+async def index_transactions(session, after_id: int):
+    """Add the Transactions with an id after the ``after_id`` to the search index.
+
+    :param session: The database session to use
+    :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+    :param after_id: The largest id of the Transactions that are already indexed
+    :type after_id: int
+    """
+    if session.bind.dialect.name == 'sqlite':
+        await session.execute(insert(search_table).from_select(
+            ['rowid', 'description'],
+            select(Transaction.id, Transaction.description).filter(Transaction.id > after_id)
+        ))
+
+
+def search_condition(query: str, dialect: str):
+    """Create the condition for the Transactions whose description contains the ``query``, ignoring case.
+
+    On SQLite, queries of at least :data:`~major_bloodnok.models.search.TRIGRAM_LENGTH` characters use the trigram
+    search index. Shorter queries and other databases scan the descriptions.
+
+    :param query: The text to search for
+    :type query: str
+    :param dialect: The name of the database dialect
+    :type dialect: str
+    """
+    if dialect == 'sqlite' and len(query) >= TRIGRAM_LENGTH:
+        return _indexed([query])
+    return Transaction.description.ilike('%' + _escape_like(query) + '%', escape='\\')
+
+
+def pattern_condition(pattern: str, dialect: str):
+    """Create the condition for the Transactions whose description a Rule with the ``pattern`` would match.
+
+    The Transactions are matched with the ``rule_match`` SQL function, which is only registered on SQLite. If the
+    ``pattern`` contains literals of at least :data:`~major_bloodnok.models.search.TRIGRAM_LENGTH` characters, only
+    the Transactions that the search index finds for them are matched.
+
+    :param pattern: The regular expression pattern of the Rule
+    :type pattern: str
+    :param dialect: The name of the database dialect
+    :type dialect: str
+    :raises re.error: If the ``pattern`` is not a valid regular expression
+    """
+    re.compile(pattern)
+    condition = func.rule_match(pattern, Transaction.description)
+    literals = [literal for literal in required_literals(pattern) if len(literal) >= TRIGRAM_LENGTH]
+    if dialect == 'sqlite' and literals:
+        return and_(_indexed(literals), condition)
+    return condition
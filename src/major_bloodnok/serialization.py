@@ -0,0 +1,140 @@
+"""Fast JSON:API serialization of model rows."""
+from datetime import date
+from json.encoder import encode_basestring_ascii
+
+from .amounts import Amount, PENCE
+from .models import Category, Rule, Transaction
+
+
+def _encode_string(value) -> str:
+    if value is None:
+        return 'null'
+    return encode_basestring_ascii(value).replace('</', '<\\/')
+
+
+def _encode_number(value) -> str:
+    if value is None:
+        return 'null'
+    return repr(value)
+
+
+def _encode_amount(value) -> str:
+    if value is None:
+        return 'null'
+    return repr(value / PENCE)
+
+
+def _encode_date(value) -> str:
+    if value is None:
+        return 'null'
+    return '"' + value.isoformat() + '"'
+
+
+def _encode_id(value) -> str:
+    if value is None:
+        return 'null'
+    return '"' + str(value) + '"'
+
+
+ENCODERS = {
+    str: _encode_string,
+    int: _encode_number,
+    float: _encode_number,
+    date: _encode_date,
+    Amount: _encode_amount,
+}
+
+
+def _relationship_encoder(name: str, type_: str, optional: bool):
+    """Create the encoder for a to-one relationship.
+
+    :param name: The name of the relationship
+    :type name: str
+    :param type_: The JSON:API type of the related resource
+    :type type_: str
+    :param optional: Whether to leave out the relationship if there is no related resource
+    :type optional: bool
+    """
+    prefix = encode_basestring_ascii(name) + ': {"data": {"type": ' + encode_basestring_ascii(type_) + ', "id": "'
+    empty = '' if optional else encode_basestring_ascii(name) + ': {"data": null}'
+
+    def encode(value) -> str:
+        if value is None:
+            return empty
+        return prefix + str(value) + '"}}'
+
+    return encode
+
+
+class Serializer(object):
+    """Serializer that encodes rows of model columns as JSON:API resource objects.
+
+    The rows are selected from the :attr:`~Serializer.columns`, which avoids creating model instances. The function
+    that encodes a row is compiled once for each serializer, so that encoding only calls the encoder of each value and
+    joins the results. Values are encoded by the encoder for their column's type, falling back to the encoder for
+    their Python type. The output is the same as encoding the model's ``jsonapi()`` with Tornado's ``json_encode``.
+    """
+
+    def __init__(self, type_: str, id_column, attributes: dict, relationships: dict = None):
+        """Create a new serializer.
+
+        :param type_: The JSON:API type of the resources
+        :type type_: str
+        :param id_column: The column with the resource ids
+        :param attributes: The columns of the attributes, keyed by the attribute name
+        :type attributes: dict
+        :param relationships: The ``(type, column, optional)`` of the to-one relationships, keyed by the relationship
+                              name. Optional relationships are left out if there is no related resource.
+        :type relationships: dict
+        """
+        relationships = relationships or {}
+        self.type = type_
+        self.columns = [id_column] + list(attributes.values()) + [column for _, column, _ in relationships.values()]
+        self._keys = [column.key for column in self.columns]
+        namespace = {'_id': _encode_id}
+        parts = [repr('{"type": ' + encode_basestring_ascii(type_) + ', "id": '), '_id(row[0])']
+        separator = ', "attributes": {'
+        for idx, (name, column) in enumerate(attributes.items(), start=1):
+            encoder = f'_attr{idx}'
+            namespace[encoder] = ENCODERS.get(type(column.type)) or ENCODERS[column.type.python_type]
+            parts.append(repr(separator + encode_basestring_ascii(name) + ': '))
+            parts.append(f'{encoder}(row[{idx}])')
+            separator = ', '
+        parts.append(repr('}, "relationships": {' if attributes else ', "attributes": {}, "relationships": {'))
+        encoded_relationships = []
+        for idx, (name, (related_type, _, optional)) in enumerate(relationships.items(), start=1 + len(attributes)):
+            namespace[f'_rel{idx}'] = _relationship_encoder(name, related_type, optional)
+            encoded_relationships.append(f'_rel{idx}(row[{idx}]), ')
+        if encoded_relationships:
+            parts.append(f'", ".join(filter(None, ({"".join(encoded_relationships)})))')
+        parts.append(repr('}}'))
+        source = f'def encode(row):\n    return "".join(({", ".join(parts)}))\n'
+        exec(compile(source, f'<serializer {type_}>', 'exec'), namespace)
+        self.encode = namespace['encode']
+
+    def index(self, column) -> int:
+        """Return the index of the ``column`` in the selected rows.
+
+        :param column: The column to find
+        :return: The index of the column
+        :rtype: int
+        """
+        return self._keys.index(column.key)
+
+
+SERIALIZERS = {
+    Transaction: Serializer('transactions', Transaction.id,
+                            {'date': Transaction.date,
+                             'description': Transaction.description,
+                             'amount': Transaction.amount,
+                             'direction': Transaction.direction,
+                             'initiator': Transaction.initiator},
+                            {'category': ('categories', Transaction.category_id, False)}),
+    Category: Serializer('categories', Category.id,
+                         {'title': Category.title},
+                         {'parent': ('categories', Category.parent_id, True)}),
+    Rule: Serializer('rules', Rule.id,
+                     {'pattern': Rule.description,
+                      'direction': Rule.direction},
+                     {'category': ('categories', Rule.category_id, False)}),
+}
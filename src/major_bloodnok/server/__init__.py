@@ -1,37 +1,205 @@
 """Frontend web server."""
 import asyncio
 import logging
+import os
+import signal
 
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import PeriodicCallback
+from tornado.netutil import bind_sockets
 from tornado.web import Application, RedirectHandler
 
 from .frontend import FrontendHandler
+from .metrics import InstrumentedApplication, MetricsHandler
 from .api import (DashboardCollectionHandler, TransactionCollectionHandler, TransactionItemHandler,
                   UncategorisedTransactionCollectionHandler, CategoriesCollectionHandler, CategoriesItemHandler,
-                  RulesCollectionHandler, AnalysisTimePeriodsCollectionHandler, AnalysisCollectionHandler)
+                  RulesCollectionHandler, RulesApplyHandler, RulesPreviewHandler, JobItemHandler, EventsHandler,
+                  AnalysisTimePeriodsCollectionHandler, AnalysisCollectionHandler, AnalyticsHandler)
+from ..analytics import create_analytics
+from ..cache import Cache, Versions
+from ..events import EventBus
+from ..executor import create_executor
+from ..importer import StatementFormat, register_format
+from ..jobs import JobQueue
+from ..metrics import Metrics
+from ..models import create_engine, create_sessionmaker, pool_statistics
 
 
 logger = logging.getLogger(__name__)
 
 
+def create_application(config: dict, sessionmaker, versions: Versions = None, executor=None,
+                       metrics: Metrics = None) -> Application:
+    """Create the web application.
+
+    The application owns the :class:`~major_bloodnok.cache.Cache` of Categories and Rules, the
+    :class:`~major_bloodnok.events.EventBus`, and the :class:`~major_bloodnok.jobs.JobQueue` that all handlers share.
+    The bus and the queue are available as the ``events`` and ``jobs`` settings and must be started by the caller.
+    The analytics backend is created from the ``analytics`` settings and also shared by all handlers.
+    The ``server.debug`` setting enables debug mode, but automatic reloading is only enabled when running a single
+    worker process. Additional statement formats are registered from the ``importer.formats`` settings, each of which
+    holds the arguments of a :class:`~major_bloodnok.importer.StatementFormat`. If ``metrics`` are given, every request
+    and background job is recorded in them, responses carry a ``Server-Timing`` header, and the metrics are served at
+    ``/metrics``.
+
+    :param config: The configuration to use
+    :type config: dict
+    :param sessionmaker: The shared sessionmaker that all handlers use
+    :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+    :param versions: The version counters shared with the other worker processes
+    :type versions: :class:`~major_bloodnok.cache.Versions`
+    :param executor: The executor for CPU-heavy work or ``None`` to run it on the event loop
+    :type executor: :class:`~concurrent.futures.Executor`
+    :param metrics: The metrics to record the requests and jobs in or ``None`` to not record them
+    :type metrics: :class:`~major_bloodnok.metrics.Metrics`
+    :return: The new application
+    :rtype: :class:`~tornado.web.Application`
+    """
+    server_config = config.get('server', {})
+    debug = server_config.get('debug', True)
+    for format_config in config.get('importer', {}).get('formats', []):
+        register_format(StatementFormat(**format_config))
+    versions = versions or Versions()
+    cache = Cache(sessionmaker, versions)
+    events = EventBus(config, sessionmaker, versions)
+    jobs = JobQueue(config, sessionmaker, cache, events, executor, metrics)
+    analytics = create_analytics(config.get('analytics', {}), sessionmaker, cache, events)
+    handler_args = {'config': config, 'sessionmaker': sessionmaker, 'cache': cache, 'events': events,
+                    'executor': executor, 'jobs': jobs, 'analytics': analytics}
+    handlers = [
+        ('/', RedirectHandler, {'url': '/app', 'permanent': False}),
+        ('/app(.*)', FrontendHandler),
+        ('/api/dashboards', DashboardCollectionHandler, handler_args),
+        ('/api/transactions', TransactionCollectionHandler, handler_args),
+        ('/api/transactions/(?P<id>[0-9]+)', TransactionItemHandler, handler_args),
+        ('/api/uncategorised', UncategorisedTransactionCollectionHandler, handler_args),
+        ('/api/categories', CategoriesCollectionHandler, handler_args),
+        ('/api/categories/(?P<id>[0-9]+)', CategoriesItemHandler, handler_args),
+        ('/api/rules', RulesCollectionHandler, handler_args),
+        ('/api/rules/apply', RulesApplyHandler, handler_args),
+        ('/api/rules/preview', RulesPreviewHandler, handler_args),
+        ('/api/jobs/(?P<id>[0-9]+)', JobItemHandler, handler_args),
+        ('/api/events', EventsHandler, handler_args),
+        ('/api/analysis-time-periods', AnalysisTimePeriodsCollectionHandler, handler_args),
+        ('/api/analysis', AnalysisCollectionHandler, handler_args),
+        ('/api/analytics', AnalyticsHandler, handler_args)
+    ]
+    settings = {'debug': debug, 'autoreload': debug and server_config.get('workers', 1) == 1, 'events': events,
+                'jobs': jobs}
+    if metrics is None:
+        return Application(handlers, **settings)
+    handlers.append(('/metrics', MetricsHandler, {'metrics': metrics}))
+    return InstrumentedApplication(handlers, metrics, **settings)
+
+
+def log_pool_statistics(engine):
+    """Log the connection pool statistics for the given ``engine``."""
+    stats = pool_statistics(engine)
+    if stats is not None:
+        logger.info('Connection pool: ' + ', '.join(f'{key}={value}' for key, value in stats.items()))
+
+
+async def serve(config: dict, sockets: list, versions: Versions):
+    """Serve the web application on the ``sockets`` until SIGINT or SIGTERM is received.
+
+    The database engine and its connection pool, and the executor for CPU-heavy work are created in the serving
+    process and shared by all its requests. Unless ``metrics.enabled`` is ``False``, the requests, jobs, and SQL
+    statements of the process are recorded in its :class:`~major_bloodnok.metrics.Metrics`. The process also runs
+    background jobs and passes on data change events to its event streams. On shutdown, the event streams are closed,
+    running jobs are stopped, to be resumed by the next server, and the engine and executor are disposed of.
+
+    :param config: The configuration to use
+    :type config: dict
+    :param sockets: The bound sockets to serve on
+    :type sockets: list
+    :param versions: The version counters shared with the other worker processes
+    :type versions: :class:`~major_bloodnok.cache.Versions`
+    """
+    engine = create_engine(config['database'])
+    executor = create_executor(config.get('executor', {}))
+    metrics = None
+    if config.get('metrics', {}).get('enabled', True):
+        metrics = Metrics(config)
+        metrics.instrument(engine)
+    app = create_application(config, create_sessionmaker(engine), versions, executor, metrics)
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    app.settings['events'].start()
+    app.settings['jobs'].start()
+    report_interval = config['database'].get('pool', {}).get('report_interval')
+    reporter = None
+    if report_interval:
+        reporter = PeriodicCallback(lambda: log_pool_statistics(engine), report_interval * 1000)
+        reporter.start()
+    shutdown = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, shutdown.set)
+    logger.debug('Starting the web server')
+    await shutdown.wait()
+    logger.debug('Stopping the web server')
+    if reporter is not None:
+        reporter.stop()
+    server.stop()
+    await app.settings['events'].stop()
+    await server.close_all_connections()
+    await app.settings['jobs'].stop()
+    if executor is not None:
+        executor.shutdown()
+    log_pool_statistics(engine)
+    await engine.dispose()
+
+
+def fork_workers(count: int) -> bool:
+    """Fork ``count`` worker processes and supervise them.
+
+    In the parent process SIGINT and SIGTERM are forwarded to the workers and the function only returns once all
+    workers have exited.
+
+    :param count: The number of worker processes to fork
+    :type count: int
+    :return: ``True`` in the worker processes and ``False`` in the parent process
+    :rtype: bool
+    """
+    workers = set()
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            return True
+        workers.add(pid)
+    logger.debug(f'Started {count} worker processes')
+
+    def forward(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    while workers:
+        pid, status = os.wait()
+        workers.discard(pid)
+        if os.waitstatus_to_exitcode(status) != 0:
+            logger.warning(f'Worker process {pid} exited with status {os.waitstatus_to_exitcode(status)}')
+    logger.debug('All worker processes stopped')
+    return False
+
+
 def run_server(config):
-    """Run the web server."""
+    """Run the web server.
+
+    The ``server`` configuration section sets the ``host`` and ``port`` to listen on and the number of ``workers``.
+    With more than one worker, the sockets are bound and then the worker processes are forked, each of which creates
+    its own database connection pool. A ``workers`` setting of 0 forks one worker per CPU core.
+    """
     logger.debug('Setting up the web server')
-    app = Application(
-        [
-            ('/', RedirectHandler, {'url': '/app', 'permanent': False}),
-            ('/app(.*)', FrontendHandler),
-            ('/api/dashboards', DashboardCollectionHandler, {'config': config}),
-            ('/api/transactions', TransactionCollectionHandler, {'config': config}),
-            ('/api/transactions/(?P<id>[0-9]+)', TransactionItemHandler, {'config': config}),
-            ('/api/uncategorised', UncategorisedTransactionCollectionHandler, {'config': config}),
-            ('/api/categories', CategoriesCollectionHandler, {'config': config}),
-            ('/api/categories/(?P<id>[0-9]+)', CategoriesItemHandler, {'config': config}),
-            ('/api/rules', RulesCollectionHandler, {'config': config}),
-            ('/api/analysis-time-periods', AnalysisTimePeriodsCollectionHandler, {'config': config}),
-            ('/api/analysis', AnalysisCollectionHandler, {'config': config})
-        ],
-        debug=True
-    )
-    app.listen(6543)
-    logger.debug('Starting the web server')
-    asyncio.get_event_loop().run_forever()
+    server_config = config.get('server', {})
+    workers = server_config.get('workers', 1)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    sockets = bind_sockets(server_config.get('port', 6543), server_config.get('host'))
+    versions = Versions()
+    if workers == 1 or fork_workers(workers):
+        asyncio.run(serve(config, sockets, versions))
@@ -1,86 +1,264 @@
 """API Handlers."""
 import logging
-import dateparser
+import os
 import re
 
-from csv import DictReader
-from datetime import date, timedelta
-from io import StringIO
+from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime
 from sqlalchemy import select, and_, func, desc
-from tornado.web import RequestHandler, HTTPError
-
-from ..models import create_sessionmaker, Transaction, Category, Rule
+from tornado.escape import json_decode, json_encode
+from tornado.httputil import url_concat
+from tornado.iostream import StreamClosedError
+from tornado.web import RequestHandler, HTTPError, stream_request_body
+
+from ..amounts import to_pounds
+from ..analytics import BUCKETS, BucketTotals, bucket_starts
+from ..categories import CategoryCycleError, add_category, move_category, subtree
+from ..models import Job, Transaction, Category, MonthlyTotal, Rule
+from ..queries import period_totals, uncategorised_transactions
+from ..rules import apply_rules
+from ..search import pattern_condition, search_condition
+from ..serialization import SERIALIZERS
+from .pagination import after_cursor, decode_cursor, encode_cursor
 
 
 logger = logging.getLogger(__name__)
 
 
-async def apply_rule(session, rule):
-    async with session.begin():
-        uncategorised = (await session.execute(select(Category).
-                         filter(Category.title == 'Uncategorised'))).scalars().first()
-        transactions = (await session.execute(select(Transaction).
-                        filter(Transaction.category_id == uncategorised.id))).scalars()
-        for transaction in transactions:
-            if re.match(rule.description, transaction.description) and rule.direction == transaction.direction:
-                transaction.category_id = rule.category_id
-                session.add(transaction)
+STREAM_CHUNK_SIZE = 1000
 
 
-class CollectionHandler(RequestHandler):
-    """Generic handler for JSONAPI collections."""
+def format_event(event: str, data: str, event_id: int = None) -> str:
+    """Format a server-sent event.
+
+    :param event: The type of the event
+    :type event: str
+    :param data: The encoded JSON data of the event
+    :type data: str
+    :param event_id: The optional id of the event
+    :type event_id: int
+    :return: The formatted event
+    :rtype: str
+    """
+    if event_id is not None:
+        return f'id: {event_id}\nevent: {event}\ndata: {data}\n\n'
+    return f'event: {event}\ndata: {data}\n\n'
+
+
+class APIHandler(RequestHandler):
+    """Base handler for the API.
 
-    def initialize(self, config):
-        """Initialise with the given ``config``.
+    ``GET`` responses carry a strong ``Etag`` and a ``Last-Modified`` header derived from the data version in the
+    :class:`~major_bloodnok.cache.Cache`, which all write handlers change. Because the responses also depend on the
+    current date, the date is part of the ``Etag`` and the ``Last-Modified`` is never before the start of the day.
+    Conditional requests for unchanged data are answered with ``304 Not Modified`` before any database work is done.
+    Only the ``Etag`` is used for this, as the modification time has a resolution of one second and cannot tell apart
+    a response from before and one from after a change within the same second.
+    Handlers whose responses do not depend on the data version set :attr:`~APIHandler.versioned` to ``False``.
+    """
+
+    versioned = True
+
+    def initialize(self, config, sessionmaker, cache, events, executor, jobs, analytics):
+        """Initialise the handler with the shared application objects.
 
         :param config: The configuration to use
         :type config: dict
+        :param sessionmaker: The shared sessionmaker to create database sessions with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        :param cache: The shared cache of Categories and Rules
+        :type cache: :class:`~major_bloodnok.cache.Cache`
+        :param events: The shared bus to publish data changes to
+        :type events: :class:`~major_bloodnok.events.EventBus`
+        :param executor: The shared executor for CPU-heavy work
+        :type executor: :class:`~concurrent.futures.Executor`
+        :param jobs: The shared queue of background jobs
+        :type jobs: :class:`~major_bloodnok.jobs.JobQueue`
+        :param analytics: The shared analytics backend
+        :type analytics: :class:`~major_bloodnok.analytics.Analytics`
         """
         self._config = config
+        self._sessionmaker = sessionmaker
+        self._cache = cache
+        self._events = events
+        self._executor = executor
+        self._jobs = jobs
+        self._analytics = analytics
+
+    def compute_etag(self) -> str:
+        """Compute the Etag from the data version and the current date."""
+        if not self.versioned:
+            return super().compute_etag()
+        return f'"{self._cache.epoch}-{self._cache.data_version}-{date.today().isoformat()}"'
+
+    def last_modified(self) -> datetime:
+        """Return when the data was last changed, but no earlier than the start of the current day.
+
+        :return: The last modification time in UTC
+        :rtype: datetime
+        """
+        today = datetime.combine(date.today(), time()).astimezone(timezone.utc)
+        return max(self._cache.modified, today)
+
+    def prepare(self):
+        """Answer a conditional ``GET`` with ``304 Not Modified`` if its ``If-None-Match`` matches the ``Etag``."""
+        if self.request.method == 'GET' and self.versioned:
+            modified = self.last_modified()
+            self.set_header('Etag', self.compute_etag())
+            self.set_header('Last-Modified', format_datetime(modified, usegmt=True))
+            self.set_header('Cache-Control', 'no-cache')
+            if self.request.headers.get('If-None-Match') and self.check_etag_header():
+                self.set_status(304)
+                self.finish()
+
+    def category_filter(self) -> int:
+        """Return the id of the Category in the ``filter[category]`` argument.
+
+        :return: The id of the Category or ``None`` if the argument is not set
+        :rtype: int
+        :raises HTTPError: If the argument is not a valid id
+        """
+        category_id = self.get_argument('filter[category]', default=None)
+        if not category_id:
+            return None
+        try:
+            return int(category_id)
+        except ValueError:
+            raise HTTPError(400, 'Invalid filter[category]')
+
+    def write_job(self, job: Job):
+        """Write the submitted background ``job`` with a ``202 Accepted`` status.
+
+        :param job: The submitted job
+        :type job: :class:`~major_bloodnok.models.Job`
+        """
+        self.set_status(202)
+        self.set_header('Location', f'/api/jobs/{job.id}')
+        self.write({'data': job.jsonapi()})
 
-    async def get(self, cls, order=None):
+
+class CollectionHandler(APIHandler):
+    """Generic handler for JSONAPI collections."""
+
+    async def get(self, cls, keys=None, descending=False, condition=None):
         """Fetch all entries of the given ``cls``.
 
         :param cls: The class of objects to fetch
         :type cls: class
+        :param keys: The columns that uniquely order the entries, by default the ``id``
+        :type keys: list
+        :param descending: Whether to order the entries in descending order
+        :type descending: bool
+        :param condition: The optional condition that the entries must match
         """
         logger.debug(f'GET {cls.__name__}')
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
+        async with self._sessionmaker() as session:
             stmt = select(cls)
-            if order is not None:
-                stmt = stmt.order_by(order)
-            if self.get_argument('page[offset]', default=None):
-                stmt = stmt.offset(int(self.get_argument('page[offset]', '0')))
-                stmt = stmt.limit(int(self.get_argument('page[limit]', '30')))
-            result = await session.execute(stmt)
-            self.write({'data': [item.jsonapi() for item in result.scalars()]})
+            if condition is not None:
+                stmt = stmt.filter(condition)
+            await self.write_page(session, stmt, SERIALIZERS[cls], keys or [cls.id], descending)
+
+    def search(self, condition=None):
+        """Add the search for the ``filter[q]`` argument to the Transaction ``condition``, if the argument is set.
+
+        :param condition: The optional condition that the Transactions must match
+        :return: The combined condition
+        """
+        query = self.get_argument('filter[q]', default=None)
+        if not query:
+            return condition
+        search = search_condition(query, self._sessionmaker.kw['bind'].dialect.name)
+        return search if condition is None else and_(condition, search)
+
+    async def write_page(self, session, stmt, serializer, keys: list, descending: bool = False):
+        """Write a page of the entries selected by the ``stmt``.
+
+        If the ``page[offset]`` argument is set, the page starts at that offset. Otherwise, if the ``page[limit]`` or
+        ``page[after]`` arguments are set, the page starts after the cursor in ``page[after]`` and, if there may be
+        more entries, the URL of the next page is returned in ``links.next``. Cursors seek on the ``keys``, so that
+        fetching a page costs the same wherever it is in the collection. Without any of these arguments all entries
+        are written.
+
+        Only the ``serializer``'s columns are selected and the entries are streamed to the client in chunks of
+        :data:`STREAM_CHUNK_SIZE`, so that large pages are neither loaded into model instances nor held in memory.
+
+        :param session: The database session to use
+        :type session: :class:`~sqlalchemy.ext.asyncio.AsyncSession`
+        :param stmt: The statement selecting the entries
+        :type stmt: :class:`~sqlalchemy.sql.expression.Select`
+        :param serializer: The serializer for the entries
+        :type serializer: :class:`~major_bloodnok.serialization.Serializer`
+        :param keys: The columns that uniquely order the entries
+        :type keys: list
+        :param descending: Whether to order the entries in descending order
+        :type descending: bool
+        """
+        if descending:
+            stmt = stmt.order_by(None).order_by(*[desc(key) for key in keys])
+        else:
+            stmt = stmt.order_by(None).order_by(*keys)
+        try:
+            page_offset = int(self.get_argument('page[offset]', default=None) or '0')
+            page_limit = int(self.get_argument('page[limit]', default=None) or '30')
+        except ValueError:
+            raise HTTPError(400, 'Invalid page[offset] or page[limit]')
+        if page_offset < 0 or page_limit < 1:
+            raise HTTPError(400, 'Invalid page[offset] or page[limit]')
+        limit = None
+        if self.get_argument('page[offset]', default=None):
+            stmt = stmt.offset(page_offset)
+            stmt = stmt.limit(page_limit)
+        elif self.get_argument('page[limit]', default=None) or self.get_argument('page[after]', default=None):
+            limit = page_limit
+            if self.get_argument('page[after]', default=None):
+                try:
+                    values = decode_cursor(self.get_argument('page[after]'), keys)
+                except ValueError:
+                    raise HTTPError(400, 'Invalid page[after] cursor')
+                stmt = stmt.filter(after_cursor(keys, values, descending))
+            stmt = stmt.limit(limit)
+        stmt = stmt.with_only_columns(*serializer.columns)
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write('{"data": [')
+        count = 0
+        last = None
+        result = await session.stream(stmt)
+        async for rows in result.partitions(STREAM_CHUNK_SIZE):
+            if count:
+                self.write(', ')
+            self.write(', '.join([serializer.encode(row) for row in rows]))
+            count = count + len(rows)
+            last = rows[-1]
+            await self.flush()
+        self.write(']')
+        if limit and count == limit:
+            args = [(name, self.get_argument(name)) for name in self.request.query_arguments
+                    if not name.startswith('page[')]
+            args.append(('page[limit]', str(limit)))
+            args.append(('page[after]', encode_cursor([last[serializer.index(key)] for key in keys])))
+            self.write(', "links": ' + json_encode({'next': url_concat(self.request.path, args)}))
+        self.write('}')
 
     async def post(self, cls):
-        """Create a new instance of the given ``cls``.
+        """Create a new instance of the given ``cls`` and publish it.
 
         :param cls: The class of object to create
         :type cls: class
         """
         logger.debug(f'POST {cls.__name__}')
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
+        async with self._sessionmaker() as session:
             async with session.begin():
                 obj = cls.from_jsonapi(self.request.body)
                 session.add(obj)
+            self._cache.changed()
+            await self._events.publish(SERIALIZERS[cls].type, {'action': 'create', 'data': obj.jsonapi()})
             self.write({'data': obj.jsonapi()})
         return obj
 
 
-class ItemHandler(RequestHandler):
+class ItemHandler(APIHandler):
     """Generic handler for a single JSONAPI item."""
 
-    def initialize(self, config):
-        """Initialise with the given ``config``.
-
-        :param config: The configuration to use
-        :type config: dict
-        """
-        self._config = config
-
     async def get(self, cls, id):
         """Fetch the entry of the given ``cls`` with the given ``id``.
 
@@ -88,7 +266,7 @@ class ItemHandler(RequestHandler):
         :type cls: class
         """
         logger.debug(f'GET {cls.__name__} {id}')
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
+        async with self._sessionmaker() as session:
             stmt = select(cls).filter(getattr(cls, 'id') == id)
             result = await session.execute(stmt)
             obj = result.scalars().first()
@@ -98,13 +276,13 @@ class ItemHandler(RequestHandler):
                 raise HTTPError(404)
 
     async def put(self, cls, id):
-        """Update the entry of the given ``cls`` with the given ``id``.
+        """Update the entry of the given ``cls`` with the given ``id`` and publish it.
 
         :param cls: The class of objects to fetch
         :type cls: class
         """
         logger.debug(f'PUT {cls.__name__} {id}')
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
+        async with self._sessionmaker() as session:
             async with session.begin():
                 stmt = select(cls).filter(getattr(cls, 'id') == id)
                 result = await session.execute(stmt)
@@ -112,94 +290,121 @@ class ItemHandler(RequestHandler):
                 if obj:
                     new_obj = cls.from_jsonapi(self.request.body)
                     obj.update(new_obj)
-                    self.write({'data': obj.jsonapi()})
                 else:
                     raise HTTPError(404)
+            self._cache.changed()
+            await self._events.publish(SERIALIZERS[cls].type, {'action': 'update', 'data': obj.jsonapi()})
+            self.write({'data': obj.jsonapi()})
 
 
 class DashboardCollectionHandler(CollectionHandler):
     """Collection handler for Dashboards.
 
-    This is currently implemented as a static API.
+    This is currently implemented as a static API. The totals can be restricted to a Category and its descendants
+    with the ``filter[category]`` argument.
     """
-    async def _month_total(self, month, direction, session):
-        stmt = select(func.sum(Transaction.amount)).filter(and_(
-            Transaction.direction == direction,
-            func.DATE(Transaction.date) >= func.DATE(month),
-            func.DATE(Transaction.date) < func.DATE((month + timedelta(days=33)).replace(day=1)),
-        ))
-        result = await session.execute(stmt)
-        return result.scalars().first()
-
-    async def _month_out_total(self, session):
-        pass
-
     async def get(self):
-        """Fetch all Dashboards."""
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
+        """Fetch all Dashboards.
+
+        The totals for the last three months are read from the monthly totals in a single query.
+        """
+        async with self._sessionmaker() as session:
             month_1 = date.today().replace(day=1)
             month_2 = (month_1 - timedelta(days=1)).replace(day=1)
             month_3 = (month_2 - timedelta(days=1)).replace(day=1)
-
+            stmt = select(MonthlyTotal.month, MonthlyTotal.direction, func.sum(MonthlyTotal.amount)).\
+                filter(and_(MonthlyTotal.month >= month_3,
+                            MonthlyTotal.month <= month_1,
+                            MonthlyTotal.direction.in_(('in', 'out')),
+                            MonthlyTotal.count > 0)).\
+                group_by(MonthlyTotal.month, MonthlyTotal.direction)
+            category_id = self.category_filter()
+            if category_id is not None:
+                stmt = stmt.filter(MonthlyTotal.category_id.in_(subtree(category_id)))
+            totals = {(month, direction): to_pounds(amount) for month, direction, amount in await session.execute(stmt)}
             self.write({
                 'data': [
                     {
                         'name': 'Account',
                         'labels': [month_3.strftime('%B'), month_2.strftime('%B'), month_1.strftime('%B')],
                         'income': [
-                            await self._month_total(month_3, 'in', session),
-                            await self._month_total(month_2, 'in', session),
-                            await self._month_total(month_1, 'in', session)
+                            totals.get((month_3, 'in')),
+                            totals.get((month_2, 'in')),
+                            totals.get((month_1, 'in'))
                         ],
                         'outgoing': [
-                            await self._month_total(month_3, 'out', session),
-                            await self._month_total(month_2, 'out', session),
-                            await self._month_total(month_1, 'out', session)
+                            totals.get((month_3, 'out')),
+                            totals.get((month_2, 'out')),
+                            totals.get((month_1, 'out'))
                         ],
                     }
                 ]
             })
 
 
+@stream_request_body
 class TransactionCollectionHandler(CollectionHandler):
-    """Collection handler for Transactions."""
+    """Collection handler for Transactions.
+
+    CSV uploads are streamed into a file in the ``jobs.directory``, so that memory use does not depend on the size of
+    the upload. The maximum upload size is set via ``importer.max_upload_size``. Once the upload is complete, the file
+    is imported by a background job and the job is returned. The statement format is detected from the upload's
+    header, unless the ``format`` argument names it.
+    """
+
+    def initialize(self, *args, **kwargs):
+        """Initialise the handler without an upload."""
+        super().initialize(*args, **kwargs)
+        self._upload = None
+
+    async def prepare(self):
+        """Open the file for a CSV upload."""
+        super().prepare()
+        if self.request.method == 'POST' and self.request.headers.get('Content-Type') == 'text/csv':
+            importer_config = self._config.get('importer', {})
+            self.request.connection.set_max_body_size(importer_config.get('max_upload_size', 1024 ** 3))
+            self._upload_path = self._jobs.upload_path()
+            self._upload = open(self._upload_path, 'wb')
+
+    def data_received(self, chunk):
+        """Write the next ``chunk`` of the upload to its file."""
+        if self._upload is not None:
+            self._upload.write(chunk)
+
+    def on_finish(self):
+        """Remove the file of an upload that was not submitted for import."""
+        if self._upload is not None:
+            self._upload.close()
+            os.remove(self._upload_path)
+            self._upload = None
+
+    def on_connection_close(self):
+        """Remove the file of an interrupted upload."""
+        super().on_connection_close()
+        self.on_finish()
 
     async def get(self):
-        """Fetch all Transactions."""
-        await super().get(Transaction, desc(Transaction.date))
+        """Fetch all Transactions.
+
+        If the ``filter[category]`` argument is set, only the Transactions in that Category or any of its
+        descendants are fetched. If the ``filter[q]`` argument is set, only the Transactions whose description
+        contains it are fetched.
+        """
+        condition = None
+        category_id = self.category_filter()
+        if category_id is not None:
+            condition = Transaction.category_id.in_(subtree(category_id))
+        await super().get(Transaction, [Transaction.date, Transaction.id], True, self.search(condition))
 
     async def post(self):
         """Add new Transactions."""
         logger.debug('POST Transaction')
-        if self.request.headers['Content-Type'] == 'text/csv':
-            async with create_sessionmaker(self._config['database']['dsn'])() as session:
-                async with session.begin():
-                    unclassified = (await session.execute(select(Category).
-                                    filter(Category.title == 'Uncategorised'))).scalars().first()
-                    for line in DictReader(StringIO(self.request.body.decode())):
-                        data = {
-                            'date': dateparser.parse(line['Date'], settings={'PREFER_DAY_OF_MONTH': 'last'}),
-                            'description': line['Description'],
-                            'initiator': line['Type']
-                        }
-                        if 'Money In' in line and line['Money In']:
-                            data['amount'] = float(line['Money In'])
-                            data['direction'] = 'in'
-                        elif ' Money Out' in line and line[' Money Out']:
-                            data['amount'] = float(line[' Money Out'])
-                            data['direction'] = 'out'
-                        if line['Type'] == 'TRANSFER':
-                            data['direction'] = 'trans'
-                        data['category_id'] = unclassified.id
-                        if 'amount' in data:
-                            stmt = select(Transaction).filter(and_(
-                                func.DATE(Transaction.date) == func.DATE(data['date']),
-                                Transaction.description == data['description'],
-                                Transaction.amount == data['amount'],
-                                Transaction.direction == data['direction']
-                            ))
-                            if (await session.execute(stmt)).scalars().first() is None:
-                                session.add(Transaction(**data))
+        if self._upload is not None:
+            self._upload.close()
+            self._upload = None
+            job = await self._jobs.submit('import', {'path': self._upload_path,
+                                                     'format': self.get_argument('format', default=None)})
+            self.write_job(job)
 
 
 class TransactionItemHandler(ItemHandler):
@@ -214,33 +419,46 @@ class UncategorisedTransactionCollectionHandler(CollectionHandler):
     """Collection handler for uncategorised Transactions."""
 
     async def get(self):
-        """Fetch all uncategorised Transactions."""
+        """Fetch all uncategorised Transactions, optionally restricted by the ``filter[q]`` search argument."""
         logger.debug('GET uncategorised Transaction')
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
-            stmt = select(Category).filter(Category.title == 'Uncategorised')
-            uncategorised = (await session.execute(stmt)).scalars().first()
-            if uncategorised:
-                stmt = select(Transaction).filter(Transaction.category_id == uncategorised.id).\
-                    order_by(desc(Transaction.date))
-                if self.get_argument('page[offset]', default=None):
-                    stmt = stmt.offset(int(self.get_argument('page[offset]', '0')))
-                    stmt = stmt.limit(int(self.get_argument('page[limit]', '30')))
-                result = await session.execute(stmt)
-                self.write({'data': [item.jsonapi() for item in result.scalars()]})
-            else:
-                self.write({'data': []})
+        uncategorised_id = (await self._cache.categories()).uncategorised_id
+        if uncategorised_id is not None:
+            stmt = uncategorised_transactions(uncategorised_id)
+            condition = self.search()
+            if condition is not None:
+                stmt = stmt.filter(condition)
+            async with self._sessionmaker() as session:
+                await self.write_page(session, stmt, SERIALIZERS[Transaction], [Transaction.date, Transaction.id], True)
+        else:
+            self.write({'data': []})
 
 
 class CategoriesCollectionHandler(CollectionHandler):
     """Collection handler for Categories."""
 
     async def get(self):
-        """Get all Categories."""
-        await super().get(Category)
+        """Get all Categories.
+
+        Unless a page is requested, the Categories are served from the cache.
+        """
+        if any(name.startswith('page[') for name in self.request.query_arguments):
+            await super().get(Category)
+        else:
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            self.write((await self._cache.categories()).body)
 
     async def post(self):
-        """Create a new Category."""
-        await super().post(Category)
+        """Create a new Category, add it to the ancestry index, and publish it."""
+        logger.debug('POST Category')
+        async with self._sessionmaker() as session:
+            async with session.begin():
+                category = Category.from_jsonapi(self.request.body)
+                session.add(category)
+                await session.flush()
+                await add_category(session, category)
+            self._cache.invalidate_categories()
+            await self._events.publish('categories', {'action': 'create', 'data': category.jsonapi()})
+            self.write({'data': category.jsonapi()})
 
 
 class CategoriesItemHandler(ItemHandler):
@@ -251,8 +469,29 @@ class CategoriesItemHandler(ItemHandler):
         await super().get(Category, id)
 
     async def put(self, id):
-        """Update a single Category with the given ``id``."""
-        await super().put(Category, id)
+        """Update a single Category with the given ``id`` and publish it.
+
+        If the parent changes, then the ancestry index is updated. Changes that would make the Category its own
+        ancestor are rejected.
+        """
+        logger.debug(f'PUT Category {id}')
+        async with self._sessionmaker() as session:
+            async with session.begin():
+                stmt = select(Category).filter(Category.id == id)
+                category = (await session.execute(stmt)).scalars().first()
+                if category:
+                    new_category = Category.from_jsonapi(self.request.body)
+                    if new_category.parent_id != category.parent_id:
+                        try:
+                            await move_category(session, category, new_category.parent_id)
+                        except CategoryCycleError:
+                            raise HTTPError(400)
+                    category.update(new_category)
+                else:
+                    raise HTTPError(404)
+            self._cache.invalidate_categories()
+            await self._events.publish('categories', {'action': 'update', 'data': category.jsonapi()})
+            self.write({'data': category.jsonapi()})
 
 
 class RulesCollectionHandler(CollectionHandler):
@@ -263,10 +502,154 @@ class RulesCollectionHandler(CollectionHandler):
         await super().get(Rule)
 
     async def post(self):
-        """Create a new Rule."""
-        rule = await super().post(Rule)
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
-            await apply_rule(session, rule)
+        """Create a new Rule.
+
+        The rules are then applied to the uncategorised transactions in the background.
+        """
+        await super().post(Rule)
+        self._cache.invalidate_rules()
+        await self._jobs.submit('apply-rules', {})
+
+
+class RulesPreviewHandler(CollectionHandler):
+    """Collection handler for previewing the Transactions that a Rule would match before it is saved."""
+
+    async def get(self):
+        """Fetch the Transactions that a Rule with the ``pattern`` argument would match.
+
+        The pattern is matched in the same way as when the Rules are applied. If the ``direction`` argument is set,
+        only Transactions in that direction are matched. If the ``filter[category]`` argument is set, only the
+        Transactions in that Category or any of its descendants are matched. The search index narrows down the
+        Transactions to those that contain the pattern's literal text, before the pattern itself is matched.
+        """
+        logger.debug('GET preview Rule')
+        try:
+            condition = pattern_condition(self.get_argument('pattern'), self._sessionmaker.kw['bind'].dialect.name)
+        except re.error:
+            raise HTTPError(400, 'Invalid pattern')
+        if self.get_argument('direction', default=None):
+            condition = and_(condition, Transaction.direction == self.get_argument('direction'))
+        category_id = self.category_filter()
+        if category_id is not None:
+            condition = and_(condition, Transaction.category_id.in_(subtree(category_id)))
+        await super().get(Transaction, [Transaction.date, Transaction.id], True, condition)
+
+
+class RulesApplyHandler(APIHandler):
+    """Handler for applying all Rules."""
+
+    async def post(self):
+        """Apply all Rules to the uncategorised transactions.
+
+        If the ``dry-run`` argument is set, then the number of transactions that each Rule would categorise is
+        returned without changing any transactions. Otherwise the Rules are applied by a background job, which is
+        returned.
+        """
+        logger.debug('POST apply Rules')
+        if self.get_argument('dry-run', default='false') == 'true':
+            categories = await self._cache.categories()
+            engine = await self._cache.rules()
+            async with self._sessionmaker() as session:
+                affected = await apply_rules(session, engine, categories.uncategorised_id, dry_run=True,
+                                             executor=self._executor)
+            self.write({'meta': {'affected': {str(key): value for key, value in affected.items()}}})
+        else:
+            self.write_job(await self._jobs.submit('apply-rules', {}))
+
+
+class JobItemHandler(ItemHandler):
+    """Item handler for background jobs.
+
+    Clients can either poll a job or, by accepting ``text/event-stream``, receive it as a server-sent ``job`` event
+    whenever its status or progress changes. The event stream ends once the job has completed or failed.
+    """
+
+    versioned = False
+
+    async def get(self, id):
+        """Get the job with the given ``id``."""
+        if 'text/event-stream' not in self.request.headers.get('Accept', ''):
+            await super().get(Job, id)
+            return
+        keepalive = self._config.get('events', {}).get('keepalive', 15)
+        subscription = await self._events.subscribe()
+        try:
+            async with self._sessionmaker() as session:
+                job = (await session.execute(select(Job).filter(Job.id == id))).scalars().first()
+            if job is None:
+                raise HTTPError(404)
+            self.set_header('Content-Type', 'text/event-stream')
+            self.set_header('Cache-Control', 'no-cache')
+            self.write(format_event('job', json_encode({'action': 'update', 'data': job.jsonapi()})))
+            await self.flush()
+            status = job.status
+            while status not in ('completed', 'failed') and not subscription.closed:
+                events = await subscription.get(keepalive)
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    async with self._sessionmaker() as session:
+                        job = (await session.execute(select(Job).filter(Job.id == id))).scalars().first()
+                    events.append((None, 'jobs', json_encode({'action': 'update', 'data': job.jsonapi()})))
+                for _, topic, payload in events:
+                    if topic == 'jobs':
+                        data = json_decode(payload)['data']
+                        if data['id'] == id:
+                            self.write(format_event('job', payload))
+                            status = data['attributes']['status']
+                if not events:
+                    self.write(': keepalive\n\n')
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self._events.unsubscribe(subscription)
+
+
+class EventsHandler(APIHandler):
+    """Handler for the stream of data change events.
+
+    The events are sent as server-sent events, with the event's topic as the event type. The data of each event is a
+    JSON object with the ``action`` that changed the data. Creating or updating a single item adds the item in JSONAPI
+    format as the ``data``, while bulk changes add their counts. The ``filter[topic]`` argument restricts the stream
+    to a comma-separated list of topics.
+
+    Clients that reconnect with a ``Last-Event-ID`` header, or an ``after`` argument, first receive the events that
+    they missed. If events were missed that are no longer stored, or if a client falls too far behind, a ``reset``
+    event is sent instead, after which the client should reload its data.
+    """
+
+    versioned = False
+
+    async def get(self):
+        """Stream the events until the client disconnects."""
+        after = self.request.headers.get('Last-Event-ID') or self.get_argument('after', default=None)
+        try:
+            after = int(after) if after else None
+        except ValueError:
+            raise HTTPError(400, 'Invalid Last-Event-ID')
+        topics = set(filter(None, self.get_argument('filter[topic]', default='').split(',')))
+        keepalive = self._config.get('events', {}).get('keepalive', 15)
+        subscription = await self._events.subscribe(after)
+        try:
+            self.set_header('Content-Type', 'text/event-stream')
+            self.set_header('Cache-Control', 'no-cache')
+            self.write(': connected\n\n')
+            await self.flush()
+            while not subscription.closed:
+                events = await subscription.get(keepalive)
+                if subscription.overflowed:
+                    subscription.overflowed = False
+                    self.write(format_event('reset', '{}', subscription.last_id))
+                for event_id, topic, payload in events:
+                    if not topics or topic in topics:
+                        self.write(format_event(topic, payload, event_id))
+                if not events:
+                    self.write(': keepalive\n\n')
+                await self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            self._events.unsubscribe(subscription)
 
 
 class AnalysisTimePeriodsCollectionHandler(CollectionHandler):
@@ -274,15 +657,15 @@ class AnalysisTimePeriodsCollectionHandler(CollectionHandler):
 
     async def get(self):
         """Get all analysis time-periods."""
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
-            stmt = select(Transaction.date)
+        async with self._sessionmaker() as session:
+            stmt = select(MonthlyTotal.month).filter(MonthlyTotal.count > 0).distinct()
             result = await session.execute(stmt)
             today = date.today()
             years = set()
             months = set()
-            for transaction in result.scalars():
-                years.add(str(transaction.year))
-                months.add(f'{transaction.year}-{transaction.month:02}')
+            for month in result.scalars():
+                years.add(str(month.year))
+                months.add(f'{month.year}-{month.month:02}')
             items = []
             tmp = list(months)
             tmp.sort(reverse=True)
@@ -312,46 +695,15 @@ class AnalysisTimePeriodsCollectionHandler(CollectionHandler):
 class AnalysisCollectionHandler(CollectionHandler):
     """Collection handler for the analysis"""
 
-    def initialize(self, config):
-        """Initialise with the given ``config``.
+    async def get(self):
+        """Get the analysis results.
 
-        :param config: The configuration to use
-        :type config: dict
+        By default the amounts are summed per top-level Category. If the ``filter[category]`` argument is set, then
+        the amounts are summed per child of that Category, with the Transactions directly in that Category listed
+        separately. Each sum includes all Transactions in the descendants and is computed in a single query over the
+        monthly totals, using the category ancestry index. The sums are computed in integer pence.
         """
-        super().initialize(config)
-        self._category_id_lists = {}
-
-    async def _get_category_ids(self, session, category_id):
-        if category_id in self._category_id_lists:
-            return self._category_id_lists[category_id]
-        else:
-            stmt = select(Category).filter(Category.id == category_id)
-            result = await session.execute(stmt)
-            category = result.scalars().first()
-            if category.parent_id is None:
-                self._category_id_lists[category_id] = [category.id]
-            else:
-                self._category_id_lists[category_id] = [category.id] + \
-                    await self._get_category_ids(session, category.parent_id)
-            return self._category_id_lists[category_id]
-
-    async def get(self):
-        """Get the analysis results."""
-        async with create_sessionmaker(self._config['database']['dsn'])() as session:
-            stmt = select(Category)
-            result = await session.execute(stmt)
-            categories = {}
-            for category in result.scalars():
-                if category.parent_id is None:
-                    categories[category.id] = {
-                        'type': 'analysis',
-                        'id': str(category.id),
-                        'attributes': {
-                            'title': category.title,
-                            'amount': 0
-                        }
-                    }
-            stmt = select(Transaction).filter(Transaction.direction == self.get_argument('filter[direction]'))
+        async with self._sessionmaker() as session:
             if '-' in self.get_argument('filter[timePeriod]'):
                 year, month = self.get_argument('filter[timePeriod]').split('-')
                 start_date = date(int(year), int(month), 1)
@@ -359,13 +711,71 @@ class AnalysisCollectionHandler(CollectionHandler):
             else:
                 start_date = date(int(self.get_argument('filter[timePeriod]')), 1, 1)
                 end_date = (start_date + timedelta(days=370)).replace(day=1)
-            stmt = stmt.filter(and_(Transaction.date >= start_date, Transaction.date < end_date))
+            category_id = self.category_filter()
+            stmt = period_totals(self.get_argument('filter[direction]'), start_date, end_date, category_id)
             result = await session.execute(stmt)
-            for transaction in result.scalars():
-                for category_id in await self._get_category_ids(session, transaction.category_id):
-                    if category_id in categories:
-                        categories[category_id]['attributes']['amount'] = \
-                            categories[category_id]['attributes']['amount'] + transaction.amount
-            items = [item for item in categories.values() if item['attributes']['amount'] > 0]
-            items.sort(key=lambda item: item['attributes']['amount'], reverse=True)
-            self.write({'data': items})
+            self.write({'data': [
+                {
+                    'type': 'analysis',
+                    'id': str(category_id),
+                    'attributes': {
+                        'title': title,
+                        'amount': to_pounds(total)
+                    }
+                } for category_id, title, total in result
+            ]})
+
+
+class AnalyticsHandler(APIHandler):
+    """Handler for time-bucketed analytics."""
+
+    async def get(self):
+        """Get the total amounts and numbers of Transactions per bucket, Category, and direction.
+
+        The ``bucket`` argument sets the bucket size to ``day``, ``week``, ``month`` (the default), or ``year``. The
+        ``filter[start]`` and ``filter[end]`` arguments set the first and last day of the period, which defaults to
+        all months with Transactions. The ``filter[direction]`` argument restricts the totals to one direction. The
+        Categories are grouped as in the analysis, either by top-level Category or by child of the Category in the
+        ``filter[category]`` argument. The totals are returned as one array per series, with one entry per bucket.
+        If the ``window`` argument is given, the amounts are the averages over that many buckets up to each bucket.
+        The number of buckets and the ``window`` are limited by ``analytics.max_buckets``. The totals are computed
+        by the ``analytics.backend``.
+        """
+        bucket = self.get_argument('bucket', default='month')
+        if bucket not in BUCKETS:
+            raise HTTPError(400, 'Invalid bucket')
+        try:
+            start_date = self.get_argument('filter[start]', default=None)
+            start_date = date.fromisoformat(start_date) if start_date else None
+            end_date = self.get_argument('filter[end]', default=None)
+            end_date = date.fromisoformat(end_date) if end_date else None
+        except ValueError:
+            raise HTTPError(400, 'Invalid filter[start] or filter[end] date')
+        if start_date is None or end_date is None:
+            first, last = await self._analytics.data_range()
+            start_date = start_date or first
+            end_date = end_date or last
+        if start_date is None or end_date is None:
+            self.write({'data': BucketTotals(bucket, start_date, end_date).jsonapi()})
+            return
+        if start_date > end_date:
+            raise HTTPError(400, 'The filter[start] date is after the filter[end] date')
+        max_buckets = self._config.get('analytics', {}).get('max_buckets', 5000)
+        if len(bucket_starts(start_date, end_date, bucket, max_buckets + 1)) > max_buckets:
+            raise HTTPError(400, f'More than {max_buckets} buckets')
+        window = None
+        try:
+            if self.get_argument('window', default=None):
+                window = int(self.get_argument('window'))
+        except ValueError:
+            raise HTTPError(400, 'Invalid window')
+        if window is not None and not 0 < window <= max_buckets:
+            raise HTTPError(400, f'The window must be between 1 and {max_buckets} buckets')
+        category_id = self.category_filter()
+        direction = self.get_argument('filter[direction]', None)
+        if window is None:
+            totals = await self._analytics.totals(bucket, start_date, end_date, direction, category_id)
+        else:
+            totals = await self._analytics.rolling_averages(bucket, start_date, end_date, window, direction,
+                                                            category_id)
+        self.write({'data': totals.jsonapi()})
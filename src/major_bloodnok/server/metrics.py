@@ -0,0 +1,77 @@
+"""Request instrumentation and the metrics handler."""
+from tornado.web import Application, OutputTransform, RequestHandler
+
+from ..metrics import current_timing, start_timing
+
+
+class ServerTimingTransform(OutputTransform):
+    """Output transform that times each request and reports its timing in a ``Server-Timing`` header.
+
+    The transform is created before the request is handled and starts the request's
+    :class:`~major_bloodnok.metrics.Timing`, which the handler inherits. The header reports the number of SQL
+    statements, the time spent in the database, and the total time up to the first byte of the response.
+    """
+
+    def __init__(self, request):
+        """Start the timing of the ``request``.
+
+        :param request: The request to time
+        :type request: :class:`~tornado.httputil.HTTPServerRequest`
+        """
+        super().__init__(request)
+        self._timing = start_timing()
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        """Add the ``Server-Timing`` header to the response."""
+        timing = self._timing
+        headers['Server-Timing'] = (f'db;dur={timing.db_time * 1000:.1f};desc="{timing.statements} SQL", '
+                                    f'app;dur={timing.elapsed * 1000:.1f}')
+        return status_code, headers, chunk
+
+
+class InstrumentedApplication(Application):
+    """Application that records the duration and the database work of every request in the ``metrics``.
+
+    Requests are labelled with the name of the handler class that handled them.
+    """
+
+    def __init__(self, handlers: list, metrics, **settings):
+        """Create a new application.
+
+        :param handlers: The routes of the application
+        :type handlers: list
+        :param metrics: The metrics to record the requests in
+        :type metrics: :class:`~major_bloodnok.metrics.Metrics`
+        """
+        super().__init__(handlers, transforms=[ServerTimingTransform], **settings)
+        self.metrics = metrics
+
+    def log_request(self, handler: RequestHandler):
+        """Log the completed request and record it in the metrics."""
+        super().log_request(handler)
+        timing = current_timing.get()
+        if timing is not None:
+            self.metrics.observe_request(type(handler).__name__, handler.request.method, handler.get_status(),
+                                         handler.request.request_time(), timing)
+
+
+class MetricsHandler(RequestHandler):
+    """Handler for the metrics in the Prometheus text format."""
+
+    def initialize(self, metrics):
+        """Initialise with the ``metrics`` to report.
+
+        :param metrics: The metrics of the server process
+        :type metrics: :class:`~major_bloodnok.metrics.Metrics`
+        """
+        self._metrics = metrics
+
+    def compute_etag(self):
+        """Disable the Etag, as the metrics change with every request."""
+        return None
+
+    def get(self):
+        """Get the current metrics."""
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.set_header('Cache-Control', 'no-store')
+        self.write(self._metrics.render())
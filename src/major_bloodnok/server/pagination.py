@@ -0,0 +1,64 @@
+"""Keyset pagination helpers."""
+import json
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from datetime import date
+from sqlalchemy import tuple_
+
+
+def encode_cursor(values: list) -> str:
+    """Encode the key ``values`` of the last item on a page into an opaque cursor.
+
+    :param values: The key values to encode
+    :type values: list
+    :return: The cursor
+    :rtype: str
+    """
+    data = [value.isoformat() if isinstance(value, date) else value for value in values]
+    return urlsafe_b64encode(json.dumps(data).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: list) -> list:
+    """Decode a ``cursor`` into the values of the ``keys``.
+
+    :param cursor: The cursor to decode
+    :type cursor: str
+    :param keys: The key columns that the cursor was created for
+    :type keys: list
+    :return: The key values
+    :rtype: list
+    :raises ValueError: If the cursor is not valid for the ``keys``
+    """
+    try:
+        data = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (BinasciiError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e
+    if not isinstance(data, list) or len(data) != len(keys):
+        raise ValueError(f'Invalid cursor {cursor}')
+    values = []
+    for key, value in zip(keys, data):
+        python_type = key.type.python_type
+        try:
+            if python_type is date:
+                values.append(date.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid cursor {cursor}') from e
+    return values
+
+
+def after_cursor(keys: list, values: list, descending: bool = False):
+    """Create the condition that selects the rows that come after the given key ``values``.
+
+    :param keys: The key columns that the rows are ordered by
+    :type keys: list
+    :param values: The key values of the last row of the previous page
+    :type values: list
+    :param descending: Whether the rows are ordered in descending order
+    :type descending: bool
+    """
+    if descending:
+        return tuple_(*keys) < tuple_(*values)
+    return tuple_(*keys) > tuple_(*values)
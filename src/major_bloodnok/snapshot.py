@@ -0,0 +1,327 @@
+"""In-memory columnar snapshot of the transactions.
+
+The snapshot holds one column per attribute that the analytics need: the id, the date as a day ordinal, the amount in
+pence, the index of the Category, and the code of the direction. If NumPy is installed, the columns are NumPy arrays,
+otherwise they are :mod:`array` buffers.
+"""
+import asyncio
+import json
+import logging
+
+from array import array
+from bisect import bisect_left, bisect_right
+from sqlalchemy import select
+
+from .cache import Cache
+from .events import EventBus
+from .models import Transaction
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+logger = logging.getLogger(__name__)
+
+
+LOAD_CHUNK_SIZE = 10000
+ID_CHUNK_SIZE = 500
+
+COLUMNS = (('ids', 'q'), ('days', 'i'), ('amounts', 'q'), ('categories', 'i'), ('directions', 'b'))
+
+
+def _empty(typecode: str):
+    if numpy is not None:
+        return numpy.zeros(0, dtype=typecode)
+    return array(typecode)
+
+
+def _extend(column, values: list):
+    """Return the ``column`` extended by the ``values``, which may be a new column."""
+    if numpy is not None:
+        return numpy.concatenate((column, numpy.array(values, dtype=column.dtype)))
+    column.extend(values)
+    return column
+
+
+class TransactionSnapshot(object):
+    """Columnar snapshot of all Transactions, which is kept up to date with the data change events.
+
+    The snapshot is loaded on first use. After that, it only loads the changes that the events published since then
+    describe: imported Transactions are appended, updated Transactions are reloaded, and after the Rules have been
+    applied the Categories of the uncategorised Transactions are reloaded. If the events since the last refresh are
+    no longer stored, or describe a change that cannot be applied, the snapshot is loaded again.
+
+    The Categories and directions are stored as indexes into :attr:`~TransactionSnapshot.category_ids` and
+    :attr:`~TransactionSnapshot.direction_names`. The rows are ordered by id.
+    """
+
+    def __init__(self, sessionmaker, cache: Cache, events: EventBus):
+        """Create a new, empty snapshot.
+
+        :param sessionmaker: The sessionmaker to load the Transactions with
+        :type sessionmaker: :class:`~sqlalchemy.orm.sessionmaker`
+        :param cache: The shared cache of Categories and Rules
+        :type cache: :class:`~major_bloodnok.cache.Cache`
+        :param events: The bus that the data change events are published on
+        :type events: :class:`~major_bloodnok.events.EventBus`
+        """
+        self._sessionmaker = sessionmaker
+        self._cache = cache
+        self._events = events
+        self._version = None
+        self._last_event_id = None
+        self._lock = asyncio.Lock()
+        for name, typecode in COLUMNS:
+            setattr(self, name, _empty(typecode))
+        self.category_ids = []
+        self.direction_names = []
+        self._category_indexes = {}
+        self._direction_codes = {}
+
+    def __len__(self) -> int:
+        """Return the number of Transactions in the snapshot."""
+        return len(self.ids)
+
+    def category_index(self, category_id: int) -> int:
+        """Return the index of the ``category_id``, adding it if it is new."""
+        idx = self._category_indexes.get(category_id)
+        if idx is None:
+            idx = len(self.category_ids)
+            self._category_indexes[category_id] = idx
+            self.category_ids.append(category_id)
+        return idx
+
+    def direction_code(self, direction: str) -> int:
+        """Return the code of the ``direction``, adding it if it is new."""
+        code = self._direction_codes.get(direction)
+        if code is None:
+            code = len(self.direction_names)
+            self._direction_codes[direction] = code
+            self.direction_names.append(direction)
+        return code
+
+    def find_direction(self, direction: str) -> int:
+        """Return the code of the ``direction`` or ``None`` if no Transaction has that direction."""
+        return self._direction_codes.get(direction)
+
+    async def refresh(self):
+        """Bring the snapshot up to date with the data change events.
+
+        The events version is read before the events are loaded, so that events published while refreshing cause the
+        next refresh to check again. The snapshot is only changed once all changes have been loaded, so that it can be
+        used while it is refreshed.
+        """
+        if self._events.version != self._version:
+            async with self._lock:
+                if self._events.version != self._version:
+                    await self._refresh(self._events.version)
+
+    async def _refresh(self, version: int):
+        if self._last_event_id is None:
+            await self._load(version)
+            return
+        events = await self._events.events_after(self._last_event_id)
+        if events and events[0][0] != self._last_event_id + 1:
+            logger.debug('Events since the last refresh are no longer stored')
+            await self._load(version)
+            return
+        appended = False
+        updated = set()
+        categorised = False
+        for _, topic, payload in events:
+            if topic != 'transactions':
+                continue
+            payload = json.loads(payload)
+            action = payload.get('action')
+            if action in ('create', 'import'):
+                appended = True
+            if action in ('create', 'update'):
+                updated.add(int(payload['data']['id']))
+            elif action == 'categorise':
+                categorised = True
+            elif action != 'import':
+                logger.debug(f'Cannot apply the {action} event')
+                await self._load(version)
+                return
+        new_rows = []
+        changed_rows = []
+        if appended or updated or categorised:
+            async with self._sessionmaker() as session:
+                last_id = int(self.ids[-1]) if len(self) else 0
+                if appended:
+                    stmt = self._select().filter(Transaction.id > last_id).order_by(Transaction.id)
+                    new_rows = list(await session.execute(stmt))
+                ids = [transaction_id for transaction_id in updated if transaction_id <= last_id]
+                if categorised:
+                    uncategorised_idx = self._category_indexes.get((await self._cache.categories()).uncategorised_id)
+                    if uncategorised_idx is not None:
+                        ids.extend(int(self.ids[idx]) for idx in self._positions(self.categories, uncategorised_idx))
+                for start in range(0, len(ids), ID_CHUNK_SIZE):
+                    stmt = self._select().filter(Transaction.id.in_(ids[start:start + ID_CHUNK_SIZE]))
+                    changed_rows.extend(await session.execute(stmt))
+        for row in changed_rows:
+            self._update(row)
+        self._append(new_rows)
+        if events:
+            self._last_event_id = events[-1][0]
+        self._version = version
+        logger.debug(f'Refreshed the snapshot with {len(new_rows)} new and {len(changed_rows)} changed rows')
+
+    def _select(self):
+        return select(Transaction.id, Transaction.date, Transaction.amount, Transaction.category_id,
+                      Transaction.direction)
+
+    async def _load(self, version: int):
+        """Load all Transactions into a new snapshot."""
+        last_event_id = await self._events.last_event_id()
+        snapshot = TransactionSnapshot(self._sessionmaker, self._cache, self._events)
+        async with self._sessionmaker() as session:
+            result = await session.stream(self._select().order_by(Transaction.id))
+            async for rows in result.partitions(LOAD_CHUNK_SIZE):
+                snapshot._append(rows)
+        for name, _ in COLUMNS:
+            setattr(self, name, getattr(snapshot, name))
+        self.category_ids = snapshot.category_ids
+        self.direction_names = snapshot.direction_names
+        self._category_indexes = snapshot._category_indexes
+        self._direction_codes = snapshot._direction_codes
+        self._last_event_id = last_event_id
+        self._version = version
+        logger.debug(f'Loaded the snapshot with {len(self)} rows')
+
+    def _append(self, rows: list):
+        """Append the ``(id, date, amount, category_id, direction)`` ``rows``, which must be ordered by id."""
+        if not rows:
+            return
+        values = ([], [], [], [], [])
+        for transaction_id, day, amount, category_id, direction in rows:
+            values[0].append(transaction_id)
+            values[1].append(day.toordinal())
+            values[2].append(amount)
+            values[3].append(self.category_index(category_id))
+            values[4].append(self.direction_code(direction))
+        for (name, _), column_values in zip(COLUMNS, values):
+            setattr(self, name, _extend(getattr(self, name), column_values))
+
+    def _update(self, row: tuple):
+        """Replace the values of the Transaction in the ``(id, date, amount, category_id, direction)`` ``row``."""
+        idx = bisect_left(self.ids, row[0])
+        if idx < len(self) and self.ids[idx] == row[0]:
+            self.days[idx] = row[1].toordinal()
+            self.amounts[idx] = row[2]
+            self.categories[idx] = self.category_index(row[3])
+            self.directions[idx] = self.direction_code(row[4])
+
+    def _positions(self, column, value: int) -> list:
+        """Return the positions of the rows whose ``column`` has the ``value``."""
+        if numpy is not None:
+            return numpy.flatnonzero(column == value).tolist()
+        return [idx for idx, column_value in enumerate(column) if column_value == value]
+
+    def find_category(self, category_id: int) -> int:
+        """Return the index of the ``category_id`` or ``None`` if no Transaction has that Category."""
+        return self._category_indexes.get(category_id)
+
+    def day_range(self) -> tuple:
+        """Return the first and last day ordinal of the Transactions or ``(None, None)`` if there are none."""
+        if not len(self):
+            return None, None
+        if numpy is not None:
+            return int(self.days.min()), int(self.days.max())
+        return min(self.days), max(self.days)
+
+    def bucket_sums(self, boundaries: list, last_day: int, groups: list, group_count: int, direction: int = None):
+        """Sum the amounts and count the Transactions per bucket, group of Categories, and direction.
+
+        The sums are returned in flat arrays, where the entry of a bucket, group, and direction is at the index
+        ``(bucket * group_count + group) * len(direction_names) + direction``. With NumPy the sums are computed with
+        :func:`numpy.bincount`, which sums in floating point, but is exact as long as the sums are below 2 ** 53 pence.
+
+        :param boundaries: The first day ordinal of each bucket, in ascending order
+        :type boundaries: list[int]
+        :param last_day: The last day ordinal to include
+        :type last_day: int
+        :param groups: The group of each Category index or -1 to exclude the Category
+        :type groups: list[int]
+        :param group_count: The number of groups
+        :type group_count: int
+        :param direction: The optional code of the direction to restrict the sums to
+        :type direction: int
+        :return: The ``(amounts, counts)`` arrays
+        :rtype: tuple
+        """
+        width = group_count * len(self.direction_names)
+        size = len(boundaries) * width
+        if numpy is not None:
+            mask = (self.days >= boundaries[0]) & (self.days <= last_day)
+            if direction is not None:
+                mask = mask & (self.directions == direction)
+            group = numpy.array(groups, dtype='i')[self.categories[mask]]
+            keep = group >= 0
+            bucket = numpy.searchsorted(numpy.array(boundaries), self.days[mask][keep], side='right') - 1
+            keys = (bucket * group_count + group[keep]) * len(self.direction_names) + self.directions[mask][keep]
+            amounts = numpy.bincount(keys, weights=self.amounts[mask][keep], minlength=size)
+            return numpy.rint(amounts).astype('q'), numpy.bincount(keys, minlength=size)
+        amounts = [0] * size
+        counts = [0] * size
+        first_day = boundaries[0]
+        buckets = {}
+        for day, amount, category, code in zip(self.days, self.amounts, self.categories, self.directions):
+            if first_day <= day <= last_day and (direction is None or code == direction) and groups[category] >= 0:
+                bucket = buckets.get(day)
+                if bucket is None:
+                    bucket = bisect_right(boundaries, day) - 1
+                    buckets[day] = bucket
+                key = (bucket * group_count + groups[category]) * len(self.direction_names) + code
+                amounts[key] = amounts[key] + amount
+                counts[key] = counts[key] + 1
+        return amounts, counts
+
+
+def rolling_means(sums, width: int, window: int):
+    """Compute the trailing means over ``window`` buckets of the flat ``sums`` with ``width`` entries per bucket.
+
+    Each mean is rounded to the nearest integer, with ties rounded to even. The buckets before the first bucket count
+    as zero.
+
+    :param sums: The sums in the layout returned by :meth:`~TransactionSnapshot.bucket_sums`
+    :param width: The number of entries per bucket
+    :type width: int
+    :param window: The number of buckets to average over
+    :type window: int
+    :return: The means in the same layout as the ``sums``
+    """
+    if numpy is not None:
+        cumulative = numpy.zeros((len(sums) // width + 1, width), dtype='q')
+        numpy.cumsum(numpy.reshape(sums, (-1, width)), axis=0, out=cumulative[1:])
+        totals = cumulative[1:] - cumulative[numpy.maximum(numpy.arange(1, len(cumulative)) - window, 0)]
+        return numpy.rint(totals / window).astype('q').reshape(-1)
+    means = [0] * len(sums)
+    for offset in range(width):
+        total = 0
+        for idx in range(offset, len(sums), width):
+            total = total + sums[idx]
+            if idx >= window * width:
+                total = total - sums[idx - window * width]
+            means[idx] = round(total / window)
+    return means
+
+
+def series(values, offset: int, width: int, start: int = 0) -> list:
+    """Return the entries of one series from the flat ``values`` as a list.
+
+    :param values: The values in the layout returned by :meth:`~TransactionSnapshot.bucket_sums`
+    :param offset: The offset of the series within each bucket
+    :type offset: int
+    :param width: The number of entries per bucket
+    :type width: int
+    :param start: The index of the first bucket to return
+    :type start: int
+    :rtype: list[int]
+    """
+    values = values[start * width + offset::width]
+    if numpy is not None:
+        return values.tolist()
+    return values